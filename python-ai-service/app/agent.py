@@ -1,11 +1,22 @@
 """
 AI Agent that processes natural language questions and generates ShopifyQL queries
 """
+import asyncio
+import copy
+import json
 import os
-from typing import Dict, Any
-from openai import OpenAI
+import time
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional, Tuple
+from app.cache import AnswerCache, TTLCache, normalize_question
+from app.intent_classifier import IntentClassifier
+from app.llm import LLMClient
+from app.metrics import REQUESTS_IN_FLIGHT, Timings, stage
+from app.planner import FETCH_FIELDS, FusedPlanner
 from app.shopify_client import ShopifyClient
+from app.singleflight import SingleFlight
+from app.webhooks import WEBHOOK_TOPICS
 from app.query_generator import QueryGenerator
+from app.query_templates import render_query
 from app.response_formatter import ResponseFormatter
 
 class AnalyticsAgent:
@@ -16,60 +27,478 @@ class AnalyticsAgent:
     3. Generate ShopifyQL
     4. Execute query
     5. Format response
+
+    A single instance is created per process (see the lifespan handler in
+    main.py) so the LLM and Shopify clients keep their pooled connections
+    warm across requests.
     """
     
-    def __init__(self):
-        api_key = os.getenv("OPENAI_API_KEY", "")
-        self.llm_client = OpenAI(api_key=api_key) if api_key else None
-        self.shopify_client = ShopifyClient()
-        self.query_generator = QueryGenerator(self.llm_client) if self.llm_client else None
-        self.response_formatter = ResponseFormatter(self.llm_client) if self.llm_client else None
+    def __init__(
+        self,
+        llm_client: Optional[LLMClient] = None,
+        shopify_client: Optional[ShopifyClient] = None
+    ):
+        self.llm_client = llm_client or LLMClient.from_env()
+        self.shopify_client = shopify_client or ShopifyClient()
+        self.query_generator = QueryGenerator(self.llm_client)
+        # PIPELINE_MODE=fused plans intent and query in a single LLM round trip
+        self.pipeline_mode = os.getenv("PIPELINE_MODE", "sequential")
+        self.planner = (
+            FusedPlanner(self.llm_client)
+            if self.llm_client and self.pipeline_mode == "fused"
+            else None
+        )
+        # Questions the local classifier is confident about skip the intent
+        # LLM call; INTENT_LOCAL_THRESHOLD above 1 always asks the LLM
+        self.intent_classifier = IntentClassifier.from_env()
+        self.intent_threshold = float(os.getenv("INTENT_LOCAL_THRESHOLD", "0.8"))
+        # LLM classifications are appended here as training data for the
+        # local model (python -m app.intent_classifier train ...)
+        self.intent_log_path = os.getenv("INTENT_LOG_PATH", "")
+        # Planning results keyed by normalized question; a hit skips both LLM calls
+        self.intent_cache = TTLCache(
+            max_size=int(os.getenv("INTENT_CACHE_SIZE", "2048")),
+            ttl=float(os.getenv("INTENT_CACHE_TTL", "3600"))
+        )
+        # Complete responses keyed by store, canonical intent and data version
+        self.answer_cache = AnswerCache.from_env()
+        # Identical questions in flight for a store share one pipeline run
+        self.question_flights = SingleFlight()
+        # Webhook deliveries already applied, by (store, X-Shopify-Webhook-Id);
+        # Shopify retries failed deliveries for up to 48 hours
+        self.webhook_deliveries = TTLCache(
+            max_size=int(os.getenv("WEBHOOK_DEDUP_SIZE", "100000")),
+            ttl=float(os.getenv("WEBHOOK_DEDUP_TTL", "172800"))
+        )
+        # The formatter is always available: without an LLM it still computes
+        # insights and template-based answers
+        self.response_formatter = ResponseFormatter(self.llm_client)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        Hit/miss counters for the agent's caches and in-flight coalescing
+        """
+        return {
+            "intent": self.intent_cache.stats(),
+            "answer": self.answer_cache.stats(),
+            "coalescing": {
+                "questions": self.question_flights.stats(),
+                "data": self.shopify_client.data_flights.stats()
+            },
+            "views": self.shopify_client.views.stats() if self.shopify_client.views is not None else None
+        }
+    
+    def start(self) -> None:
+        """
+        Start background work (materialized view refreshes); called from the lifespan handler
+        """
+        self.shopify_client.start()
+    
+    def invalidate_store(self, store_id: str, data_type: Optional[str] = None) -> None:
+        """
+        Forget cached answers and materialized views for a store, or only
+        those built from one data type
+        """
+        self.answer_cache.invalidate(store_id, data_type)
+        if self.shopify_client.views is not None:
+            self.shopify_client.views.invalidate(store_id, data_type)
+    
+    async def handle_webhook(
+        self,
+        store_id: str,
+        topic: str,
+        webhook_id: Optional[str],
+        payload: Dict[str, Any]
+    ) -> bool:
+        """
+        Apply a verified webhook: update the store's local data, then drop
+        the answers and views it may have changed. Returns False for a
+        delivery already handled (Shopify retries reuse X-Shopify-Webhook-Id).
+        """
+        resource, data_types = WEBHOOK_TOPICS[topic]
+        delivery = (store_id, webhook_id)
+        if webhook_id:
+            if self.webhook_deliveries.get(delivery) is not None:
+                return False
+            # Claimed before processing so a concurrent retry is skipped too
+            self.webhook_deliveries.set(delivery, True)
+        try:
+            await self.shopify_client.apply_webhook(store_id, resource, payload)
+        except Exception:
+            # Let Shopify's retry of this delivery be processed
+            if webhook_id:
+                self.webhook_deliveries.delete(delivery)
+            raise
+        for data_type in data_types:
+            self.invalidate_store(store_id, data_type)
+        return True
+    
+    async def aclose(self) -> None:
+        """
+        Release pooled connections held by the LLM and Shopify clients
+        """
+        if self.llm_client is not None:
+            await self.llm_client.aclose()
+        await self.shopify_client.aclose()
     
     async def process_question(self, question: str, store_id: str) -> Dict[str, Any]:
         """
-        Main processing pipeline for user questions
+        Main processing pipeline for user questions. Concurrent requests for
+        the same store and normalized question share one pipeline run.
+        metadata.timings has the milliseconds spent per stage; a request that
+        joined another's run only reports its total.
         """
+        timings = Timings()
+        key = (store_id, normalize_question(question))
+        with timings.activate(), REQUESTS_IN_FLIGHT.labels("analyze").track_inprogress():
+            response = copy.deepcopy(
+                await self.question_flights.do(key, lambda: self._process_question(question, store_id))
+            )
+        if "original_question" in response.get("metadata", {}):
+            response["metadata"]["original_question"] = question
+        return timings.finish(response, "analyze")
+    
+    async def _process_question(self, question: str, store_id: str) -> Dict[str, Any]:
+        fetch_task = None
         try:
-            # Step 1: Understand intent and classify question
-            if self.llm_client:
-                intent = await self._understand_intent(question)
-            else:
-                # Fallback intent without LLM
-                intent = self._simple_intent_classification(question)
+            # Steps 1-2: Understand intent and generate the ShopifyQL query.
+            # In fused mode the data fetch is already running when this returns.
+            intent, query, fetch_task = await self._plan(question, store_id)
             
-            # Step 2: Generate ShopifyQL query
-            if self.query_generator:
-                query = await self.query_generator.generate_query(question, intent)
-            else:
-                query = "FROM orders SELECT * LIMIT 10"
+            # An equivalent question was answered recently for this store
+            with stage("cache_lookup"):
+                cached_response = await self._cached_answer(question, store_id, intent, query)
+            if cached_response is not None:
+                return cached_response
             
-            # Step 3: Execute query against Shopify
-            data = await self.shopify_client.execute_query(store_id, query, intent)
+            # Step 3: Fetch the data and execute the query over it
+            with stage("execute"):
+                if fetch_task is not None:
+                    data = await self.shopify_client.run_query(store_id, query, await fetch_task)
+                else:
+                    data = await self.shopify_client.execute_query(store_id, query, intent)
             
             # Step 4: Format response in business-friendly language
-            if self.response_formatter:
-                formatted_response = await self.response_formatter.format_response(
-                    question, intent, data, query
-                )
-            else:
-                formatted_response = self._simple_response_format(question, intent, data, query)
+            return await self._respond(question, store_id, intent, query, data)
+            
+        except Exception as e:
+            return self._error_response(e)
+        finally:
+            if fetch_task is not None and not fetch_task.done():
+                fetch_task.cancel()
+    
+    async def process_batch(self, questions: List[str], store_id: str) -> List[Dict[str, Any]]:
+        """
+        Answer several questions about one store.
+
+        Questions are planned concurrently, then grouped by the intent fields
+        the data fetch depends on, so each group fetches its data once and
+        runs every member's query over it. Formatting runs concurrently too.
+        Results come back in input order; a question that fails gets the
+        usual error response (metadata.error set) without affecting the others.
+        Each result has its own metadata.timings; a shared fetch is counted
+        in every member's execute stage.
+        """
+        with REQUESTS_IN_FLIGHT.labels("batch").track_inprogress():
+            timings = [Timings() for _ in questions]
+            results = await self._process_batch(questions, store_id, timings)
+        return [timing.finish(result, "batch") for timing, result in zip(timings, results)]
+    
+    async def _process_batch(
+        self,
+        questions: List[str],
+        store_id: str,
+        timings: List[Timings]
+    ) -> List[Dict[str, Any]]:
+        async def plan(index: int) -> Tuple[Dict[str, Any], str, Optional[asyncio.Task]]:
+            with timings[index].activate():
+                return await self._plan(questions[index], store_id, prefetch=False)
+        
+        plans = await asyncio.gather(
+            *(plan(index) for index in range(len(questions))),
+            return_exceptions=True
+        )
+        results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+        groups: Dict[Tuple, List[int]] = {}
+        for index, (question, plan) in enumerate(zip(questions, plans)):
+            if isinstance(plan, Exception):
+                results[index] = self._error_response(plan)
+                continue
+            intent, query, _ = plan
+            with timings[index].stage("cache_lookup"):
+                cached_response = await self._cached_answer(question, store_id, intent, query)
+            if cached_response is not None:
+                results[index] = cached_response
+                continue
+            groups.setdefault(tuple(intent.get(field) for field in FETCH_FIELDS), []).append(index)
+        
+        async def answer(index: int, data: Dict[str, Any]) -> None:
+            intent, query, _ = plans[index]
+            try:
+                with timings[index].activate():
+                    # run_query attaches its own query_result, so each question
+                    # gets a shallow copy of the shared fetch
+                    with stage("execute"):
+                        data = await self.shopify_client.run_query(store_id, query, dict(data))
+                    results[index] = await self._respond(questions[index], store_id, intent, query, data)
+            except Exception as e:
+                results[index] = self._error_response(e)
+        
+        async def answer_group(indexes: List[int]) -> None:
+            intent, query, _ = plans[indexes[0]]
+            started = time.perf_counter()
+            try:
+                if len(indexes) == 1:
+                    # A lone question streams its data straight into its query
+                    data = await self.shopify_client.fetch_data(store_id, intent, query)
+                else:
+                    data = await self.shopify_client.fetch_data(store_id, intent)
+            except Exception as e:
+                for index in indexes:
+                    results[index] = self._error_response(e)
+                return
+            finally:
+                for index in indexes:
+                    timings[index].add("execute", time.perf_counter() - started)
+            await asyncio.gather(*(answer(index, data) for index in indexes))
+        
+        await asyncio.gather(*(answer_group(indexes) for indexes in groups.values()))
+        return results
+    
+    async def stream_question(self, question: str, store_id: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Streaming variant of process_question yielding (event, payload) pairs
+        as each stage completes: "intent", "query", "insights", one "answer"
+        per streamed text delta, then "done" with the complete response.
+        A failure yields "error" with the usual error response instead.
+        """
+        timings = Timings()
+        intent_ready = asyncio.get_running_loop().create_future()
+        
+        def on_intent(intent: Dict[str, Any]) -> None:
+            if not intent_ready.done():
+                intent_ready.set_result(copy.deepcopy(intent))
+        
+        async def plan() -> Tuple[Dict[str, Any], str, Optional[asyncio.Task]]:
+            # Activated inside the task: a context variable set in this
+            # generator would leak into the caller between yields
+            with timings.activate():
+                return await self._plan(question, store_id, on_intent=on_intent)
+        
+        in_flight = REQUESTS_IN_FLIGHT.labels("stream")
+        in_flight.inc()
+        plan_task = asyncio.create_task(plan())
+        fetch_task = None
+        try:
+            # The intent is usually known well before the query is generated
+            await asyncio.wait({plan_task, intent_ready}, return_when=asyncio.FIRST_COMPLETED)
+            if intent_ready.done():
+                yield "intent", {"intent": intent_ready.result()}
+            intent, query, fetch_task = await plan_task
+            yield "query", {"query": query}
             
-            # Pass question to formatter for better fallback answers
-            if hasattr(formatted_response, 'get') and formatted_response.get('answer'):
-                # Ensure question is available in metadata for fallback
-                if 'metadata' in formatted_response:
-                    formatted_response['metadata']['original_question'] = question
+            with timings.stage("cache_lookup"):
+                cached_response = await self._cached_answer(question, store_id, intent, query)
+            if cached_response is not None:
+                yield "answer", {"delta": cached_response["answer"]}
+                yield "done", timings.finish(cached_response, "stream")
+                return
             
-            return formatted_response
+            with timings.stage("execute"):
+                if fetch_task is not None:
+                    data = await self.shopify_client.run_query(store_id, query, await fetch_task)
+                else:
+                    data = await self.shopify_client.execute_query(store_id, query, intent)
             
-        except Exception as e:
-            # Fallback response on error
-            return {
-                "answer": f"I encountered an error processing your question: {str(e)}. Please try rephrasing or contact support.",
-                "confidence": "low",
-                "query_used": None,
-                "metadata": {"error": str(e)}
+            formatter = self.response_formatter
+            data_type = data.get("type", "general")
+            with timings.stage("insights"):
+                insights = formatter._calculate_insights(
+                    data_type, data.get("data", []), intent, data.get("query_result"), data.get("insights")
+                )
+            yield "insights", {"data_type": data_type, "insights": insights}
+            
+            # Includes the time the client takes to read each delta
+            deltas = []
+            answer_started = time.perf_counter()
+            async for delta in formatter.stream_answer(question, insights, data_type):
+                deltas.append(delta)
+                yield "answer", {"delta": delta}
+            timings.add("answer", time.perf_counter() - answer_started)
+            
+            formatted_response = {
+                "answer": "".join(deltas).strip(),
+                "confidence": intent.get("confidence", "medium"),
+                "query_used": query,
+                "metadata": formatter.response_metadata(data, intent)
             }
+            formatted_response["metadata"]["original_question"] = question
+            self.answer_cache.set(await self._answer_key(store_id, intent, query), copy.deepcopy(formatted_response))
+            yield "done", timings.finish(formatted_response, "stream")
+        
+        except Exception as e:
+            yield "error", timings.finish(self._error_response(e), "stream")
+        finally:
+            in_flight.dec()
+            if not plan_task.done():
+                plan_task.cancel()
+            if fetch_task is not None and not fetch_task.done():
+                fetch_task.cancel()
+    
+    async def _answer_key(self, store_id: str, intent: Dict[str, Any], query: str) -> Any:
+        """
+        Answer cache key, with the time period resolved in the store's timezone
+        """
+        window = await self.shopify_client.date_range(store_id, intent)
+        return self.answer_cache.key(store_id, intent, query, window)
+    
+    async def _cached_answer(
+        self,
+        question: str,
+        store_id: str,
+        intent: Dict[str, Any],
+        query: str
+    ) -> Optional[Dict[str, Any]]:
+        cached_response = self.answer_cache.get(await self._answer_key(store_id, intent, query))
+        if cached_response is None:
+            return None
+        formatted_response = copy.deepcopy(cached_response)
+        formatted_response["metadata"]["original_question"] = question
+        formatted_response["metadata"]["cached"] = True
+        return formatted_response
+    
+    async def _respond(
+        self,
+        question: str,
+        store_id: str,
+        intent: Dict[str, Any],
+        query: str,
+        data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Format the response for fetched data and remember it in the answer cache
+        """
+        if self.llm_client:
+            formatted_response = await self.response_formatter.format_response(
+                question, intent, data, query
+            )
+        else:
+            formatted_response = self._simple_response_format(question, intent, data, query)
+        
+        # Pass question to formatter for better fallback answers
+        if hasattr(formatted_response, 'get') and formatted_response.get('answer'):
+            # Ensure question is available in metadata for fallback
+            if 'metadata' in formatted_response:
+                formatted_response['metadata']['original_question'] = question
+        
+        self.answer_cache.set(await self._answer_key(store_id, intent, query), copy.deepcopy(formatted_response))
+        return formatted_response
+    
+    def _error_response(self, error: Exception) -> Dict[str, Any]:
+        # Fallback response on error
+        return {
+            "answer": f"I encountered an error processing your question: {str(error)}. Please try rephrasing or contact support.",
+            "confidence": "low",
+            "query_used": None,
+            "metadata": {"error": str(error)}
+        }
+    
+    async def _plan(
+        self,
+        question: str,
+        store_id: str,
+        prefetch: bool = True,
+        on_intent: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Tuple[Dict[str, Any], str, Optional[asyncio.Task]]:
+        """
+        Resolve the intent and ShopifyQL for a question, from the intent cache
+        when an equivalent question was planned recently. prefetch=False keeps
+        the fused planner from starting its own data fetch. on_intent is
+        called with the intent as soon as it is known, which in the
+        sequential pipeline is before the query has been generated.
+        """
+        cache_key = normalize_question(question)
+        cached = self.intent_cache.get(cache_key)
+        if cached is not None:
+            intent, query = copy.deepcopy(cached)
+            if on_intent is not None:
+                on_intent(intent)
+            return intent, query, None
+        
+        fetch_task = None
+        with stage("intent"):
+            local_intent = self.intent_classifier.classify(question)
+        confident = local_intent["confidence_score"] >= self.intent_threshold
+        plan = None
+        if self.planner and not confident:
+            with stage("plan"):
+                plan = await self._plan_fused(question, store_id, prefetch)
+        if plan:
+            intent, query, fetch_task = plan
+            if on_intent is not None:
+                on_intent(intent)
+        else:
+            # Step 1: Understand intent and classify question, locally when
+            # the classifier is confident or there is no LLM
+            if self.llm_client and not confident:
+                with stage("intent"):
+                    intent = await self._understand_intent(question)
+                self._log_intent(question, intent)
+            else:
+                intent = local_intent
+            if on_intent is not None:
+                on_intent(intent)
+            
+            # Step 2: Generate ShopifyQL query, from a template when one matches
+            with stage("query"):
+                query = await self.query_generator.generate_query(question, intent)
+        
+        # Low confidence usually means the LLM call failed and a default intent
+        # was returned; don't pin that answer for the whole TTL
+        if intent.get("confidence") != "low":
+            self.intent_cache.set(cache_key, copy.deepcopy((intent, query)))
+        return intent, query, fetch_task
+    
+    async def _plan_fused(
+        self,
+        question: str,
+        store_id: str,
+        prefetch: bool = True
+    ) -> Optional[Tuple[Dict[str, Any], str, Optional[asyncio.Task]]]:
+        """
+        Classify and generate the query in one LLM call, starting the data
+        fetch as soon as the intent fields it needs have been streamed.
+        Returns None when the fused plan fails so the caller can fall back
+        to the sequential pipeline.
+        """
+        fetch_task = None
+        
+        def start_fetch(fetch_intent: Dict[str, Any]) -> None:
+            nonlocal fetch_task
+            fetch_task = asyncio.create_task(
+                self.shopify_client.fetch_data(store_id, fetch_intent)
+            )
+        
+        try:
+            plan = await self.planner.plan(question, on_intent=start_fetch if prefetch else None)
+        except BaseException:
+            if fetch_task is not None:
+                fetch_task.cancel()
+            raise
+        
+        if plan is None:
+            if fetch_task is not None:
+                fetch_task.cancel()
+            return None
+        
+        intent, query = plan
+        # Prefer the template query so the same question always runs the same query
+        query = render_query(question, intent) or query
+        if fetch_task is None and prefetch:
+            fetch_task = asyncio.create_task(
+                self.shopify_client.fetch_data(store_id, intent)
+            )
+        return intent, query, fetch_task
     
     async def _understand_intent(self, question: str) -> Dict[str, Any]:
         """
@@ -98,8 +527,7 @@ Example response:
 Only return the JSON object, no additional text."""
 
         try:
-            response = self.llm_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4"),
+            response = await self.llm_client.complete(
                 messages=[
                     {"role": "system", "content": "You are an expert at analyzing business questions and extracting intent. Always respond with valid JSON only."},
                     {"role": "user", "content": prompt}
@@ -108,7 +536,6 @@ Only return the JSON object, no additional text."""
                 max_tokens=200
             )
             
-            import json
             intent_data = json.loads(response.choices[0].message.content)
             return intent_data
             
@@ -122,45 +549,18 @@ Only return the JSON object, no additional text."""
                 "confidence": "low"
             }
     
-    def _simple_intent_classification(self, question: str) -> Dict[str, Any]:
+    def _log_intent(self, question: str, intent: Dict[str, Any]) -> None:
         """
-        Simple rule-based intent classification when LLM is not available
+        Append an LLM classification to INTENT_LOG_PATH for training
         """
-        question_lower = question.lower()
-        
-        if any(word in question_lower for word in ["inventory", "stock", "reorder", "units", "available"]):
-            intent_type = "inventory"
-        elif any(word in question_lower for word in ["sales", "revenue", "selling", "top", "products"]):
-            intent_type = "sales"
-        elif any(word in question_lower for word in ["customer", "repeat", "orders"]):
-            intent_type = "customers"
-        else:
-            intent_type = "general"
-        
-        # Extract time period
-        time_period = None
-        if "last week" in question_lower or "past week" in question_lower:
-            time_period = "last week"
-        elif "last month" in question_lower or "past month" in question_lower:
-            time_period = "last month"
-        elif "next week" in question_lower:
-            time_period = "next week"
-        elif "next month" in question_lower:
-            time_period = "next month"
-        elif "90 days" in question_lower or "last 90" in question_lower:
-            time_period = "last 90 days"
-        elif "30 days" in question_lower or "last 30" in question_lower:
-            time_period = "last 30 days"
-        elif "7 days" in question_lower or "last 7" in question_lower:
-            time_period = "last 7 days"
-        
-        return {
-            "intent_type": intent_type,
-            "time_period": time_period,
-            "metrics": [],
-            "product_mentioned": None,
-            "confidence": "medium"
-        }
+        if not self.intent_log_path or intent.get("confidence") == "low":
+            return
+        record = {"question": question, "intent_type": intent.get("intent_type")}
+        try:
+            with open(self.intent_log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError:
+            pass
     
     def _simple_response_format(
         self,
@@ -174,25 +574,23 @@ Only return the JSON object, no additional text."""
         Use the response formatter's fallback method
         """
         # Use response formatter even if LLM is not available
-        from app.response_formatter import ResponseFormatter
-        formatter = ResponseFormatter(None)  # No LLM client
+        formatter = self.response_formatter
         
         # Calculate insights
         data_type = data.get("type", "general")
         raw_data = data.get("data", [])
-        insights = formatter._calculate_insights(data_type, raw_data, intent)
+        query_result = data.get("query_result")
+        with stage("insights"):
+            insights = formatter._calculate_insights(data_type, raw_data, intent, query_result, data.get("insights"))
         
         # Generate fallback answer
-        answer = formatter._generate_fallback_answer(insights, data_type, question)
+        with stage("answer"):
+            answer = formatter._generate_fallback_answer(insights, data_type, question)
         
         return {
             "answer": answer,
             "confidence": intent.get("confidence", "medium"),
             "query_used": query,
-            "metadata": {
-                "data_type": data_type,
-                "records_analyzed": len(raw_data),
-                "intent": intent
-            }
+            "metadata": formatter.response_metadata(data, intent)
         }
 
@@ -0,0 +1,240 @@
+"""
+Mergeable aggregate state for computing insights page by page
+"""
+import heapq
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.columnar import columnar_enabled, inventory_totals
+
+
+class SpaceSaving:
+    """
+    Space-Saving top-k sketch: at most `capacity` counters. When a new key
+    arrives at capacity it takes over the smallest counter, so a reported
+    count overestimates the true count by at most that counter's error.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[Any, int] = {}
+        self.errors: Dict[Any, int] = {}
+        # Lazy min-heap of (count, key); stale entries are skipped on pop
+        self._heap: List[Tuple[int, Any]] = []
+
+    def add(self, key: Any, amount: int = 1) -> None:
+        counts = self.counts
+        if key in counts:
+            counts[key] += amount
+        elif len(counts) < self.capacity:
+            counts[key] = amount
+            self.errors[key] = 0
+        else:
+            floor, victim = self._pop_min()
+            del counts[victim]
+            del self.errors[victim]
+            counts[key] = floor + amount
+            self.errors[key] = floor
+        heapq.heappush(self._heap, (counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, k) for k, count in counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[int, Any]:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return count, key
+
+    def merge(self, other: "SpaceSaving") -> None:
+        for key, count in other.counts.items():
+            self.add(key, count)
+
+    def items(self) -> Iterable[Tuple[Any, int]]:
+        return self.counts.items()
+
+
+class InsightAggregate:
+    """
+    Base for aggregates that are updated with pages of records, merged
+    across partitions and finalized into the insights dict
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def update(self, records: List[Dict[str, Any]]) -> "InsightAggregate":
+        self.count += len(records)
+        return self
+
+    def merge(self, other: "InsightAggregate") -> "InsightAggregate":
+        self.count += other.count
+        return self
+
+    def finalize(self, intent: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "message": "Data retrieved but analysis needed",
+            "record_count": self.count
+        }
+
+
+class SalesAggregate(InsightAggregate):
+    """
+    Revenue, order count and units per product. Product quantities are an
+    exact map, or a Space-Saving sketch when top_k_capacity is set
+    (INSIGHTS_TOPK_CAPACITY) to bound memory for very large catalogs.
+    """
+
+    def __init__(self, top_k_capacity: Optional[int] = None):
+        super().__init__()
+        if top_k_capacity is None:
+            top_k_capacity = int(os.getenv("INSIGHTS_TOPK_CAPACITY", "0"))
+        self.revenue = 0.0
+        self.products = SpaceSaving(top_k_capacity) if top_k_capacity > 0 else None
+        self.product_sales: Dict[str, int] = {}
+
+    def update(self, orders: List[Dict[str, Any]]) -> "SalesAggregate":
+        super().update(orders)
+        product_sales = self.product_sales
+        sketch = self.products
+        for order in orders:
+            self.revenue += float(order.get("total_price", 0))
+            for line_item in order.get("line_items", []):
+                product_title = line_item.get("title", "Unknown")
+                quantity = int(line_item.get("quantity", 0))
+                if sketch is not None:
+                    sketch.add(product_title, quantity)
+                else:
+                    product_sales[product_title] = product_sales.get(product_title, 0) + quantity
+        return self
+
+    def merge(self, other: "SalesAggregate") -> "SalesAggregate":
+        super().merge(other)
+        self.revenue += other.revenue
+        if self.products is not None and other.products is not None:
+            self.products.merge(other.products)
+        else:
+            for product_title, quantity in other.product_sales.items():
+                self.product_sales[product_title] = self.product_sales.get(product_title, 0) + quantity
+        return self
+
+    def finalize(self, intent: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.count:
+            return super().finalize(intent)
+        items = self.products.items() if self.products is not None else self.product_sales.items()
+        # nlargest matches sorted(..., reverse=True)[:5], ties included
+        top_products = heapq.nlargest(5, items, key=lambda x: x[1])
+        return {
+            "total_revenue": self.revenue,
+            "total_orders": self.count,
+            "avg_order_value": self.revenue / self.count,
+            "top_products": top_products,
+            "time_period": intent.get("time_period", "specified period")
+        }
+
+
+class InventoryAggregate(InsightAggregate):
+    """
+    Available, incoming and committed totals
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.available = 0
+        self.incoming = 0
+        self.committed = 0
+
+    def update(self, levels: List[Dict[str, Any]]) -> "InventoryAggregate":
+        super().update(levels)
+        if columnar_enabled(len(levels)):
+            available, incoming, committed = inventory_totals(levels)
+        else:
+            available = sum(int(level.get("available", 0)) for level in levels)
+            incoming = sum(int(level.get("incoming", 0)) for level in levels)
+            committed = sum(int(level.get("committed", 0)) for level in levels)
+        self.available += available
+        self.incoming += incoming
+        self.committed += committed
+        return self
+
+    def merge(self, other: "InventoryAggregate") -> "InventoryAggregate":
+        super().merge(other)
+        self.available += other.available
+        self.incoming += other.incoming
+        self.committed += other.committed
+        return self
+
+    def finalize(self, intent: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.count:
+            return super().finalize(intent)
+        return {
+            "total_available": self.available,
+            "total_incoming": self.incoming,
+            "total_committed": self.committed,
+            "net_available": self.available - self.committed + self.incoming,
+            "product_count": self.count
+        }
+
+
+class CustomerAggregate(InsightAggregate):
+    """
+    Customer count, repeat-customer count and the top repeat customers,
+    keeping only the best `limit` customers seen so far
+    """
+
+    def __init__(self, limit: int = 5):
+        super().__init__()
+        self.limit = limit
+        self.repeat_count = 0
+        # Min-heap of (orders_count, -position, position, customer); position
+        # keeps ties in arrival order like a stable sort
+        self._top: List[Tuple[int, int, int, Dict[str, Any]]] = []
+
+    def update(self, customers: List[Dict[str, Any]]) -> "CustomerAggregate":
+        offset = self.count
+        super().update(customers)
+        for index, customer in enumerate(customers):
+            orders_count = customer.get("orders_count", 0)
+            if orders_count > 1:
+                self.repeat_count += 1
+                self._offer(orders_count, offset + index, customer)
+        return self
+
+    def _offer(self, orders_count: int, position: int, customer: Dict[str, Any]) -> None:
+        entry = (orders_count, -position, position, customer)
+        if len(self._top) < self.limit:
+            heapq.heappush(self._top, entry)
+        elif entry[:2] > self._top[0][:2]:
+            heapq.heapreplace(self._top, entry)
+
+    def merge(self, other: "CustomerAggregate") -> "CustomerAggregate":
+        offset = self.count
+        super().merge(other)
+        self.repeat_count += other.repeat_count
+        for orders_count, _, position, customer in other._top:
+            self._offer(orders_count, offset + position, customer)
+        return self
+
+    def finalize(self, intent: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.count:
+            return super().finalize(intent)
+        ranked = sorted(self._top, key=lambda entry: (-entry[0], entry[2]))
+        return {
+            "total_customers": self.count,
+            "repeat_customers_count": self.repeat_count,
+            "repeat_customers": [entry[3] for entry in ranked]
+        }
+
+
+AGGREGATES = {
+    "sales": SalesAggregate,
+    "inventory": InventoryAggregate,
+    "customers": CustomerAggregate,
+}
+
+
+def aggregate_for(data_type: str) -> InsightAggregate:
+    """
+    Fresh aggregate for a data type; types without insights only count records
+    """
+    return AGGREGATES.get(data_type, InsightAggregate)()
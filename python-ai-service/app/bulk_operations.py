@@ -0,0 +1,265 @@
+"""
+GraphQL Bulk Operations queries and JSONL result assembly
+"""
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+RUN_BULK_QUERY = """
+mutation RunBulkQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+CANCEL_BULK_OPERATION = """
+mutation CancelBulkOperation($id: ID!) {
+  bulkOperationCancel(id: $id) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+BULK_OPERATION_STATUS = """
+query BulkOperationStatus($id: ID!) {
+  node(id: $id) {
+    ... on BulkOperation { id status errorCode objectCount url }
+  }
+}
+"""
+
+# Bulk queries per resource. Nested connections (line items, inventory
+# levels) come back as separate JSONL lines carrying __parentId.
+BULK_QUERIES = {
+    "orders": """
+{
+  orders%(filter)s {
+    edges {
+      node {
+        id
+        name
+        createdAt
+        updatedAt
+        totalPriceSet { shopMoney { amount } }
+        customer { email firstName lastName }
+        lineItems {
+          edges {
+            node {
+              title
+              quantity
+              originalUnitPriceSet { shopMoney { amount } }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+""",
+    "customers": """
+{
+  customers%(filter)s {
+    edges {
+      node {
+        id
+        email
+        firstName
+        lastName
+        numberOfOrders
+        amountSpent { amount }
+        createdAt
+        updatedAt
+      }
+    }
+  }
+}
+""",
+    "inventory_levels": """
+{
+  inventoryItems {
+    edges {
+      node {
+        id
+        variant { product { title } }
+        inventoryLevels {
+          edges {
+            node {
+              location { id }
+              quantities(names: ["available", "incoming", "committed"]) { name quantity }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+""",
+}
+
+
+class BulkOperationError(Exception):
+    """
+    Raised when a bulk operation cannot be started or does not complete
+    """
+
+
+class BulkOperationTimeout(BulkOperationError):
+    """
+    Raised when a bulk operation is still running after SHOPIFY_BULK_TIMEOUT
+    """
+
+
+class BulkOperationBusy(BulkOperationError):
+    """
+    Raised instead of starting a bulk operation while the shop already has
+    one running; Shopify allows one bulk query per shop at a time
+    """
+
+
+def is_busy_error(user_errors: List[Dict[str, Any]]) -> bool:
+    """
+    Whether bulkOperationRunQuery userErrors say another bulk query is
+    already running for the shop (e.g. one started by another worker)
+    """
+    return any("already in progress" in (error.get("message") or "") for error in user_errors)
+
+
+def build_bulk_query(resource: str, search: Optional[str] = None) -> str:
+    """
+    Render the bulk query for a resource with an optional search filter,
+    e.g. "created_at:>='2024-01-01T00:00:00Z'"
+    """
+    if resource not in BULK_QUERIES:
+        raise BulkOperationError(f"Bulk ingestion is not supported for {resource}")
+    filter_clause = f"(query: {json.dumps(search)})" if search else ""
+    return BULK_QUERIES[resource] % {"filter": filter_clause}
+
+
+def legacy_id(gid: Optional[str]) -> Optional[int]:
+    """
+    Numeric id from a GraphQL global id such as gid://shopify/Order/123
+    """
+    if not gid:
+        return None
+    tail = str(gid).rsplit("/", 1)[-1]
+    return int(tail) if tail.isdigit() else None
+
+
+def _amount(money: Optional[Dict[str, Any]]) -> str:
+    if not money:
+        return "0.00"
+    return str((money.get("shopMoney") or money).get("amount", "0.00"))
+
+
+class _RecordAssembler:
+    """
+    Turns JSONL lines into the REST-shaped records the insight code reads.
+
+    Bulk results list each parent before its children, so only the
+    current parent is held in memory.
+    """
+
+    def __init__(self, resource: str):
+        self.resource = resource
+        self.parent: Optional[Dict[str, Any]] = None
+        self.parent_gid: Optional[str] = None
+
+    def feed(self, row: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Consume one JSONL object and return any records that are now complete
+        """
+        parent_gid = row.get("__parentId")
+        if parent_gid is not None:
+            if parent_gid == self.parent_gid:
+                return self._add_child(row)
+            return []
+
+        finished = self.flush()
+        if self.resource == "orders":
+            self.parent = {
+                "id": legacy_id(row.get("id")),
+                "order_number": row.get("name"),
+                "total_price": _amount(row.get("totalPriceSet")),
+                "created_at": row.get("createdAt"),
+                "updated_at": row.get("updatedAt"),
+                "line_items": [],
+                "customer": {
+                    "email": (row.get("customer") or {}).get("email"),
+                    "first_name": (row.get("customer") or {}).get("firstName"),
+                    "last_name": (row.get("customer") or {}).get("lastName"),
+                } if row.get("customer") else None,
+            }
+            self.parent_gid = row.get("id")
+        elif self.resource == "customers":
+            finished.append({
+                "id": legacy_id(row.get("id")),
+                "email": row.get("email"),
+                "first_name": row.get("firstName"),
+                "last_name": row.get("lastName"),
+                "orders_count": int(row.get("numberOfOrders") or 0),
+                "total_spent": _amount(row.get("amountSpent")),
+                "created_at": row.get("createdAt"),
+                "updated_at": row.get("updatedAt"),
+            })
+        elif self.resource == "inventory_levels":
+            # The item itself is not a record; its levels are
+            self.parent = {
+                "inventory_item_id": legacy_id(row.get("id")),
+                "product_title": (((row.get("variant") or {}).get("product") or {}).get("title")) or "Unknown",
+            }
+            self.parent_gid = row.get("id")
+        return finished
+
+    def _add_child(self, row: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self.resource == "orders":
+            self.parent["line_items"].append({
+                "title": row.get("title", "Unknown"),
+                "quantity": int(row.get("quantity") or 0),
+                "price": _amount(row.get("originalUnitPriceSet")),
+            })
+            return []
+
+        quantities = {q.get("name"): int(q.get("quantity") or 0) for q in row.get("quantities") or []}
+        return [{
+            "inventory_item_id": self.parent["inventory_item_id"],
+            "location_id": legacy_id((row.get("location") or {}).get("id")),
+            "available": quantities.get("available", 0),
+            "incoming": quantities.get("incoming", 0),
+            "committed": quantities.get("committed", 0),
+            "product_title": self.parent["product_title"],
+        }]
+
+    def flush(self) -> List[Dict[str, Any]]:
+        """
+        Emit the pending parent record, if it is itself a record
+        """
+        finished = []
+        if self.parent is not None and self.resource == "orders":
+            finished.append(self.parent)
+        self.parent = None
+        self.parent_gid = None
+        return finished
+
+
+async def iter_bulk_records(
+    lines: AsyncIterator[str],
+    resource: str,
+    page_size: int
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Stream-parse a bulk JSONL result into pages of records
+    """
+    assembler = _RecordAssembler(resource)
+    page: List[Dict[str, Any]] = []
+    async for line in lines:
+        if not line.strip():
+            continue
+        page.extend(assembler.feed(json.loads(line)))
+        if len(page) >= page_size:
+            yield page
+            page = []
+    page.extend(assembler.flush())
+    if page:
+        yield page
@@ -0,0 +1,193 @@
+"""
+In-process caches for planning results and answers
+"""
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, Optional
+
+from app.time_periods import NUMBER_WORDS, DateRange, period_key
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical cache key for a question.
+
+    Case, punctuation and whitespace are folded away. Numbers (including
+    spelled-out ones) are replaced by a slot marker in the text and their
+    values appended, so "Top 5 products?" and "top five products" share a
+    key while "top 10 products" does not.
+    """
+    text = _PUNCTUATION.sub(" ", question.lower().replace("'", ""))
+    words = [str(NUMBER_WORDS[word]) if word in NUMBER_WORDS else word for word in text.split()]
+    text = " ".join(words)
+    slots = _NUMBER.findall(text)
+    template = _NUMBER.sub("#", text)
+    return f"{template}|{','.join(slots)}" if slots else template
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries also expire after a time-to-live
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the cached value, or None if missing or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store a value, evicting the least recently used entry when full
+        """
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Hit/miss counters for monitoring
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class AnswerCache:
+    """
+    Cache of complete analyze responses.
+
+    Keys combine the store, the canonical intent, the normalized query and a
+    per-store data-version stamp. Invalidating a store (or one of its data
+    types) bumps the stamp, so stale entries become unreachable immediately
+    and age out of the LRU on their own.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 4096,
+        default_ttl: float = 300.0,
+        ttls: Optional[Dict[str, float]] = None
+    ):
+        self._cache = TTLCache(max_size=max_size, ttl=default_ttl)
+        self.ttls = ttls or {}
+        self._versions: Dict[Hashable, int] = {}
+
+    @classmethod
+    def from_env(cls) -> "AnswerCache":
+        """
+        Build the cache from ANSWER_CACHE_* environment variables.
+
+        ANSWER_CACHE_TTLS is a comma-separated list of intent=seconds pairs,
+        e.g. "inventory=60,sales=300,customers=3600".
+        """
+        ttls = {}
+        for pair in os.getenv(
+            "ANSWER_CACHE_TTLS",
+            "inventory=60,sales=300,customers=3600,products=900"
+        ).split(","):
+            if "=" in pair:
+                intent_type, seconds = pair.split("=", 1)
+                ttls[intent_type.strip()] = float(seconds)
+        return cls(
+            max_size=int(os.getenv("ANSWER_CACHE_SIZE", "4096")),
+            default_ttl=float(os.getenv("ANSWER_CACHE_TTL", "300")),
+            ttls=ttls
+        )
+
+    def key(
+        self,
+        store_id: str,
+        intent: Dict[str, Any],
+        query: str,
+        window: Optional[DateRange] = None
+    ) -> Hashable:
+        """
+        Canonical key for an answer; window is the date range the intent's
+        time period resolved to for this store, if any
+        """
+        intent_type = intent.get("intent_type", "general")
+        product = intent.get("product_mentioned")
+        return (
+            store_id,
+            intent_type,
+            _resolved_window(intent.get("time_period"), window),
+            product.strip().lower() if isinstance(product, str) else None,
+            tuple(sorted(str(m).lower() for m in intent.get("metrics") or [])),
+            " ".join((query or "").split()),
+            self._versions.get(store_id, 0),
+            self._versions.get((store_id, intent_type), 0),
+        )
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        return self._cache.get(key)
+
+    def set(self, key: Hashable, response: Dict[str, Any]) -> None:
+        self._cache.set(key, response, ttl=self.ttls.get(key[1]))
+
+    def invalidate(self, store_id: str, data_type: Optional[str] = None) -> None:
+        """
+        Drop cached answers for a store, or only those of one data type
+        """
+        version_key = (store_id, data_type) if data_type else store_id
+        self._versions[version_key] = self._versions.get(version_key, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+def _resolved_window(time_period: Optional[str], window: Optional[DateRange]) -> Hashable:
+    """
+    The period's canonical form and its concrete range, so "last 7 days"
+    asked today and tomorrow do not share an answer. Periods that did not
+    resolve are anchored to the current UTC day instead.
+    """
+    if window is not None:
+        return period_key(time_period), window.start, window.end
+    return period_key(time_period), datetime.now(timezone.utc).date().isoformat()
@@ -0,0 +1,217 @@
+"""
+Columnar (NumPy) insight computation for large order and inventory sets
+"""
+import os
+from collections import OrderedDict
+from itertools import chain, repeat
+from typing import Any, Dict, Hashable, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency; insights fall back to Python loops
+    np = None
+
+
+def columnar_available() -> bool:
+    return np is not None
+
+
+def columnar_enabled(row_count: int) -> bool:
+    """
+    Whether a record set is large enough for the columnar path to pay off.
+    COLUMNAR_MIN_ROWS=0 disables it.
+    """
+    threshold = int(os.getenv("COLUMNAR_MIN_ROWS", "5000"))
+    return np is not None and threshold > 0 and row_count >= threshold
+
+
+def _column(records: List[Dict[str, Any]], field: str, default: Any, convert, dtype) -> "np.ndarray":
+    """
+    One field of every record as an array, with the per-record work done by
+    map() in C rather than a Python loop
+    """
+    values = map(convert, map(dict.get, records, repeat(field), repeat(default)))
+    return np.fromiter(values, dtype=dtype, count=len(records))
+
+
+def _cents(records: List[Dict[str, Any]], field: str) -> "np.ndarray":
+    """
+    Decimal price strings to integer cents
+    """
+    return np.rint(_column(records, field, "0", float, np.float64) * 100).astype(np.int64)
+
+
+class SalesColumns:
+    """
+    Per-product partial sales totals: the order count, revenue in integer
+    cents and the quantity sold per product. Product titles are interned
+    into integer codes in first-seen order, so code order matches the
+    insertion order of the dict-based calculation. Memory is O(distinct
+    products), independent of the number of orders or line items.
+    """
+
+    def __init__(self, count: int, revenue_cents: int, quantities: "np.ndarray", titles: List[str]):
+        self.count = count
+        self.revenue_cents = revenue_cents
+        self.quantities = quantities
+        self.titles = titles
+
+    @classmethod
+    def from_orders(cls, orders: List[Dict[str, Any]]) -> "SalesColumns":
+        return ColumnarSalesAggregate().update(orders).columns()
+
+    def appended(self, orders: List[Dict[str, Any]]) -> "SalesColumns":
+        """
+        New totals with orders added, converting only the new orders; this
+        instance is left unchanged
+        """
+        return ColumnarSalesAggregate.from_columns(self).update(orders).columns()
+
+    def top_products(self, limit: int = 5) -> List[tuple]:
+        """
+        (title, quantity) for the best sellers, ties broken by first appearance
+        """
+        quantities = self.quantities
+        if len(quantities) == 0:
+            return []
+        if len(quantities) > limit:
+            # Everything tied with the k-th largest quantity is a candidate;
+            # the exact order among candidates is settled by lexsort
+            kth = np.partition(quantities, len(quantities) - limit)[len(quantities) - limit]
+            candidates = np.flatnonzero(quantities >= kth)
+        else:
+            candidates = np.arange(len(quantities))
+        ranked = candidates[np.lexsort((candidates, -quantities[candidates]))][:limit]
+        return [(self.titles[code], int(quantities[code])) for code in ranked]
+
+
+class ColumnarSalesAggregate:
+    """
+    Sales aggregate that converts each page of orders to arrays as it
+    arrives and folds them into per-product totals, so only the page being
+    converted is held as arrays. Title codes are shared across pages;
+    merging remaps the other aggregate's codes. Finalizes to the same
+    insights as SalesAggregate.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.revenue_cents = 0
+        self._codes: Dict[str, int] = {}
+        self._quantities = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_columns(cls, columns: SalesColumns) -> "ColumnarSalesAggregate":
+        aggregate = cls()
+        aggregate.count = columns.count
+        aggregate.revenue_cents = columns.revenue_cents
+        aggregate._codes = {title: code for code, title in enumerate(columns.titles)}
+        aggregate._quantities = columns.quantities.copy()
+        return aggregate
+
+    def _grow(self) -> None:
+        """
+        Extend the quantity totals to cover newly interned titles
+        """
+        if len(self._quantities) < len(self._codes):
+            quantities = np.zeros(len(self._codes), dtype=np.int64)
+            quantities[:len(self._quantities)] = self._quantities
+            self._quantities = quantities
+
+    def update(self, orders: List[Dict[str, Any]]) -> "ColumnarSalesAggregate":
+        self.count += len(orders)
+        self.revenue_cents += int(_cents(orders, "total_price").sum())
+        items = list(chain.from_iterable(map(dict.get, orders, repeat("line_items"), repeat(()))))
+        titles = list(map(dict.get, items, repeat("title"), repeat("Unknown")))
+        codes = self._codes
+        # dict.fromkeys keeps first-seen order
+        for title in dict.fromkeys(titles):
+            if title not in codes:
+                codes[title] = len(codes)
+        self._grow()
+        line_product = np.fromiter(map(codes.__getitem__, titles), dtype=np.int32, count=len(titles))
+        line_quantity = _column(items, "quantity", 0, int, np.int64)
+        self._quantities += np.bincount(
+            line_product, weights=line_quantity, minlength=len(codes)
+        ).astype(np.int64)
+        return self
+
+    def merge(self, other: "ColumnarSalesAggregate") -> "ColumnarSalesAggregate":
+        self.count += other.count
+        self.revenue_cents += other.revenue_cents
+        remap = np.fromiter(
+            (self._codes.setdefault(title, len(self._codes)) for title in other._codes),
+            dtype=np.int32,
+            count=len(other._codes)
+        )
+        self._grow()
+        # Codes are unique, so fancy-index addition does not drop repeats
+        self._quantities[remap] += other._quantities
+        return self
+
+    def columns(self) -> SalesColumns:
+        return SalesColumns(
+            count=self.count,
+            revenue_cents=self.revenue_cents,
+            quantities=self._quantities,
+            titles=list(self._codes)
+        )
+
+    def finalize(self, intent: Dict[str, Any]) -> Dict[str, Any]:
+        return sales_insights(self.columns(), intent)
+
+
+class ColumnCache:
+    """
+    Small LRU of per-product sales totals keyed by (store_id, data
+    version, date range), so a store's orders are converted once per sync
+    rather than once per question. Each entry is O(distinct products).
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or int(os.getenv("COLUMNAR_CACHE_SIZE", "8"))
+        self._entries: "OrderedDict[Hashable, SalesColumns]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[SalesColumns]:
+        columns = self._entries.get(key)
+        if columns is not None:
+            self._entries.move_to_end(key)
+        return columns
+
+    def items(self) -> List[tuple]:
+        return list(self._entries.items())
+
+    def set(self, key: Hashable, columns: SalesColumns) -> None:
+        self._entries[key] = columns
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def sales_insights(columns: SalesColumns, intent: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Same result as the dict-based sales insights, from the per-product totals
+    """
+    total_orders = columns.count
+    if not total_orders:
+        return {"message": "Data retrieved but analysis needed", "record_count": 0}
+    total_revenue = columns.revenue_cents / 100
+    return {
+        "total_revenue": total_revenue,
+        "total_orders": total_orders,
+        "avg_order_value": total_revenue / total_orders,
+        "top_products": columns.top_products(5),
+        "time_period": intent.get("time_period", "specified period")
+    }
+
+
+def inventory_totals(levels: List[Dict[str, Any]]) -> tuple:
+    """
+    (available, incoming, committed) totals from an (n, 3) array
+    """
+    quantities = np.stack([
+        _column(levels, "available", 0, int, np.int64),
+        _column(levels, "incoming", 0, int, np.int64),
+        _column(levels, "committed", 0, int, np.int64),
+    ], axis=1)
+    return tuple(int(total) for total in quantities.sum(axis=0))
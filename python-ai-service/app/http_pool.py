@@ -0,0 +1,23 @@
+"""
+Shared HTTP connection pool settings for outbound clients
+"""
+import os
+import httpx
+
+
+def http_limits() -> httpx.Limits:
+    """
+    Connection pool limits shared by the OpenAI and Shopify HTTP clients
+    """
+    return httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+    )
+
+
+def http_timeout() -> httpx.Timeout:
+    """
+    Default timeout for outbound HTTP requests
+    """
+    return httpx.Timeout(float(os.getenv("HTTP_TIMEOUT", "30")), connect=5.0)
@@ -0,0 +1,315 @@
+"""
+Local intent classification: keyword patterns plus an optional TF-IDF
+linear model trained from logged questions
+"""
+import json
+import math
+import os
+import random
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.time_periods import NUMBER_WORDS
+
+INTENT_TYPES = ["inventory", "sales", "customers", "products", "general"]
+
+# Keyword patterns per intent, compiled once into a single alternation.
+# Weights are log-odds style votes: strong cues (inventory, repeat customer)
+# outweigh generic ones (orders, products).
+_KEYWORDS = {
+    "inventory": [
+        (r"inventory", 2.0), (r"in stock", 2.0), (r"stock(?:ed)?", 1.5), (r"reorder", 2.0),
+        (r"restock", 2.0), (r"out of stock", 2.5), (r"run(?:ning)? out", 2.0),
+        (r"available", 1.0), (r"on hand", 1.5), (r"incoming", 1.0), (r"committed", 1.0),
+        (r"units", 1.0), (r"(?:will|do|should) i need", 2.0),
+    ],
+    "sales": [
+        (r"sales", 1.5), (r"sold", 1.5), (r"selling", 1.5), (r"sell", 1.5), (r"revenue", 2.0),
+        (r"best[- ]?sellers?", 2.0), (r"(?:worst|bottom)[- ]?sell(?:ers?|ing)", 2.0),
+        (r"top (?:(?:\d+|%s) )?(?:selling )?products?" % "|".join(NUMBER_WORDS), 2.5),
+        (r"(?:most|least) popular", 2.0), (r"income", 1.0),
+        (r"average order value", 2.0), (r"aov", 2.0), (r"earn(?:ed|ings)?", 1.0),
+        (r"how much (?:money|did i make)", 2.0),
+    ],
+    "customers": [
+        (r"customers?", 2.0), (r"repeat", 1.5), (r"returning", 1.5), (r"loyal", 1.5),
+        (r"buyers?", 1.0), (r"shoppers?", 1.0), (r"who (?:bought|ordered|purchased)", 1.5),
+        (r"lifetime value", 1.5), (r"clv|ltv", 1.5),
+    ],
+    "products": [
+        (r"catalog(?:ue)?", 2.0), (r"vendors?", 1.5), (r"product types?", 2.0),
+        (r"variants?", 1.5), (r"how many products", 1.5), (r"list (?:my |all )?products", 2.0),
+    ],
+}
+
+# Softmax temperature over keyword votes: a lone weight-2.0 cue scores 0.84,
+# a lone weight-1.0 cue 0.42
+KEYWORD_TEMPERATURE = 0.5
+
+_KEYWORD_PATTERN = re.compile(
+    "|".join(
+        f"(?P<{intent}_{index}>\\b(?:{pattern})\\b)"
+        for intent, patterns in _KEYWORDS.items()
+        for index, (pattern, _) in enumerate(patterns)
+    )
+)
+_KEYWORD_WEIGHTS = {
+    f"{intent}_{index}": (intent, weight)
+    for intent, patterns in _KEYWORDS.items()
+    for index, (_, weight) in enumerate(patterns)
+}
+
+_METRICS = [
+    ("revenue", re.compile(r"\b(?:revenue|sales|income|earn\w*|money|\$)")),
+    ("units", re.compile(r"\b(?:units?|quantity|quantities|sold|sell\w*|stock|inventory)\b")),
+    ("orders", re.compile(r"\borders?\b")),
+    ("aov", re.compile(r"\b(?:average order value|aov)\b")),
+    ("customers", re.compile(r"\b(?:customers?|buyers?|shoppers?)\b")),
+]
+
+_PERIOD = re.compile(
+    r"\b(last|past|previous|next|coming|this)\s+(?:(\d+|%s)\s+)?(day|week|month|quarter|year)s?\b"
+    % "|".join(NUMBER_WORDS)
+)
+_NAMED_PERIOD = re.compile(r"\b(today|yesterday|year to date|ytd|month to date|mtd)\b")
+
+_QUOTED = re.compile(r"\"([^\"]{2,60})\"|“([^”]{2,60})”|‘([^’]{2,60})’|(?<!\w)'([^']{2,60})'(?!\w)")
+# A capitalized name after "of/for/about", e.g. "units of Blue Mug will I need"
+_NAMED_PRODUCT = re.compile(
+    r"\b(?:of|for|about|on)\s+((?:[A-Z0-9][\w&'-]*)(?:\s+[A-Z0-9][\w&'-]*)*)"
+)
+
+_TOKEN = re.compile(r"[a-z0-9$]+")
+
+
+class IntentClassifier:
+    """
+    Classifies questions into the same schema the LLM produces, with a
+    numeric confidence_score in [0, 1].
+
+    Keyword votes give a score per intent; when a trained model is loaded
+    its probabilities are blended in. The score of the winning intent is
+    its probability after a softmax over votes, so it is meaningful to
+    threshold against. Callers skip the LLM when it is high enough.
+    """
+
+    def __init__(self, model: Optional[Dict[str, Any]] = None, model_weight: float = 0.6):
+        self.model = model
+        self.model_weight = model_weight
+
+    @classmethod
+    def from_env(cls) -> "IntentClassifier":
+        """
+        Keyword-only, plus the model at INTENT_MODEL_PATH when it exists
+        """
+        path = os.getenv("INTENT_MODEL_PATH", "")
+        model = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                model = json.load(f)
+        return cls(model)
+
+    def classify(self, question: str) -> Dict[str, Any]:
+        probabilities = self._keyword_probabilities(question)
+        if self.model is not None:
+            learned = predict_proba(self.model, question)
+            probabilities = {
+                intent: (1 - self.model_weight) * probabilities.get(intent, 0.0)
+                + self.model_weight * learned.get(intent, 0.0)
+                for intent in INTENT_TYPES
+            }
+        intent_type = max(INTENT_TYPES, key=lambda intent: probabilities.get(intent, 0.0))
+        score = probabilities.get(intent_type, 0.0)
+        return {
+            "intent_type": intent_type,
+            "time_period": extract_time_period(question),
+            "metrics": extract_metrics(question),
+            "product_mentioned": extract_product(question),
+            "confidence": "high" if score >= 0.8 else "medium" if score >= 0.5 else "low",
+            "confidence_score": round(score, 3),
+        }
+
+    def _keyword_probabilities(self, question: str) -> Dict[str, float]:
+        votes = Counter()
+        for match in _KEYWORD_PATTERN.finditer(question.lower()):
+            intent, weight = _KEYWORD_WEIGHTS[match.lastgroup]
+            votes[intent] += weight
+        # "general" holds a constant prior vote, so a single weak cue stays
+        # uncertain while one strong or several agreeing cues score above 0.8
+        votes["general"] += 1.0
+        return _softmax({intent: votes[intent] for intent in INTENT_TYPES}, KEYWORD_TEMPERATURE)
+
+
+def extract_time_period(question: str) -> Optional[str]:
+    """
+    The period phrase normalized the way the LLM writes it, e.g.
+    "last 7 days", "last week", "next month"
+    """
+    text = question.lower()
+    match = _PERIOD.search(text)
+    if match:
+        direction, count, unit = match.groups()
+        direction = {"past": "last", "previous": "last", "coming": "next"}.get(direction, direction)
+        if count is None or direction == "this":
+            return f"{direction} {unit}"
+        count = int(NUMBER_WORDS.get(count, count))
+        return f"{direction} {count} {unit}{'s' if count != 1 else ''}"
+    match = _NAMED_PERIOD.search(text)
+    if match:
+        return {"ytd": "year to date", "mtd": "month to date"}.get(match.group(1), match.group(1))
+    return None
+
+
+def extract_metrics(question: str) -> List[str]:
+    text = question.lower()
+    return [name for name, pattern in _METRICS if pattern.search(text)]
+
+
+def extract_product(question: str) -> Optional[str]:
+    """
+    A quoted name, or a capitalized name after "of/for/about/on"
+    """
+    match = _QUOTED.search(question)
+    if match:
+        return next(group for group in match.groups() if group).strip()
+    for match in _NAMED_PRODUCT.finditer(question):
+        name = match.group(1).strip()
+        if name.lower() not in ("i", "my", "the", "next", "last", "this"):
+            return name
+    return None
+
+
+def _softmax(scores: Dict[str, float], temperature: float = 1.0) -> Dict[str, float]:
+    peak = max(scores.values())
+    exps = {key: math.exp((value - peak) / temperature) for key, value in scores.items()}
+    total = sum(exps.values())
+    return {key: value / total for key, value in exps.items()}
+
+
+# Linear model
+
+def _features(question: str, idf: Dict[str, float]) -> Dict[str, float]:
+    """
+    L2-normalized TF-IDF over unigrams and bigrams, limited to the vocabulary
+    """
+    tokens = _TOKEN.findall(question.lower())
+    terms = Counter(tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])])
+    vector = {term: count * idf[term] for term, count in terms.items() if term in idf}
+    norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+    return {term: value / norm for term, value in vector.items()}
+
+
+def _logits(model: Dict[str, Any], vector: Dict[str, float]) -> List[float]:
+    logits = list(model["bias"])
+    weights = model["weights"]
+    for term, value in vector.items():
+        for index, weight in enumerate(weights[term]):
+            logits[index] += weight * value
+    return logits
+
+
+def predict_proba(model: Dict[str, Any], question: str) -> Dict[str, float]:
+    """
+    Class probabilities from a trained model, temperature-scaled
+    """
+    logits = _logits(model, _features(question, model["idf"]))
+    return _softmax(dict(zip(model["classes"], logits)), model.get("temperature", 1.0))
+
+
+def train(
+    examples: Iterable[Tuple[str, str]],
+    epochs: int = 30,
+    learning_rate: float = 0.5,
+    l2: float = 1e-4,
+    min_count: int = 2,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Fit a softmax regression over TF-IDF features with SGD, then fit a
+    temperature on a held-out fifth of the examples so that predicted
+    probabilities match observed accuracy. Returns a JSON-serializable model.
+    """
+    examples = [(question, label) for question, label in examples if label in INTENT_TYPES]
+    if not examples:
+        raise ValueError("No labelled examples")
+    rng = random.Random(seed)
+    rng.shuffle(examples)
+    split = max(1, len(examples) // 5) if len(examples) >= 10 else 0
+    held_out, training = examples[:split], examples[split:]
+
+    document_frequency = Counter()
+    for question, _ in training:
+        tokens = _TOKEN.findall(question.lower())
+        document_frequency.update(set(tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]))
+    idf = {
+        term: math.log((1 + len(training)) / (1 + count)) + 1
+        for term, count in document_frequency.items() if count >= min_count
+    }
+    classes = list(INTENT_TYPES)
+    model = {
+        "version": 1,
+        "classes": classes,
+        "idf": idf,
+        "weights": {term: [0.0] * len(classes) for term in idf},
+        "bias": [0.0] * len(classes),
+        "temperature": 1.0,
+    }
+    samples = [(_features(question, idf), classes.index(label)) for question, label in training]
+    for epoch in range(epochs):
+        rng.shuffle(samples)
+        rate = learning_rate / (1 + epoch * 0.1)
+        for vector, target in samples:
+            probabilities = list(_softmax(dict(enumerate(_logits(model, vector)))).values())
+            for index in range(len(classes)):
+                gradient = probabilities[index] - (1.0 if index == target else 0.0)
+                model["bias"][index] -= rate * gradient
+                for term, value in vector.items():
+                    weights = model["weights"][term]
+                    weights[index] -= rate * (gradient * value + l2 * weights[index])
+
+    if held_out:
+        model["temperature"] = _fit_temperature(model, held_out)
+    return model
+
+
+def _fit_temperature(model: Dict[str, Any], examples: List[Tuple[str, str]]) -> float:
+    """
+    Temperature minimizing held-out negative log-likelihood
+    """
+    logits = [(_logits(model, _features(question, model["idf"])), label) for question, label in examples]
+
+    def loss(temperature: float) -> float:
+        total = 0.0
+        for row, label in logits:
+            probabilities = _softmax(dict(zip(model["classes"], row)), temperature)
+            total -= math.log(max(probabilities[label], 1e-12))
+        return total
+
+    return min((0.1 * 1.2 ** step for step in range(25)), key=loss)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    python -m app.intent_classifier train LOG.jsonl MODEL.json
+
+    LOG.jsonl holds one {"question": ..., "intent_type": ...} object per line,
+    e.g. the questions logged to INTENT_LOG_PATH.
+    """
+    import sys
+    args = argv if argv is not None else sys.argv[1:]
+    if len(args) != 3 or args[0] != "train":
+        raise SystemExit(main.__doc__)
+    with open(args[1]) as f:
+        examples = [
+            (record["question"], record["intent_type"])
+            for record in map(json.loads, filter(str.strip, f))
+        ]
+    model = train(examples)
+    with open(args[2], "w") as f:
+        json.dump(model, f)
+    print(f"Trained on {len(examples)} questions, temperature {model['temperature']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Async LLM client with bounded concurrency and per-call timeouts
+"""
+import asyncio
+import os
+import httpx
+from typing import Any, AsyncIterator, Dict, List, Optional
+from openai import AsyncOpenAI
+from app.http_pool import http_limits
+from app.metrics import LLM_REQUESTS, record_usage
+
+
+class LLMClient:
+    """
+    Thin wrapper around AsyncOpenAI chat completions.
+
+    Every call waits on a per-worker semaphore so a burst of questions cannot
+    open an unbounded number of completions at once, and every call carries
+    its own timeout so one slow completion fails fast instead of holding a slot.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None
+    ):
+        self.client = client
+        self.model = os.getenv("OPENAI_MODEL", "gpt-4")
+        self.timeout = timeout or float(os.getenv("OPENAI_TIMEOUT", "20"))
+        self.max_concurrency = max_concurrency or int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Ask for a final usage chunk on streams so their tokens are counted;
+        # disable for OpenAI-compatible servers that reject stream_options
+        self.stream_usage = os.getenv("OPENAI_STREAM_USAGE", "true").lower() == "true"
+
+    @classmethod
+    def from_env(cls) -> Optional["LLMClient"]:
+        """
+        Build a client from OPENAI_* environment variables, or None without an API key
+        """
+        api_key = os.getenv("OPENAI_API_KEY", "")
+        if not api_key:
+            return None
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "1")),
+            http_client=httpx.AsyncClient(limits=http_limits())
+        )
+        return cls(client)
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        timeout: Optional[float] = None,
+        **kwargs: Any
+    ):
+        """
+        Run one chat completion, waiting for a free concurrency slot first
+        """
+        async with self._semaphore:
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=timeout or self.timeout,
+                    **kwargs
+                )
+            except Exception:
+                LLM_REQUESTS.labels("complete", "error").inc()
+                raise
+        LLM_REQUESTS.labels("complete", "ok").inc()
+        record_usage(getattr(response, "usage", None))
+        return response
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        timeout: Optional[float] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[str]:
+        """
+        Stream a chat completion as content deltas, holding one concurrency slot
+        until the stream is exhausted or closed
+        """
+        if self.stream_usage:
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        async with self._semaphore:
+            outcome = "error"
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=timeout or self.timeout,
+                    stream=True,
+                    **kwargs
+                )
+                try:
+                    async for chunk in response:
+                        record_usage(getattr(chunk, "usage", None))
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                    outcome = "ok"
+                finally:
+                    await response.close()
+            except GeneratorExit:
+                # The consumer stopped reading early, e.g. the fused planner
+                outcome = "closed"
+                raise
+            finally:
+                LLM_REQUESTS.labels("stream", outcome).inc()
+
+    async def aclose(self) -> None:
+        """
+        Close the underlying HTTP connections
+        """
+        await self.client.close()
@@ -0,0 +1,434 @@
+"""
+Local per-store analytical store backed by SQLite
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional
+
+# Shard readers map the database file rather than copying pages through read()
+MMAP_SIZE = 1 << 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    order_number TEXT,
+    total_price TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    customer_email TEXT,
+    customer_first_name TEXT,
+    customer_last_name TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_created_at ON orders (created_at);
+CREATE TABLE IF NOT EXISTS line_items (
+    order_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT,
+    quantity INTEGER,
+    price TEXT,
+    PRIMARY KEY (order_id, position)
+);
+CREATE TABLE IF NOT EXISTS customers (
+    id INTEGER PRIMARY KEY,
+    email TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    orders_count INTEGER,
+    total_spent TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS inventory_levels (
+    inventory_item_id INTEGER NOT NULL,
+    location_id INTEGER NOT NULL,
+    available INTEGER,
+    incoming INTEGER,
+    committed INTEGER,
+    product_title TEXT,
+    PRIMARY KEY (inventory_item_id, location_id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    resource TEXT PRIMARY KEY,
+    watermark TEXT,
+    synced_at REAL
+);
+"""
+
+
+class LocalStore:
+    """
+    One SQLite file per store_id holding orders, line items, customers and
+    inventory levels, plus the updated_at watermark of the last sync.
+
+    All SQLite work runs in worker threads; each store's connection is
+    guarded by its own lock.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._connections: Dict[str, sqlite3.Connection] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        # (store_id, resource) -> sync_state row, so the hot path does not
+        # touch SQLite just to check freshness
+        self._sync_states: Dict[tuple, Optional[Dict[str, Any]]] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["LocalStore"]:
+        """
+        Enabled by setting LOCAL_STORE_DIR
+        """
+        directory = os.getenv("LOCAL_STORE_DIR", "")
+        return cls(directory) if directory else None
+
+    def _path(self, store_id: str) -> str:
+        safe = re.sub(r"[^a-z0-9._-]", "_", store_id.strip().lower())
+        return os.path.join(self.directory, f"{safe}.sqlite3")
+
+    def _connection(self, store_id: str):
+        with self._guard:
+            connection = self._connections.get(store_id)
+            if connection is None:
+                connection = sqlite3.connect(self._path(store_id), check_same_thread=False)
+                connection.row_factory = sqlite3.Row
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.executescript(SCHEMA)
+                self._connections[store_id] = connection
+                self._locks[store_id] = threading.Lock()
+            return connection, self._locks[store_id]
+
+    async def _run(self, store_id: str, fn, *args):
+        def call():
+            connection, lock = self._connection(store_id)
+            with lock:
+                return fn(connection, *args)
+        return await asyncio.to_thread(call)
+
+    def close(self) -> None:
+        with self._guard:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+
+    # Sync state
+
+    async def sync_state(self, store_id: str, resource: str) -> Optional[Dict[str, Any]]:
+        """
+        Watermark and last sync time for a resource, or None if never synced
+        """
+        key = (store_id, resource)
+        if key in self._sync_states:
+            return self._sync_states[key]
+
+        def read(connection):
+            row = connection.execute(
+                "SELECT watermark, synced_at FROM sync_state WHERE resource = ?", (resource,)
+            ).fetchone()
+            return dict(row) if row else None
+        state = await self._run(store_id, read)
+        self._sync_states[key] = state
+        return state
+
+    async def mark_synced(self, store_id: str, resource: str, watermark: Optional[str]) -> None:
+        def write(connection):
+            with connection:
+                connection.execute(
+                    "INSERT INTO sync_state (resource, watermark, synced_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(resource) DO UPDATE SET "
+                    "watermark = COALESCE(excluded.watermark, sync_state.watermark), synced_at = excluded.synced_at",
+                    (resource, watermark, time.time())
+                )
+                row = connection.execute(
+                    "SELECT watermark, synced_at FROM sync_state WHERE resource = ?", (resource,)
+                ).fetchone()
+                return dict(row)
+        self._sync_states[(store_id, resource)] = await self._run(store_id, write)
+
+    # Writes
+
+    async def upsert_orders(self, store_id: str, orders: List[Dict[str, Any]]) -> List[int]:
+        """
+        Insert or replace orders and their line items; returns the ids of
+        orders that were already stored
+        """
+        def write(connection):
+            with connection:
+                ids = [order["id"] for order in orders]
+                existing = [
+                    row["id"] for chunk in range(0, len(ids), 500)
+                    for row in connection.execute(
+                        f"SELECT id FROM orders WHERE id IN ({','.join('?' * len(ids[chunk:chunk + 500]))})",
+                        ids[chunk:chunk + 500]
+                    )
+                ]
+                connection.executemany(
+                    "INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            order["id"],
+                            order.get("order_number"),
+                            str(order.get("total_price", "0")),
+                            order.get("created_at"),
+                            order.get("updated_at"),
+                            (order.get("customer") or {}).get("email"),
+                            (order.get("customer") or {}).get("first_name"),
+                            (order.get("customer") or {}).get("last_name"),
+                        )
+                        for order in orders
+                    ]
+                )
+                connection.executemany(
+                    "DELETE FROM line_items WHERE order_id = ?",
+                    [(order["id"],) for order in orders]
+                )
+                connection.executemany(
+                    "INSERT INTO line_items VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            order["id"],
+                            position,
+                            item.get("title", "Unknown"),
+                            int(item.get("quantity", 0)),
+                            str(item.get("price", "0")),
+                        )
+                        for order in orders
+                        for position, item in enumerate(order.get("line_items") or [])
+                    ]
+                )
+            return existing
+        return await self._run(store_id, write)
+
+    async def upsert_customers(self, store_id: str, customers: List[Dict[str, Any]]) -> None:
+        def write(connection):
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO customers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            customer["id"],
+                            customer.get("email"),
+                            customer.get("first_name"),
+                            customer.get("last_name"),
+                            int(customer.get("orders_count") or 0),
+                            str(customer.get("total_spent", "0")),
+                            customer.get("created_at"),
+                            customer.get("updated_at"),
+                        )
+                        for customer in customers
+                    ]
+                )
+        await self._run(store_id, write)
+
+    async def upsert_inventory(
+        self,
+        store_id: str,
+        levels: List[Dict[str, Any]],
+        replace: bool = False
+    ) -> None:
+        """
+        Upsert inventory levels; replace=True first clears the table
+        """
+        def write(connection):
+            with connection:
+                if replace:
+                    connection.execute("DELETE FROM inventory_levels")
+                connection.executemany(
+                    "INSERT OR REPLACE INTO inventory_levels VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            level["inventory_item_id"],
+                            level.get("location_id") or 0,
+                            int(level.get("available") or 0),
+                            int(level.get("incoming") or 0),
+                            int(level.get("committed") or 0),
+                            level.get("product_title", "Unknown"),
+                        )
+                        for level in levels
+                    ]
+                )
+        await self._run(store_id, write)
+
+    async def update_inventory_level(self, store_id: str, level: Dict[str, Any]) -> None:
+        """
+        Set the available quantity of one inventory level (the shape of an
+        inventory_levels/update webhook), keeping its other columns
+        """
+        def write(connection):
+            with connection:
+                connection.execute(
+                    "INSERT INTO inventory_levels VALUES (?, ?, ?, 0, 0, 'Unknown') "
+                    "ON CONFLICT (inventory_item_id, location_id) DO UPDATE SET available = excluded.available",
+                    (level["inventory_item_id"], level.get("location_id") or 0, int(level.get("available") or 0))
+                )
+        await self._run(store_id, write)
+
+    # Reads
+
+    async def iter_orders(
+        self,
+        store_id: str,
+        page_size: int,
+        created_at_min: Optional[str] = None,
+        created_at_max: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield orders with their line items in id order, one page at a time
+        """
+        after_id = -1
+        while True:
+            page = await self._run(
+                store_id, _read_order_page, after_id, page_size, created_at_min, created_at_max
+            )
+            if not page:
+                return
+            yield page
+            after_id = page[-1]["id"]
+
+    async def order_id_range(self, store_id: str) -> Optional[Dict[str, int]]:
+        """
+        Smallest and largest order id and the order count, for sharding
+        """
+        def read(connection):
+            row = connection.execute("SELECT MIN(id) AS low, MAX(id) AS high, COUNT(*) AS count FROM orders").fetchone()
+            return dict(row) if row["count"] else None
+        return await self._run(store_id, read)
+
+    def path(self, store_id: str) -> str:
+        return self._path(store_id)
+
+    async def iter_customers(self, store_id: str, page_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        async for page in self._iter_table(store_id, "customers", "id", page_size):
+            yield page
+
+    async def iter_inventory(
+        self,
+        store_id: str,
+        page_size: int,
+        product_name: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        async for page in self._iter_table(store_id, "inventory_levels", "rowid", page_size, product_name):
+            yield page
+
+    async def _iter_table(
+        self,
+        store_id: str,
+        table: str,
+        key: str,
+        page_size: int,
+        product_name: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        def read(connection, after):
+            clauses, params = [f"{key} > ?"], [after]
+            if product_name:
+                clauses.append("product_title LIKE ?")
+                params.append(f"%{product_name}%")
+            return connection.execute(
+                f"SELECT {key} AS _key, * FROM {table} WHERE {' AND '.join(clauses)} ORDER BY {key} LIMIT ?",
+                (*params, page_size)
+            ).fetchall()
+
+        after = -1
+        while True:
+            rows = await self._run(store_id, read, after)
+            if not rows:
+                return
+            after = rows[-1]["_key"]
+            yield [{k: row[k] for k in row.keys() if k != "_key"} for row in rows]
+
+
+def _read_order_page(
+    connection: sqlite3.Connection,
+    after_id: int,
+    page_size: int,
+    created_at_min: Optional[str] = None,
+    created_at_max: Optional[str] = None,
+    max_id: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    One keyset page of orders with their line items, ids above after_id
+    """
+    clauses, params = ["id > ?"], [after_id]
+    if max_id is not None:
+        clauses.append("id <= ?")
+        params.append(max_id)
+    if created_at_min:
+        clauses.append("created_at >= ?")
+        params.append(created_at_min)
+    if created_at_max:
+        clauses.append("created_at < ?")
+        params.append(created_at_max)
+    rows = connection.execute(
+        f"SELECT * FROM orders WHERE {' AND '.join(clauses)} ORDER BY id LIMIT ?",
+        (*params, page_size)
+    ).fetchall()
+    if not rows:
+        return []
+    items: Dict[int, List[Dict[str, Any]]] = {}
+    for item in connection.execute(
+        f"SELECT order_id, title, quantity, price FROM line_items "
+        f"WHERE order_id IN ({','.join('?' * len(rows))}) ORDER BY order_id, position",
+        [row["id"] for row in rows]
+    ):
+        items.setdefault(item["order_id"], []).append(
+            {"title": item["title"], "quantity": item["quantity"], "price": item["price"]}
+        )
+    return [_order_record(row, items.get(row["id"], [])) for row in rows]
+
+
+def read_order_range(
+    path: str,
+    low_id: int,
+    high_id: int,
+    page_size: int,
+    created_at_min: Optional[str] = None,
+    created_at_max: Optional[str] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Pages of orders with low_id <= id <= high_id, optionally within string
+    created_at bounds, read through a separate read-only, memory-mapped
+    connection. Used by worker processes, which cannot share the store's
+    connections.
+    """
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    connection.row_factory = sqlite3.Row
+    connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    try:
+        after_id = low_id - 1
+        while True:
+            page = _read_order_page(
+                connection, after_id, page_size, created_at_min, created_at_max, max_id=high_id
+            )
+            if not page:
+                return
+            yield page
+            after_id = page[-1]["id"]
+    finally:
+        connection.close()
+
+
+def _order_record(row: sqlite3.Row, line_items: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Rebuild the REST order shape from a stored row
+    """
+    customer = None
+    if row["customer_email"] or row["customer_first_name"] or row["customer_last_name"]:
+        customer = {
+            "email": row["customer_email"],
+            "first_name": row["customer_first_name"],
+            "last_name": row["customer_last_name"],
+        }
+    return {
+        "id": row["id"],
+        "order_number": row["order_number"],
+        "total_price": row["total_price"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "line_items": list(line_items),
+        "customer": customer,
+    }
@@ -0,0 +1,232 @@
+"""
+Background-refreshed materialized views of common per-store metrics
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional
+
+from app.query_templates import render_query
+from app.shopifyql import QueryError, parse
+from app.time_periods import period_key
+
+logger = logging.getLogger(__name__)
+
+
+class ViewDefinition(NamedTuple):
+    name: str
+    intent: Dict[str, Any]
+    query: str
+
+
+def _template_view(name: str, question: str, intent: Dict[str, Any]) -> ViewDefinition:
+    return ViewDefinition(name, intent, render_query(question, intent))
+
+
+# The questions asked most often, rendered by the same templates the query
+# generator uses so that they match: top sellers, revenue / AOV, repeat
+# customers and inventory
+DEFAULT_VIEWS = (
+    _template_view(
+        "top_products_7d", "What were my top 5 selling products in the last 7 days?",
+        {"intent_type": "sales", "time_period": "last 7 days"}
+    ),
+    _template_view(
+        "top_products_30d", "What were my top 5 selling products in the last 30 days?",
+        {"intent_type": "sales", "time_period": "last 30 days"}
+    ),
+    _template_view(
+        "revenue_30d", "What was my revenue in the last 30 days?",
+        {"intent_type": "sales", "time_period": "last 30 days"}
+    ),
+    _template_view(
+        "repeat_customers_90d", "Which customers placed repeat orders in the last 90 days?",
+        {"intent_type": "customers", "time_period": "last 90 days"}
+    ),
+    _template_view(
+        "inventory", "How much inventory do I have?",
+        {"intent_type": "inventory", "time_period": None}
+    ),
+)
+
+
+class _View(NamedTuple):
+    data: Dict[str, Any]
+    refreshed_at: float
+
+
+class MaterializedViews:
+    """
+    Keeps the fetched data (insights and query result) behind a fixed set
+    of common questions precomputed for every recently active store.
+
+    Each store gets its own refresh loop, started at a random offset and
+    repeated every `interval` seconds plus or minus `jitter`, so stores
+    do not all hit Shopify at once. A store that has not been asked about
+    for `idle_ttl` seconds stops refreshing and its views are dropped.
+
+    A request is served from a view when its intent names the same data
+    (type, time period and product) and its query parses to the same
+    clauses as the view's query, however it is spelled or ordered.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str, Dict[str, Any], str], Awaitable[Dict[str, Any]]],
+        interval: float = 300.0,
+        jitter: float = 0.1,
+        idle_ttl: float = 3600.0,
+        definitions: tuple = DEFAULT_VIEWS
+    ):
+        self.fetch = fetch
+        self.interval = interval
+        self.jitter = jitter
+        self.idle_ttl = idle_ttl
+        self.definitions = {_view_key(d.intent, d.query): d for d in definitions}
+        self._views: Dict[str, Dict[Hashable, _View]] = {}
+        # Bumped per view by invalidate, so a refresh that was already
+        # fetching when the data changed does not store its stale result
+        self._generations: Dict[str, Dict[Hashable, int]] = {}
+        self._last_used: Dict[str, float] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._running = False
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(
+        cls,
+        fetch: Callable[[str, Dict[str, Any], str], Awaitable[Dict[str, Any]]]
+    ) -> Optional["MaterializedViews"]:
+        """
+        Build from MATERIALIZED_VIEWS_* environment variables; an interval of 0 disables
+        """
+        interval = float(os.getenv("MATERIALIZED_VIEWS_INTERVAL", "300"))
+        if interval <= 0:
+            return None
+        return cls(
+            fetch,
+            interval=interval,
+            jitter=float(os.getenv("MATERIALIZED_VIEWS_JITTER", "0.1")),
+            idle_ttl=float(os.getenv("MATERIALIZED_VIEWS_IDLE_TTL", "3600"))
+        )
+
+    def start(self) -> None:
+        """
+        Allow refresh loops to run; stores are picked up as they are asked about
+        """
+        self._running = True
+
+    async def stop(self) -> None:
+        self._running = False
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    def get(self, store_id: str, intent: Dict[str, Any], query: str) -> Optional[Dict[str, Any]]:
+        """
+        The view's data for this request, relabelled with the caller's time
+        period, or None when no fresh view matches. Marks the store active.
+        """
+        self._touch(store_id)
+        key = _view_key(intent, query)
+        view = self._views.get(store_id, {}).get(key) if key is not None else None
+        if view is None or time.monotonic() - view.refreshed_at > 2 * self.interval:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        data = dict(view.data)
+        if "time_period" in data:
+            data["time_period"] = intent.get("time_period", "last 30 days")
+        insights = data.get("insights")
+        if insights and "time_period" in insights:
+            data["insights"] = {**insights, "time_period": intent.get("time_period", "specified period")}
+        return data
+
+    def invalidate(self, store_id: str, data_type: Optional[str] = None) -> None:
+        """
+        Drop a store's views (or those of one data type) until the next
+        refresh; refreshes already in flight for them are discarded
+        """
+        generations = self._generations.setdefault(store_id, {})
+        for key in self.definitions:
+            if data_type is None or key[0] == data_type:
+                generations[key] = generations.get(key, 0) + 1
+        views = self._views.get(store_id)
+        if not views:
+            return
+        for key in [key for key in views if data_type is None or key[0] == data_type]:
+            del views[key]
+
+    async def refresh(self, store_id: str) -> None:
+        """
+        Recompute every view for a store, one at a time
+        """
+        views = self._views.setdefault(store_id, {})
+        generations = self._generations.setdefault(store_id, {})
+        for key, definition in self.definitions.items():
+            generation = generations.get(key, 0)
+            try:
+                data = await self.fetch(store_id, dict(definition.intent), definition.query)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Refreshing view %s failed for %s", definition.name, store_id)
+                continue
+            if generations.get(key, 0) != generation:
+                # Invalidated while fetching: the data may predate the change
+                continue
+            views[key] = _View(data, time.monotonic())
+
+    def _touch(self, store_id: str) -> None:
+        self._last_used[store_id] = time.monotonic()
+        if self._running and store_id not in self._tasks:
+            self._tasks[store_id] = asyncio.create_task(self._refresh_loop(store_id))
+
+    async def _refresh_loop(self, store_id: str) -> None:
+        try:
+            # Spread first refreshes out so stores seen together drift apart
+            await asyncio.sleep(random.uniform(0, self.interval * self.jitter))
+            while time.monotonic() - self._last_used[store_id] < self.idle_ttl:
+                await self.refresh(store_id)
+                spread = self.interval * self.jitter
+                await asyncio.sleep(self.interval + random.uniform(-spread, spread))
+        finally:
+            if self._tasks.get(store_id) is asyncio.current_task():
+                del self._tasks[store_id]
+                self._views.pop(store_id, None)
+                self._generations.pop(store_id, None)
+                self._last_used.pop(store_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "stores": len(self._tasks),
+            "views": sum(len(views) for views in self._views.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def _view_key(intent: Dict[str, Any], query: str) -> Optional[Hashable]:
+    """
+    (intent type, canonical time period, product, parsed query) for matching
+    requests to views; None for queries the engine cannot parse
+    """
+    try:
+        clauses = repr(parse(query))
+    except QueryError:
+        return None
+    product = intent.get("product_mentioned")
+    return (
+        intent.get("intent_type", "general"),
+        period_key(intent.get("time_period")),
+        product.strip().lower() if isinstance(product, str) else None,
+        clauses,
+    )
+
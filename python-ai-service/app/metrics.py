@@ -0,0 +1,186 @@
+"""
+Per-request stage timings and Prometheus metrics
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from app.intent_classifier import INTENT_TYPES
+
+# From a cached answer (~1ms) to a slow LLM completion (tens of seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_SECONDS = Histogram(
+    "analytics_request_seconds",
+    "Time to answer a question, by endpoint, intent type and whether the answer was cached",
+    ["endpoint", "intent_type", "cached"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "analytics_stage_seconds",
+    "Time spent in each pipeline stage, by intent type",
+    ["stage", "intent_type"],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "analytics_requests_in_flight",
+    "Questions currently being answered, by endpoint",
+    ["endpoint"]
+)
+LLM_TOKENS = Counter(
+    "analytics_llm_tokens",
+    "LLM tokens used, by kind (prompt or completion)",
+    ["kind"]
+)
+LLM_REQUESTS = Counter(
+    "analytics_llm_requests",
+    "LLM completions, by mode (complete or stream) and outcome",
+    ["mode", "outcome"]
+)
+SHOPIFY_REQUESTS = Counter(
+    "analytics_shopify_requests",
+    "Shopify Admin API calls, by API (rest, graphql, bulk_download) and HTTP status",
+    ["api", "status"]
+)
+
+_current: ContextVar[Optional["Timings"]] = ContextVar("timings", default=None)
+
+
+class Timings:
+    """
+    Wall-clock time per pipeline stage for one request. Stages are recorded
+    with the module-level stage() context manager by whatever code runs
+    while the timings are active, including tasks started meanwhile.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    @contextmanager
+    def activate(self) -> Iterator["Timings"]:
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def as_dict(self) -> Dict[str, float]:
+        """
+        Milliseconds per stage plus the request total
+        """
+        timings = {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 3)
+        return timings
+
+    def finish(self, response: Dict[str, Any], endpoint: str) -> Dict[str, Any]:
+        """
+        Attach the breakdown to response metadata and record it in the
+        histograms. Call after the response has been cached so cached copies
+        never carry another request's timings.
+        """
+        total = time.perf_counter() - self.started
+        metadata = response.setdefault("metadata", {})
+        intent_type = _intent_label((metadata.get("intent") or {}).get("intent_type"))
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.labels(stage, intent_type).observe(seconds)
+        cached = "true" if metadata.get("cached") else "false"
+        REQUEST_SECONDS.labels(endpoint, intent_type, cached).observe(total)
+        metadata["timings"] = self.as_dict()
+        return response
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a block as a stage of the active request; a no-op outside one
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
+
+
+def record_usage(usage: Any) -> None:
+    """
+    Count the tokens reported in an OpenAI usage object
+    """
+    if usage is None:
+        return
+    LLM_TOKENS.labels("prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels("completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def _intent_label(intent_type: Any) -> str:
+    """
+    Bound label cardinality: LLM-produced intent types outside the known set are "other"
+    """
+    if intent_type is None:
+        return "unknown"
+    return intent_type if intent_type in INTENT_TYPES else "other"
+
+
+class AgentCollector:
+    """
+    Exposes an agent's cache, coalescing and Shopify scheduler counters at
+    scrape time, so the request path does no extra work for them
+    """
+
+    def __init__(self, agent: Any):
+        self.agent = agent
+
+    def collect(self):
+        stats = self.agent.cache_stats()
+        caches = {"intent": stats["intent"], "answer": stats["answer"]}
+        if stats.get("views") is not None:
+            caches["views"] = stats["views"]
+
+        hits = CounterMetricFamily("analytics_cache_hits", "Cache hits, by cache", labels=["cache"])
+        misses = CounterMetricFamily("analytics_cache_misses", "Cache misses, by cache", labels=["cache"])
+        ratio = GaugeMetricFamily("analytics_cache_hit_ratio", "Hit ratio since start, by cache", labels=["cache"])
+        for name, cache in caches.items():
+            hits.add_metric([name], cache["hits"])
+            misses.add_metric([name], cache["misses"])
+            ratio.add_metric([name], cache["hit_ratio"])
+        yield hits
+        yield misses
+        yield ratio
+
+        in_flight = GaugeMetricFamily(
+            "analytics_coalescing_in_flight", "Distinct in-flight questions and data fetches", labels=["flight"]
+        )
+        coalesced = CounterMetricFamily(
+            "analytics_coalesced", "Callers that joined an identical in-flight run", labels=["flight"]
+        )
+        for name, flight in stats["coalescing"].items():
+            in_flight.add_metric([name], flight["in_flight"])
+            coalesced.add_metric([name], flight["coalesced"])
+        yield in_flight
+        yield coalesced
+
+        scheduler = self.agent.shopify_client.scheduler.stats()
+        yield GaugeMetricFamily(
+            "analytics_shopify_requests_in_flight", "Shopify calls holding a scheduler slot",
+            value=scheduler["in_flight"]
+        )
+        yield GaugeMetricFamily(
+            "analytics_shopify_requests_waiting", "Shopify calls waiting for a scheduler slot",
+            value=scheduler["waiting_requests"]
+        )
@@ -0,0 +1,138 @@
+"""
+Multi-process aggregation of very large local-store order sets
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, tzinfo
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.aggregates import SalesAggregate
+from app.columnar import ColumnarSalesAggregate
+from app.local_store import read_order_range
+from app.shopifyql import Plan, QueryExecution, compile_query
+from app.time_periods import DateRange, filter_orders, padded_bounds
+
+# Orders per page read inside a worker; larger than REST pages since the
+# columnar aggregate converts each page in one pass
+SHARD_PAGE_SIZE = 5000
+
+
+class ParallelAggregator:
+    """
+    Splits a store's orders into id-range shards and aggregates them in a
+    process pool. Workers open the store's SQLite file themselves through a
+    read-only memory-mapped connection, so no records are pickled across
+    the process boundary; only the per-shard partial aggregates (per-product
+    totals) and query group state come back to be merged.
+    """
+
+    def __init__(self, min_orders: int, max_workers: int):
+        self.min_orders = min_orders
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["ParallelAggregator"]:
+        """
+        Enabled unless PARALLEL_MIN_ORDERS=0 or only one worker is available
+        """
+        min_orders = int(os.getenv("PARALLEL_MIN_ORDERS", "200000"))
+        max_workers = int(os.getenv("PARALLEL_WORKERS", "0")) or os.cpu_count() or 1
+        if min_orders <= 0 or max_workers < 2:
+            return None
+        return cls(min_orders, max_workers)
+
+    def should_shard(self, order_count: int) -> bool:
+        return order_count >= self.min_orders
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn rather than fork: the parent runs an event loop and
+            # SQLite threads that must not be duplicated into children
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def aggregate_orders(
+        self,
+        path: str,
+        id_range: Dict[str, int],
+        aggregate_type: Optional[str],
+        query: Optional[str] = None,
+        query_plan: Optional[Plan] = None,
+        window: Optional[DateRange] = None
+    ) -> Tuple[Any, List[Tuple[Dict, List]]]:
+        """
+        Aggregate every order in id_range, or only those created within
+        `window`. aggregate_type is "columnar", "dict" or None (query only).
+        A query is recompiled in each worker with the parent's query_plan
+        now and tz, so relative dates resolve identically. Returns the
+        merged aggregate and each shard's (groups, results) for
+        QueryExecution.merge_state.
+        """
+        now, tz = (query_plan.now, query_plan.tz) if query_plan is not None else (None, None)
+        loop = asyncio.get_running_loop()
+        executor = self._executor()
+        partials = await asyncio.gather(*(
+            loop.run_in_executor(
+                executor, _aggregate_order_shard, path, low_id, high_id, aggregate_type, query, now, tz, window
+            )
+            for low_id, high_id in _shards(id_range["low"], id_range["high"], self.max_workers * 2)
+        ))
+
+        # Shards are merged in id order, so first-seen title order (and with
+        # it tie-breaking among top products) matches a sequential scan
+        aggregate = partials[0][0]
+        if aggregate is not None:
+            for shard_aggregate, _ in partials[1:]:
+                aggregate.merge(shard_aggregate)
+        return aggregate, [state for _, state in partials if state is not None]
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def _shards(low_id: int, high_id: int, count: int) -> List[Tuple[int, int]]:
+    """
+    Split [low_id, high_id] into at most `count` contiguous inclusive ranges
+    """
+    span = high_id - low_id + 1
+    count = max(1, min(count, span))
+    bounds = [low_id + span * index // count for index in range(count + 1)]
+    return [(bounds[index], bounds[index + 1] - 1) for index in range(count)]
+
+
+def _aggregate_order_shard(
+    path: str,
+    low_id: int,
+    high_id: int,
+    aggregate_type: Optional[str],
+    query: Optional[str],
+    now: Optional[datetime],
+    tz: Optional[tzinfo],
+    window: Optional[DateRange] = None
+) -> Tuple[Any, Optional[Tuple[Dict, List]]]:
+    """
+    Worker entry point: scan one shard into a fresh aggregate and, when a
+    query is given, a fresh execution of it (the compiled plan holds
+    closures, so each worker compiles the query text itself)
+    """
+    aggregate = {"columnar": ColumnarSalesAggregate, "dict": SalesAggregate}.get(aggregate_type)
+    aggregate = aggregate() if aggregate else None
+    execution = None
+    if query:
+        execution = QueryExecution(compile_query(query, now, tz))
+    bounds = padded_bounds(window.start, window.end) if window is not None else (None, None)
+    for page in read_order_range(path, low_id, high_id, SHARD_PAGE_SIZE, *bounds):
+        page = filter_orders(page, window)
+        if aggregate is not None:
+            aggregate.update(page)
+        if execution is not None:
+            execution.feed(page)
+    return aggregate, (execution.groups, execution.results) if execution else None
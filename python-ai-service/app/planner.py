@@ -0,0 +1,122 @@
+"""
+Single-round-trip planning: intent classification and ShopifyQL in one completion
+"""
+import json
+import re
+from typing import Dict, Any, Callable, Optional, Tuple
+from app.llm import LLMClient
+from app.query_generator import QueryGenerator
+
+# Intent fields the data fetch depends on. They are requested first in the
+# JSON object so the fetch can start before the query text has finished streaming.
+FETCH_FIELDS = ("intent_type", "time_period", "product_mentioned")
+
+_FIELD_PATTERNS = {
+    field: re.compile(r'"%s"\s*:\s*("(?:[^"\\]|\\.)*"|null)' % field)
+    for field in FETCH_FIELDS
+}
+
+
+class FusedPlanner:
+    """
+    Produces the intent and the ShopifyQL query from one structured-output call
+    """
+
+    def __init__(self, llm_client: LLMClient):
+        self.llm_client = llm_client
+
+    async def plan(
+        self,
+        question: str,
+        on_intent: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Optional[Tuple[Dict[str, Any], str]]:
+        """
+        Stream the plan and return (intent, query), or None if the model output
+        could not be parsed.
+
+        on_intent is called once with the fetch-relevant intent fields as soon
+        as they have streamed in, while the query is still being generated.
+        """
+        buffer = ""
+        early_intent = None
+
+        try:
+            async for delta in self.llm_client.stream(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": """You are an expert at analyzing Shopify store analytics questions and writing ShopifyQL.
+                        ShopifyQL is Shopify's analytics query language.
+                        Common tables: orders, products, inventory_levels, customers.
+                        Always respond with a single valid JSON object only."""
+                    },
+                    {"role": "user", "content": self._build_prompt(question)}
+                ],
+                temperature=0.2,
+                max_tokens=600,
+                response_format={"type": "json_object"}
+            ):
+                buffer += delta
+                if early_intent is None and on_intent is not None:
+                    early_intent = self._scan_fetch_fields(buffer)
+                    if early_intent is not None:
+                        on_intent(early_intent)
+
+            plan = json.loads(buffer)
+            query = QueryGenerator.clean_query(plan.pop("query", "") or "")
+        except Exception:
+            return None
+
+        if not query or not plan.get("intent_type"):
+            return None
+
+        plan.setdefault("time_period", None)
+        plan.setdefault("metrics", [])
+        plan.setdefault("product_mentioned", None)
+        plan.setdefault("confidence", "medium")
+        return plan, query
+
+    def _scan_fetch_fields(self, buffer: str) -> Optional[Dict[str, Any]]:
+        """
+        Extract the fetch-relevant fields from a partially streamed JSON object
+        """
+        fields = {}
+        for field, pattern in _FIELD_PATTERNS.items():
+            match = pattern.search(buffer)
+            if not match:
+                return None
+            fields[field] = json.loads(match.group(1))
+        return fields
+
+    def _build_prompt(self, question: str) -> str:
+        """
+        Build the combined intent + query prompt
+        """
+        examples = "\n".join(QueryGenerator.EXAMPLES.values())
+
+        return f"""Analyze the following question about Shopify store analytics, classify it and write the ShopifyQL query that answers it.
+
+Question: "{question}"
+
+Return a JSON object with these keys, in this order:
+- intent_type: one of ["inventory", "sales", "customers", "products", "general"]
+- time_period: extracted time period (e.g., "last 7 days", "next month", "last 30 days") or null
+- product_mentioned: product name if mentioned, or null
+- metrics: list of metrics mentioned (e.g., ["units", "revenue", "orders"])
+- confidence: "high", "medium", or "low"
+- query: the ShopifyQL query as a single string
+
+Example ShopifyQL queries:
+{examples}
+
+Example response:
+{{
+  "intent_type": "sales",
+  "time_period": "last week",
+  "product_mentioned": null,
+  "metrics": ["units"],
+  "confidence": "high",
+  "query": "FROM orders WHERE created_at >= DATE_SUB(NOW(), INTERVAL 7 DAY) GROUP BY product_title SELECT product_title, SUM(quantity) as total_sold ORDER BY total_sold DESC LIMIT 5"
+}}
+
+Only return the JSON object, no additional text."""
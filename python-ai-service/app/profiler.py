@@ -0,0 +1,261 @@
+"""
+Opt-in sampling profiler for single requests
+"""
+import asyncio
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+FORMATS = {"collapsed": "collapsed.txt", "speedscope": "speedscope.json"}
+
+# Pseudo-frames for samples taken while the request was not on the CPU
+WAITING = ("(waiting)", "", 0)
+OTHER_REQUESTS = ("(other requests)", "", 0)
+
+_ACTIVE: ContextVar[Optional["ProfileSession"]] = ContextVar("active_profile", default=None)
+
+Frame = Tuple[str, str, int]
+
+
+class ProfileLimitExceeded(Exception):
+    """
+    Raised when a profile is requested while one is running or after the
+    rate limit is used up
+    """
+
+
+class ProfileSession:
+    """
+    Samples the event loop thread's stack every `interval` seconds from a
+    background thread. A sample is attributed to the request when the
+    task on the CPU is the request's own or one it created (data fetches,
+    single-flight runs, prefetchers), so stages interleaved with other
+    requests are told apart. Samples where the loop is idle are counted as
+    "(waiting)" (I/O), others as "(other requests)". Work handed to
+    threads or processes is not sampled.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.loop = asyncio.get_running_loop()
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self.samples: Counter = Counter()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._previous_factory = None
+
+    def start(self) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self.tasks.add(task)
+        self._previous_factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._task_factory)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+        self.loop.set_task_factory(self._previous_factory)
+        self.duration = time.perf_counter() - self.started
+
+    def _task_factory(self, loop: asyncio.AbstractEventLoop, coro: Any, **kwargs: Any) -> asyncio.Future:
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        # Runs in the creating task's context
+        if _ACTIVE.get() is self:
+            self.tasks.add(task)
+        return task
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self) -> None:
+        task = asyncio.current_task(self.loop)
+        if task is None:
+            self.samples[(WAITING,)] += 1
+        elif task not in self.tasks:
+            self.samples[(OTHER_REQUESTS,)] += 1
+        else:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.samples[_stack(frame)] += 1
+
+    def collapsed(self) -> str:
+        """
+        Brendan Gregg's collapsed stack format, as read by flamegraph.pl
+        and speedscope
+        """
+        lines = []
+        for stack, count in self.samples.most_common():
+            names = ";".join(_label(frame) for frame in stack)
+            lines.append(f"{names} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name: str) -> Dict[str, Any]:
+        """
+        A speedscope sampled profile (https://www.speedscope.app)
+        """
+        frames: Dict[Frame, int] = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.most_common():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(round(count * self.interval, 6))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "shopify-analytics-ai-service",
+            "shared": {
+                "frames": [
+                    {"name": qualname, **({"file": file, "line": line} if file else {})}
+                    for qualname, file, line in frames
+                ]
+            },
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(self.duration, 6),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+def _stack(frame: Any) -> Tuple[Frame, ...]:
+    """
+    Outermost-first frames of a stack, starting below the event loop's
+    callback dispatch
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "_run" and code.co_filename.endswith(os.path.join("asyncio", "events.py")):
+            break
+        # co_qualname is new in Python 3.11
+        frames.append((getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+def _label(frame: Frame) -> str:
+    qualname, file, line = frame
+    return f"{qualname} ({os.path.basename(file)}:{line})" if file else qualname
+
+
+class RequestProfiler:
+    """
+    Profiles individual requests on demand for admins (ADMIN_API_KEY).
+    One profile runs at a time, and at most `rate_limit` start per
+    `rate_window` seconds, since sampling slows the whole worker.
+    Profiles are written to `output_dir` when set, otherwise returned
+    inline.
+    """
+
+    def __init__(
+        self,
+        admin_key: str,
+        output_dir: Optional[str] = None,
+        interval: float = 0.005,
+        rate_limit: int = 5,
+        rate_window: float = 60.0
+    ):
+        self.admin_key = admin_key
+        self.output_dir = output_dir
+        self.interval = interval
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self._started: deque = deque()
+        self._running = False
+
+    @classmethod
+    def from_env(cls) -> Optional["RequestProfiler"]:
+        """
+        A profiler when ADMIN_API_KEY is set, otherwise None (profiling disabled)
+        """
+        admin_key = os.getenv("ADMIN_API_KEY")
+        if not admin_key:
+            return None
+        return cls(
+            admin_key,
+            output_dir=os.getenv("PROFILE_DIR") or None,
+            interval=float(os.getenv("PROFILE_INTERVAL", "0.005")),
+            rate_limit=int(os.getenv("PROFILE_RATE_LIMIT", "5")),
+            rate_window=float(os.getenv("PROFILE_RATE_WINDOW", "60"))
+        )
+
+    def authorized(self, admin_key: Optional[str]) -> bool:
+        return admin_key is not None and hmac.compare_digest(admin_key.encode(), self.admin_key.encode())
+
+    def _acquire(self) -> None:
+        now = time.monotonic()
+        while self._started and now - self._started[0] >= self.rate_window:
+            self._started.popleft()
+        if self._running:
+            raise ProfileLimitExceeded("A profile is already running")
+        if len(self._started) >= self.rate_limit:
+            raise ProfileLimitExceeded(
+                f"At most {self.rate_limit} profiles per {self.rate_window:g}s"
+            )
+        self._started.append(now)
+        self._running = True
+
+    @asynccontextmanager
+    async def profile(self) -> AsyncIterator[ProfileSession]:
+        """
+        Sample the enclosed work; raises ProfileLimitExceeded instead of
+        starting when over the limits
+        """
+        self._acquire()
+        session = ProfileSession(self.interval)
+        token = _ACTIVE.set(session)
+        session.start()
+        try:
+            yield session
+        finally:
+            session.stop()
+            _ACTIVE.reset(token)
+            self._running = False
+
+    def export(self, session: ProfileSession, fmt: str, name: str) -> Dict[str, Any]:
+        """
+        Summary of a finished profile plus the profile itself: a file path
+        when output_dir is set, else the data inline
+        """
+        data = session.collapsed() if fmt == "collapsed" else session.speedscope(name)
+        result = {
+            "format": fmt,
+            "samples": sum(session.samples.values()),
+            "interval_ms": self.interval * 1000,
+            "duration_ms": round(session.duration * 1000, 3),
+        }
+        if self.output_dir is None:
+            result["data"] = data
+            return result
+        os.makedirs(self.output_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9.-]+", "_", name)[:80]
+        path = os.path.join(
+            self.output_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{slug}-{uuid.uuid4().hex[:8]}.{FORMATS[fmt]}"
+        )
+        with open(path, "w") as f:
+            f.write(data if fmt == "collapsed" else json.dumps(data))
+        result["path"] = path
+        return result
@@ -1,27 +1,62 @@
 """
 Generates ShopifyQL queries from natural language questions
 """
-import os
-from typing import Dict, Any
-from openai import OpenAI
+from typing import Dict, Any, Optional
+from app.llm import LLMClient
+from app.query_templates import render_query
 
 class QueryGenerator:
     """
     Converts natural language questions into ShopifyQL queries
     """
     
-    def __init__(self, llm_client: OpenAI):
+    EXAMPLES = {
+        "inventory": """
+            Example: "How many units of Product X will I need next month?"
+            ShopifyQL:
+            FROM inventory_levels
+            WHERE product_title = 'Product X'
+            SELECT available, incoming, committed
+        """,
+        "sales": """
+            Example: "What were my top 5 selling products last week?"
+            ShopifyQL:
+            FROM orders
+            WHERE created_at >= '2024-01-01' AND created_at < '2024-01-08'
+            GROUP BY product_title
+            SELECT product_title, SUM(quantity) as total_sold
+            ORDER BY total_sold DESC
+            LIMIT 5
+        """,
+        "customers": """
+            Example: "Which customers placed repeat orders in the last 90 days?"
+            ShopifyQL:
+            FROM orders
+            WHERE created_at >= DATE_SUB(NOW(), INTERVAL 90 DAY)
+            GROUP BY customer_email
+            HAVING COUNT(*) > 1
+            SELECT customer_email, COUNT(*) as order_count
+        """
+    }
+    
+    def __init__(self, llm_client: Optional[LLMClient]):
         self.llm_client = llm_client
     
     async def generate_query(self, question: str, intent: Dict[str, Any]) -> str:
         """
-        Generate ShopifyQL query based on question and intent
+        Generate ShopifyQL query based on question and intent. Known question
+        shapes are rendered from templates; the LLM only writes the rest.
         """
+        query = render_query(question, intent)
+        if query is not None:
+            return query
+        if self.llm_client is None:
+            return self._generate_fallback_query(intent)
+        
         prompt = self._build_prompt(question, intent)
         
         try:
-            response = self.llm_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4"),
+            response = await self.llm_client.complete(
                 messages=[
                     {
                         "role": "system",
@@ -36,19 +71,25 @@ class QueryGenerator:
                 max_tokens=500
             )
             
-            query = response.choices[0].message.content.strip()
-            # Remove markdown code blocks if present
-            if query.startswith("```"):
-                query = query.split("```")[1]
-                if query.startswith("sql") or query.startswith("shopifyql"):
-                    query = query.split("\n", 1)[1]
-            
-            return query
+            return self.clean_query(response.choices[0].message.content)
             
         except Exception as e:
             # Fallback to a basic query
             return self._generate_fallback_query(intent)
     
+    @staticmethod
+    def clean_query(text: str) -> str:
+        """
+        Strip whitespace and markdown code fences from an LLM-produced query
+        """
+        query = text.strip()
+        # Remove markdown code blocks if present
+        if query.startswith("```"):
+            query = query.split("```")[1]
+            if query.startswith("sql") or query.startswith("shopifyql"):
+                query = query.split("\n", 1)[1]
+        return query
+    
     def _build_prompt(self, question: str, intent: Dict[str, Any]) -> str:
         """
         Build prompt for LLM to generate ShopifyQL
@@ -57,34 +98,6 @@ class QueryGenerator:
         time_period = intent.get("time_period")
         product = intent.get("product_mentioned")
         
-        examples = {
-            "inventory": """
-            Example: "How many units of Product X will I need next month?"
-            ShopifyQL:
-            FROM inventory_levels
-            WHERE product_title = 'Product X'
-            SELECT available, incoming, committed
-            """,
-            "sales": """
-            Example: "What were my top 5 selling products last week?"
-            ShopifyQL:
-            FROM orders
-            WHERE created_at >= '2024-01-01' AND created_at < '2024-01-08'
-            GROUP BY product_title
-            SELECT product_title, SUM(quantity) as total_sold
-            ORDER BY total_sold DESC
-            LIMIT 5
-            """,
-            "customers": """
-            Example: "Which customers placed repeat orders in the last 90 days?"
-            ShopifyQL:
-            FROM orders
-            WHERE created_at >= DATE_SUB(NOW(), INTERVAL 90 DAY)
-            GROUP BY customer_email
-            HAVING COUNT(*) > 1
-            SELECT customer_email, COUNT(*) as order_count
-            """
-        }
         
         prompt = f"""Generate a ShopifyQL query for the following question:
 
@@ -94,7 +107,7 @@ Intent: {intent_type}
 Time Period: {time_period or "not specified"}
 Product: {product or "not specified"}
 
-{examples.get(intent_type, examples["sales"])}
+{self.EXAMPLES.get(intent_type, self.EXAMPLES["sales"])}
 
 Generate the ShopifyQL query for this specific question:"""
         
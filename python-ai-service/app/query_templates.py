@@ -0,0 +1,239 @@
+"""
+Deterministic ShopifyQL templates for the most common question shapes
+"""
+import re
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from app.time_periods import NUMBER_WORDS, canonical_period
+
+DEFAULT_LIMIT = 5
+MAX_LIMIT = 100
+
+_LIMIT = re.compile(
+    r"\b(?:top|best|bottom|worst|least)\s+(\d+|%s)\b|\b(\d+|%s)\s+(?:best|top|most|least|worst)\b"
+    % ("|".join(NUMBER_WORDS), "|".join(NUMBER_WORDS))
+)
+# Rankings asked for from the bottom, and customer rankings by order count
+_ASCENDING = re.compile(r"\b(?:worst|(?<!at )least|bottom|fewest|lowest)\b")
+_BY_ORDERS = re.compile(
+    r"\b(?:(?:number|count) of orders|order count|(?:most|fewest|more|fewer) orders|by orders|orders placed)\b"
+)
+
+
+class Slots(NamedTuple):
+    """
+    Values a template is filled with, extracted from the question and intent
+    """
+    limit: int
+    period: Optional[str]
+    product: Optional[str]
+    metrics: tuple
+    # ORDER BY ... ASC instead of DESC (worst sellers, fewest orders)
+    ascending: bool
+    # Rank customers by order count rather than amount spent
+    by_orders: bool
+
+
+class QueryTemplate(NamedTuple):
+    name: str
+    intent_type: str
+    # Matched against the lowercased question
+    pattern: "re.Pattern"
+    render: Callable[[Slots], str]
+    # Whether the query filters on created_at; such templates do not match
+    # future periods, whose answers need history the LLM should choose
+    dated: bool = True
+
+
+def _during(slots: Slots) -> str:
+    return f"DURING {slots.period.replace(' ', '_')}\n" if slots.period else ""
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _direction(slots: Slots) -> str:
+    return "ASC" if slots.ascending else "DESC"
+
+
+def _top_products(slots: Slots) -> str:
+    if "revenue" in slots.metrics:
+        metric = "SUM(line_total) AS total_revenue"
+        order = "total_revenue"
+    else:
+        metric = "SUM(quantity) AS total_sold"
+        order = "total_sold"
+    return (
+        f"FROM orders\n{_during(slots)}GROUP BY product_title\n"
+        f"SELECT product_title, {metric}\nORDER BY {order} {_direction(slots)}\nLIMIT {slots.limit}"
+    )
+
+
+def _product_sales(slots: Slots) -> str:
+    return (
+        f"FROM orders\nWHERE product_title = {_quote(slots.product)}\n{_during(slots)}"
+        f"SELECT SUM(quantity) AS total_sold, SUM(line_total) AS total_revenue"
+    )
+
+
+def _revenue(slots: Slots) -> str:
+    select = "SUM(total_price) AS total_revenue, COUNT(*) AS order_count"
+    if "aov" in slots.metrics:
+        select += ", AVG(total_price) AS avg_order_value"
+    return f"FROM orders\n{_during(slots)}SELECT {select}"
+
+
+def _order_count(slots: Slots) -> str:
+    return f"FROM orders\n{_during(slots)}SELECT COUNT(*) AS order_count"
+
+
+def _repeat_customers(slots: Slots) -> str:
+    return (
+        f"FROM orders\n{_during(slots)}GROUP BY customer_email\n"
+        f"HAVING COUNT(*) > 1\nSELECT customer_email, customer_name, COUNT(*) AS order_count\n"
+        f"ORDER BY order_count DESC"
+    )
+
+
+def _top_customers(slots: Slots) -> str:
+    order = "order_count" if slots.by_orders else "total_spent"
+    return (
+        f"FROM orders\n{_during(slots)}GROUP BY customer_email\n"
+        f"SELECT customer_email, customer_name, SUM(total_price) AS total_spent, COUNT(*) AS order_count\n"
+        f"ORDER BY {order} {_direction(slots)}\nLIMIT {slots.limit}"
+    )
+
+
+def _customer_count(slots: Slots) -> str:
+    return "FROM customers\nSELECT COUNT(*) AS total_customers"
+
+
+def _product_inventory(slots: Slots) -> str:
+    return (
+        f"FROM inventory_levels\nWHERE product_title = {_quote(slots.product)}\n"
+        f"SELECT available, incoming, committed"
+    )
+
+
+def _low_stock(slots: Slots) -> str:
+    return (
+        f"FROM inventory_levels\nSELECT product_title, available, incoming\n"
+        f"ORDER BY available ASC\nLIMIT {slots.limit}"
+    )
+
+
+def _inventory(slots: Slots) -> str:
+    return "FROM inventory_levels\nSELECT available, incoming, committed\nLIMIT 10"
+
+
+def _product_count(slots: Slots) -> str:
+    return "FROM products\nSELECT COUNT(*) AS product_count"
+
+
+# Tried in order within each intent; the first whose pattern matches and
+# whose slots are available renders the query
+TEMPLATES: List[QueryTemplate] = [
+    QueryTemplate(
+        "product_sales", "sales",
+        re.compile(r"\b(?:how (?:many|much)|sales of|sold|revenue)\b"), _product_sales
+    ),
+    QueryTemplate(
+        "top_products", "sales",
+        re.compile(r"\b(?:top|best[- ]?sell\w*|most popular|sold the most|sell(?:s|ing)? (?:the )?most|worst|least|bottom)\b"),
+        _top_products
+    ),
+    QueryTemplate(
+        "revenue", "sales",
+        re.compile(r"\b(?:revenue|sales|earn\w*|income|average order value|aov|how much)\b"), _revenue
+    ),
+    QueryTemplate("order_count", "sales", re.compile(r"\bhow many orders\b"), _order_count),
+    QueryTemplate("order_count", "general", re.compile(r"\bhow many orders\b"), _order_count),
+    QueryTemplate(
+        "repeat_customers", "customers",
+        re.compile(r"\b(?:repeat|returning|more than once|multiple orders|loyal)\b"), _repeat_customers
+    ),
+    QueryTemplate(
+        "top_customers", "customers",
+        re.compile(r"\b(?:top|best|biggest|most valuable)\b.*\bcustomers?\b"), _top_customers
+    ),
+    QueryTemplate(
+        "customer_count", "customers",
+        re.compile(r"\bhow many (?:customers|buyers|shoppers)\b"), _customer_count, dated=False
+    ),
+    QueryTemplate(
+        "product_inventory", "inventory",
+        re.compile(r"."), _product_inventory, dated=False
+    ),
+    QueryTemplate(
+        "low_stock", "inventory",
+        re.compile(r"\b(?:low|running out|run out|out of stock|lowest|reorder|restock)\b"), _low_stock, dated=False
+    ),
+    QueryTemplate(
+        "inventory", "inventory",
+        re.compile(r"\b(?:inventory|stock|available|on hand)\b"), _inventory, dated=False
+    ),
+    QueryTemplate("product_count", "products", re.compile(r"\bhow many products\b"), _product_count, dated=False),
+]
+
+# Templates that need a slot beyond the defaults
+_REQUIRES_PRODUCT = {"product_sales", "product_inventory"}
+
+
+def extract_slots(question: str, intent: Dict[str, Any]) -> Optional[Slots]:
+    """
+    Slots for a question, or None when its time period is not one the
+    query language can name (the LLM handles those)
+    """
+    time_period = intent.get("time_period")
+    period = canonical_period(time_period)
+    if time_period and period is None:
+        return None
+
+    text = question.lower()
+    limit = DEFAULT_LIMIT
+    match = _LIMIT.search(text)
+    if match:
+        value = match.group(1) or match.group(2)
+        limit = max(1, min(MAX_LIMIT, int(NUMBER_WORDS.get(value, value))))
+
+    product = intent.get("product_mentioned")
+    product = product.strip() if isinstance(product, str) and product.strip() else None
+    metrics = tuple(sorted(str(metric).lower() for metric in intent.get("metrics") or []))
+    if re.search(r"\b(?:average order value|aov)\b", text) and "aov" not in metrics:
+        metrics = tuple(sorted(metrics + ("aov",)))
+    return Slots(limit, period, product, metrics, ranks_ascending(question), bool(_BY_ORDERS.search(text)))
+
+
+def ranks_ascending(question: str) -> bool:
+    """
+    Whether a ranking question asks for the bottom of the list ("worst
+    sellers", "least popular products", "fewest orders")
+    """
+    return bool(_ASCENDING.search(question.lower()))
+
+
+def render_query(question: str, intent: Dict[str, Any]) -> Optional[str]:
+    """
+    ShopifyQL for a known question shape, or None when no template applies.
+    The same question and intent always render the same query text.
+    """
+    slots = extract_slots(question, intent)
+    if slots is None:
+        return None
+    template = _match(question.lower(), intent.get("intent_type", "general"), slots)
+    return template.render(slots) if template else None
+
+
+def _match(text: str, intent_type: str, slots: Slots) -> Optional[QueryTemplate]:
+    future = slots.period is not None and (slots.period.startswith("next") or slots.period == "tomorrow")
+    for template in TEMPLATES:
+        if template.intent_type != intent_type:
+            continue
+        if template.name in _REQUIRES_PRODUCT and slots.product is None:
+            continue
+        if template.dated and future:
+            continue
+        if template.pattern.search(text):
+            return template
+    return None
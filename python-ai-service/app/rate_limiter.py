@@ -0,0 +1,235 @@
+"""
+Shopify API rate-limit-aware request scheduling
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+import httpx
+from app.metrics import SHOPIFY_REQUESTS
+
+# Standard-plan defaults; the real capacity is learned from response headers
+REST_BUCKET_SIZE = 40
+# Every plan's REST bucket drains in about 20s (40 at 2/s standard, 80 at
+# 4/s Advanced, 400 at 20/s Plus), so the leak rate follows the capacity
+REST_DRAIN_SECONDS = 20.0
+GRAPHQL_BUCKET_SIZE = 1000
+GRAPHQL_RESTORE_RATE = 50.0
+
+
+class StoreBucket:
+    """
+    Client-side mirror of one store's leaky bucket.
+
+    Requests reserve capacity before they are sent, so concurrent callers
+    for the same store see each other's usage without waiting for a
+    response header. Server-reported levels replace the estimate when
+    they are higher.
+    """
+
+    def __init__(self, capacity: float, leak_rate: float):
+        self.capacity = capacity
+        self.leak_rate = leak_rate
+        self.used = 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def level(self, now: float) -> float:
+        return max(0.0, self.used - (now - self.updated) * self.leak_rate)
+
+    def reserve(self, cost: float, headroom: float) -> float:
+        """
+        Reserve capacity for a request and return how long to wait before sending it
+        """
+        now = time.monotonic()
+        level = self.level(now)
+        limit = self.capacity * headroom
+        wait = max(0.0, (level + cost - limit) / self.leak_rate) if self.leak_rate else 0.0
+        wait = max(wait, self.blocked_until - now)
+        self.used = level + cost
+        self.updated = now
+        return wait
+
+    def observe(self, used: float, capacity: float, leak_rate: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self.capacity = capacity
+        if leak_rate:
+            self.leak_rate = leak_rate
+        self.used = max(used, self.level(now))
+        self.updated = now
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class ShopifyRequestScheduler:
+    """
+    Paces Admin API requests per store and shares outbound slots fairly.
+
+    Each store has a REST and a GraphQL bucket tracked from
+    X-Shopify-Shop-Api-Call-Limit and the GraphQL throttleStatus cost
+    extension; requests are delayed so a store stays just under its limit.
+    Once paced, requests wait for one of a fixed number of global slots,
+    handed out round-robin across store_ids so a long backfill for one
+    store cannot starve other stores' interactive questions. 429s and
+    GraphQL THROTTLED errors are retried after Retry-After plus jitter.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        headroom: Optional[float] = None,
+        max_retries: Optional[int] = None
+    ):
+        self.max_concurrency = max_concurrency or int(os.getenv("SHOPIFY_MAX_CONCURRENCY", "10"))
+        self.headroom = headroom or float(os.getenv("SHOPIFY_BUCKET_HEADROOM", "0.9"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("SHOPIFY_MAX_RETRIES", "5"))
+        # SHOPIFY_REST_LEAK_RATE pins the leak rate instead of deriving it
+        # from each store's learned capacity
+        self.rest_leak_rate = float(os.getenv("SHOPIFY_REST_LEAK_RATE", "0")) or None
+        self._buckets: Dict[Tuple[str, str], StoreBucket] = {}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self._ring: Deque[str] = deque()
+        self._in_flight = 0
+
+    async def request(
+        self,
+        store_id: str,
+        send: Callable[[], Awaitable[httpx.Response]],
+        api: str = "rest",
+        cost: float = 1.0
+    ) -> httpx.Response:
+        """
+        Send a request for a store once its bucket and a fair slot allow it
+        """
+        bucket = self._bucket(store_id, api)
+        attempt = 0
+        while True:
+            wait = bucket.reserve(cost, self.headroom)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            await self._acquire(store_id)
+            try:
+                response = await send()
+            except httpx.HTTPError:
+                SHOPIFY_REQUESTS.labels(api, "error").inc()
+                raise
+            finally:
+                self._release()
+            SHOPIFY_REQUESTS.labels(api, str(response.status_code)).inc()
+
+            retry_after = self._observe(bucket, api, response)
+            if retry_after is None or attempt >= self.max_retries:
+                return response
+
+            delay = retry_after + random.uniform(0, max(retry_after, 0.5) * 0.5)
+            bucket.block(delay)
+            attempt += 1
+
+    def _bucket(self, store_id: str, api: str) -> StoreBucket:
+        bucket = self._buckets.get((store_id, api))
+        if bucket is None:
+            if api == "graphql":
+                bucket = StoreBucket(GRAPHQL_BUCKET_SIZE, GRAPHQL_RESTORE_RATE)
+            else:
+                bucket = StoreBucket(REST_BUCKET_SIZE, self._rest_leak_rate(REST_BUCKET_SIZE))
+            self._buckets[(store_id, api)] = bucket
+        return bucket
+
+    def _rest_leak_rate(self, capacity: float) -> float:
+        return self.rest_leak_rate or capacity / REST_DRAIN_SECONDS
+
+    def _observe(self, bucket: StoreBucket, api: str, response: httpx.Response) -> Optional[float]:
+        """
+        Update the bucket from the response and return a retry delay if throttled
+        """
+        call_limit = response.headers.get("X-Shopify-Shop-Api-Call-Limit")
+        if call_limit and "/" in call_limit:
+            used, capacity = call_limit.split("/", 1)
+            bucket.observe(float(used), float(capacity), self._rest_leak_rate(float(capacity)))
+
+        if response.status_code == 429:
+            try:
+                return float(response.headers.get("Retry-After", "2"))
+            except ValueError:
+                return 2.0
+
+        if api == "graphql" and response.status_code == 200:
+            body = _json_or_none(response)
+            cost = ((body or {}).get("extensions") or {}).get("cost") or {}
+            status = cost.get("throttleStatus")
+            if status:
+                maximum = float(status.get("maximumAvailable", GRAPHQL_BUCKET_SIZE))
+                available = float(status.get("currentlyAvailable", maximum))
+                restore = float(status.get("restoreRate", GRAPHQL_RESTORE_RATE))
+                bucket.observe(maximum - available, maximum, restore)
+                throttled = any(
+                    (error.get("extensions") or {}).get("code") == "THROTTLED"
+                    for error in (body or {}).get("errors") or []
+                )
+                if throttled:
+                    requested = float(cost.get("requestedQueryCost", 0))
+                    return max(0.0, (requested - available) / restore)
+        return None
+
+    async def _acquire(self, store_id: str) -> None:
+        if self._in_flight < self.max_concurrency and not self._ring:
+            self._in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue = self._waiters.setdefault(store_id, deque())
+        if not queue:
+            self._ring.append(store_id)
+        queue.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as we were cancelled; hand it on
+                self._release()
+            else:
+                queue.remove(waiter)
+                if not queue:
+                    self._ring.remove(store_id)
+                    del self._waiters[store_id]
+            raise
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """
+        Hand free slots to waiting stores in round-robin order
+        """
+        while self._in_flight < self.max_concurrency and self._ring:
+            store_id = self._ring.popleft()
+            queue = self._waiters.get(store_id)
+            if not queue:
+                self._waiters.pop(store_id, None)
+                continue
+            waiter = queue.popleft()
+            if queue:
+                self._ring.append(store_id)
+            else:
+                del self._waiters[store_id]
+            self._in_flight += 1
+            waiter.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self._in_flight,
+            "waiting_stores": len(self._ring),
+            "waiting_requests": sum(len(queue) for queue in self._waiters.values()),
+        }
+
+
+def _json_or_none(response: httpx.Response) -> Optional[Dict[str, Any]]:
+    try:
+        return response.json()
+    except ValueError:
+        return None
@@ -1,16 +1,29 @@
 """
 Formats raw Shopify data into business-friendly explanations
 """
-import os
-from typing import Dict, Any
-from openai import OpenAI
+from typing import AsyncIterator, Dict, Any, Optional
+from app.aggregates import aggregate_for
+from app.llm import LLMClient
+from app.metrics import stage
+from app.query_templates import ranks_ascending
+
+# Query columns whose values are item counts, and those that are amounts of money
+UNIT_COLUMNS = {"quantity", "available", "incoming", "committed", "inventory_quantity"}
+MONEY_COLUMNS = {"total_price", "line_total", "price", "total_spent"}
+# Query columns that identify a customer, by role
+CUSTOMER_FIELDS = {
+    "customer_email": "email", "email": "email",
+    "customer_name": "name", "customer_first_name": "first_name", "first_name": "first_name",
+    "customer_last_name": "last_name", "last_name": "last_name",
+    "orders_count": "orders_count", "total_spent": "total_spent", "total_price": "total_spent",
+}
 
 class ResponseFormatter:
     """
     Converts technical data into simple, layman-friendly language
     """
     
-    def __init__(self, llm_client: OpenAI):
+    def __init__(self, llm_client: Optional[LLMClient]):
         self.llm_client = llm_client
     
     async def format_response(
@@ -25,16 +38,19 @@ class ResponseFormatter:
         """
         data_type = data.get("type", "general")
         raw_data = data.get("data", [])
+        query_result = data.get("query_result")
         
         # Calculate insights based on data type
-        insights = self._calculate_insights(data_type, raw_data, intent)
+        with stage("insights"):
+            insights = self._calculate_insights(data_type, raw_data, intent, query_result, data.get("insights"))
         
         # Use LLM to format into natural language (with fallback)
-        try:
-            formatted_answer = await self._generate_answer(question, insights, data_type, intent)
-        except:
-            # If LLM fails, use fallback
-            formatted_answer = self._generate_fallback_answer(insights, data_type, question)
+        with stage("answer"):
+            try:
+                formatted_answer = await self._generate_answer(question, insights, data_type, intent)
+            except:
+                # If LLM fails, use fallback
+                formatted_answer = self._generate_fallback_answer(insights, data_type, question)
         
         confidence = intent.get("confidence", "medium")
         
@@ -42,91 +58,203 @@ class ResponseFormatter:
             "answer": formatted_answer,
             "confidence": confidence,
             "query_used": query,
-            "metadata": {
-                "data_type": data_type,
-                "records_analyzed": len(raw_data),
-                "intent": intent
-            }
+            "metadata": self.response_metadata(data, intent)
+        }
+    
+    def response_metadata(self, data: Dict[str, Any], intent: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Metadata describing the data an answer was built from
+        """
+        metadata = {
+            "data_type": data.get("type", "general"),
+            "records_analyzed": data.get("count", len(data.get("data", []))),
+            "intent": intent
         }
+        if data.get("query_result") is not None:
+            metadata["query_rows"] = data["query_result"]["row_count"]
+        if data.get("date_range"):
+            metadata["date_range"] = data["date_range"]
+        return metadata
+    
+    async def stream_answer(
+        self,
+        question: str,
+        insights: Dict[str, Any],
+        data_type: str
+    ) -> AsyncIterator[str]:
+        """
+        Yield the answer as the LLM streams it. Without an LLM, or if the
+        completion fails before its first token, the template answer is
+        yielded whole instead; a failure mid-answer ends the stream early.
+        """
+        streamed = False
+        if self.llm_client is not None:
+            try:
+                async for delta in self.llm_client.stream(
+                    messages=self._answer_messages(question, insights, data_type),
+                    temperature=0.7,
+                    max_tokens=200
+                ):
+                    streamed = True
+                    yield delta
+            except Exception:
+                if streamed:
+                    return
+        if not streamed:
+            yield self._generate_fallback_answer(insights, data_type, question)
     
     def _calculate_insights(
         self,
         data_type: str,
         raw_data: list,
-        intent: Dict[str, Any]
+        intent: Dict[str, Any],
+        query_result: Optional[Dict[str, Any]] = None,
+        insights: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
-        Calculate business insights from raw data
+        Calculate business insights from raw data, or start from insights
+        already aggregated while the data streamed in. When the ShopifyQL
+        query was executed, its result takes precedence so the answer
+        matches query_used.
         """
-        insights = {}
+        if insights is None:
+            insights = aggregate_for(data_type).update(raw_data).finalize(intent)
+        insights = dict(insights)
         
-        if data_type == "sales" and raw_data:
-            total_revenue = sum(float(order.get("total_price", 0)) for order in raw_data)
-            total_orders = len(raw_data)
-            avg_order_value = total_revenue / total_orders if total_orders > 0 else 0
-            
-            # Calculate product sales
-            product_sales = {}
-            for order in raw_data:
-                for line_item in order.get("line_items", []):
-                    product_title = line_item.get("title", "Unknown")
-                    quantity = int(line_item.get("quantity", 0))
-                    if product_title in product_sales:
-                        product_sales[product_title] += quantity
-                    else:
-                        product_sales[product_title] = quantity
-            
-            top_products = sorted(
-                product_sales.items(),
-                key=lambda x: x[1],
-                reverse=True
-            )[:5]
-            
-            insights = {
-                "total_revenue": total_revenue,
-                "total_orders": total_orders,
-                "avg_order_value": avg_order_value,
-                "top_products": top_products,
-                "time_period": intent.get("time_period", "specified period")
-            }
-            
-        elif data_type == "inventory" and raw_data:
-            total_available = sum(int(level.get("available", 0)) for level in raw_data)
-            total_incoming = sum(int(level.get("incoming", 0)) for level in raw_data)
-            total_committed = sum(int(level.get("committed", 0)) for level in raw_data)
-            
-            insights = {
-                "total_available": total_available,
-                "total_incoming": total_incoming,
-                "total_committed": total_committed,
-                "net_available": total_available - total_committed + total_incoming,
-                "product_count": len(raw_data)
-            }
-            
-        elif data_type == "customers" and raw_data:
-            total_customers = len(raw_data)
-            # Find repeat customers (orders_count > 1)
-            repeat_customers = [c for c in raw_data if c.get("orders_count", 0) > 1]
-            repeat_customers_sorted = sorted(
-                repeat_customers,
-                key=lambda x: x.get("orders_count", 0),
-                reverse=True
-            )
-            
-            insights = {
-                "total_customers": total_customers,
-                "repeat_customers_count": len(repeat_customers),
-                "repeat_customers": repeat_customers_sorted[:5]  # Top 5 repeat customers
-            }
-            
-        else:
-            insights = {
-                "message": "Data retrieved but analysis needed",
-                "record_count": len(raw_data)
+        if data_type == "sales" and "total_orders" in insights:
+            ranking = self._query_ranking(query_result, "product_title")
+            if ranking:
+                insights["top_products"], insights["top_products_metric"] = ranking
+        
+        if data_type == "customers":
+            customers = self._query_customers(query_result)
+            if customers is not None:
+                insights["query_customers"] = customers[:5]
+                insights["query_customers_count"] = query_result["row_count"]
+                insights["time_period"] = intent.get("time_period")
+        
+        if query_result is not None:
+            insights["query_result"] = {
+                "columns": query_result["columns"],
+                "rows": query_result["rows"][:20],
+                "row_count": query_result["row_count"],
+                "aggregated": query_result.get("aggregated", False)
             }
         
         return insights
     
+    def _query_ranking(
+        self,
+        query_result: Optional[Dict[str, Any]],
+        label_column: str
+    ) -> Optional[tuple]:
+        """
+        (label, value) pairs from a query grouped by label_column, in the
+        query's own order, plus a description of the value column (see
+        _metric)
+        """
+        if not query_result or label_column not in query_result["columns"]:
+            return None
+        columns = query_result["columns"]
+        rows = query_result["rows"]
+        if not rows:
+            return [], None
+        label_index = columns.index(label_column)
+        value_index = next(
+            (
+                index for index in range(len(columns))
+                if index != label_index
+                and all(isinstance(row[index], (int, float)) for row in rows)
+            ),
+            None
+        )
+        if value_index is None:
+            return None
+        pairs = [(row[label_index], row[value_index]) for row in rows[:5]]
+        return pairs, self._metric(query_result, value_index)
+    
+    def _metric(self, query_result: Dict[str, Any], index: int) -> Dict[str, str]:
+        """
+        How to label a query column's values, decided by the expression it
+        aggregates rather than its alias: "units" for item quantities
+        (SUM(quantity) AS total_sold), "money" for amounts, otherwise
+        "value"; plus a readable label from the column name
+        """
+        measures = query_result.get("measures") or []
+        measure = measures[index] if index < len(measures) else {}
+        column = measure.get("column")
+        if column in UNIT_COLUMNS:
+            kind = "units"
+        elif column in MONEY_COLUMNS and measure.get("function") != "COUNT":
+            kind = "money"
+        else:
+            kind = "value"
+        label = query_result["columns"][index]
+        if "(" in label:
+            # An unaliased expression such as COUNT(*) names the function
+            label = label.split("(", 1)[0]
+        return {"kind": kind, "label": label.replace("_", " ").lower()}
+    
+    def _format_ranking(self, pairs: list, metric: Optional[Dict[str, str]]) -> str:
+        """
+        Render ranked (name, value) pairs: in units for the default
+        quantity ranking and for queries that rank by quantity, otherwise
+        with the query's metric label
+        """
+        kind = metric["kind"] if metric else "units"
+        if kind == "units":
+            return ", ".join([f"{name} ({value} units)" for name, value in pairs])
+        if kind == "money":
+            return ", ".join([f"{name} ({metric['label']}: ${value:,.2f})" for name, value in pairs])
+        return ", ".join([f"{name} ({metric['label']}: {value})" for name, value in pairs])
+    
+    def _query_customers(self, query_result: Optional[Dict[str, Any]]) -> Optional[list]:
+        """
+        Customers listed by a query with one row per customer (grouped by
+        or selecting a customer email or name), in the query's order, with
+        the order count and amount spent when the query has them; None
+        when the query does not list customers
+        """
+        if not query_result:
+            return None
+        fields = {}
+        for index, measure in enumerate(query_result.get("measures") or []):
+            if measure.get("function") == "COUNT":
+                fields.setdefault("orders_count", index)
+            elif measure.get("function") in (None, "SUM") and measure.get("column") in CUSTOMER_FIELDS:
+                fields.setdefault(CUSTOMER_FIELDS[measure["column"]], index)
+        if "email" not in fields and "name" not in fields:
+            return None
+        return [
+            {field: row[index] for field, index in fields.items()}
+            for row in query_result["rows"]
+        ]
+    
+    def _customer_label(self, customer: Dict[str, Any], with_spent: bool = False) -> str:
+        """
+        "Name (N orders)" for a customer from the customer records or a
+        query row; with_spent adds the amount spent, for query rows whose
+        totals cover the period asked about
+        """
+        name = customer.get("name") or f"{customer.get('first_name') or ''} {customer.get('last_name') or ''}".strip()
+        name = name or customer.get("email") or "Unknown customer"
+        details = []
+        if customer.get("orders_count") is not None:
+            details.append(f"{customer['orders_count']} orders")
+        if with_spent and customer.get("total_spent") is not None:
+            details.append(f"${float(customer['total_spent']):,.2f} spent")
+        return f"{name} ({', '.join(details)})" if details else name
+    
+    def _format_query_result(self, query_result: Dict[str, Any], limit: int = 10) -> str:
+        """
+        Render query rows as "column: value" lines
+        """
+        lines = [
+            ", ".join(f"{column}: {value}" for column, value in zip(query_result["columns"], row))
+            for row in query_result["rows"][:limit]
+        ]
+        return "\n".join(lines)
+    
     async def _generate_answer(
         self,
         question: str,
@@ -137,6 +265,20 @@ class ResponseFormatter:
         """
         Use LLM to generate a natural language answer
         """
+        try:
+            response = await self.llm_client.complete(
+                messages=self._answer_messages(question, insights, data_type),
+                temperature=0.7,
+                max_tokens=200
+            )
+            
+            return response.choices[0].message.content.strip()
+            
+        except Exception as e:
+            # Fallback to template-based response
+            return self._generate_fallback_answer(insights, data_type, question)
+    
+    def _answer_messages(self, question: str, insights: Dict[str, Any], data_type: str) -> list:
         prompt = f"""Based on the following question and data insights, provide a clear, business-friendly answer.
 
 Original Question: "{question}"
@@ -148,25 +290,13 @@ Provide a concise, helpful answer (2-3 sentences) that directly addresses the qu
 Use simple language that a business owner would understand. 
 If the data suggests a recommendation, include it."""
 
-        try:
-            response = self.llm_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4"),
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful business analytics assistant. Provide clear, actionable insights in simple language."
-                    },
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=200
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            # Fallback to template-based response
-            return self._generate_fallback_answer(insights, data_type, question)
+        return [
+            {
+                "role": "system",
+                "content": "You are a helpful business analytics assistant. Provide clear, actionable insights in simple language."
+            },
+            {"role": "user", "content": prompt}
+        ]
     
     def _format_insights_for_llm(self, insights: Dict[str, Any], data_type: str) -> str:
         """
@@ -177,9 +307,9 @@ If the data suggests a recommendation, include it."""
             Total Revenue: ${insights.get('total_revenue', 0):.2f}
             Total Orders: {insights.get('total_orders', 0)}
             Average Order Value: ${insights.get('avg_order_value', 0):.2f}
-            Top Products: {', '.join([f'{p[0]} ({p[1]} units)' for p in insights.get('top_products', [])])}
+            Top Products: {self._format_ranking(insights.get('top_products', []), insights.get('top_products_metric'))}
             Time Period: {insights.get('time_period', 'N/A')}
-            """
+            """ + self._format_query_result_for_llm(insights)
         elif data_type == "inventory":
             return f"""
             Total Available Units: {insights.get('total_available', 0)}
@@ -187,22 +317,37 @@ If the data suggests a recommendation, include it."""
             Committed Units: {insights.get('total_committed', 0)}
             Net Available: {insights.get('net_available', 0)}
             Products Tracked: {insights.get('product_count', 0)}
-            """
+            """ + self._format_query_result_for_llm(insights)
         elif data_type == "customers":
+            if insights.get("query_customers") is not None:
+                # The executed query defines the customers (and period) asked about
+                customer_list = ", ".join(self._customer_label(c, with_spent=True) for c in insights["query_customers"])
+                return f"""
+            Customers Matching the Query: {insights['query_customers_count']}
+            Time Period: {insights.get('time_period') or 'all time'}
+            Customers: {customer_list or 'none'}
+            """ + self._format_query_result_for_llm(insights)
             repeat_info = ""
             if insights.get('repeat_customers'):
                 repeat_list = ", ".join([
-                    f"{c.get('first_name', '')} {c.get('last_name', '')} ({c.get('orders_count', 0)} orders)"
-                    for c in insights.get('repeat_customers', [])[:3]
+                    self._customer_label(c) for c in insights.get('repeat_customers', [])[:3]
                 ])
                 repeat_info = f"\nRepeat Customers: {repeat_list}"
             return f"""
             Total Customers: {insights.get('total_customers', 0)}
             Repeat Customers: {insights.get('repeat_customers_count', 0)}{repeat_info}
-            """
+            """ + self._format_query_result_for_llm(insights)
+        elif insights.get("query_result"):
+            return self._format_query_result_for_llm(insights)
         else:
             return str(insights)
     
+    def _format_query_result_for_llm(self, insights: Dict[str, Any]) -> str:
+        query_result = insights.get("query_result")
+        if not query_result or not query_result["rows"]:
+            return ""
+        return f"Query Result ({query_result['row_count']} rows):\n{self._format_query_result(query_result)}\n"
+    
     def _generate_fallback_answer(
         self,
         insights: Dict[str, Any],
@@ -220,9 +365,11 @@ If the data suggests a recommendation, include it."""
             
             answer = f"Based on your sales data, you generated ${revenue:.2f} in revenue from {orders} orders, with an average order value of ${avg_order:.2f}."
             
-            if top_products and ("top" in question.lower() or "selling" in question.lower() or "best" in question.lower()):
-                product_list = ", ".join([f"{name} ({qty} units)" for name, qty in top_products[:5]])
-                answer += f" Your top selling products were: {product_list}."
+            ascending = ranks_ascending(question)
+            if top_products and (ascending or "top" in question.lower() or "selling" in question.lower() or "best" in question.lower()):
+                product_list = self._format_ranking(top_products[:5], insights.get("top_products_metric"))
+                ranking = "lowest" if ascending and "top_products_metric" in insights else "top"
+                answer += f" Your {ranking} selling products were: {product_list}."
             
             return answer
         
@@ -259,16 +406,36 @@ If the data suggests a recommendation, include it."""
             repeat_count = insights.get("repeat_customers_count", 0)
             repeat_customers = insights.get("repeat_customers", [])
             
+            if insights.get("query_customers") is not None:
+                # Answer from the executed query so the answer matches query_used
+                count = insights["query_customers_count"]
+                period = f" ({insights['time_period']})" if insights.get("time_period") else ""
+                names = ", ".join(self._customer_label(c, with_spent=True) for c in insights["query_customers"][:3])
+                if "repeat" in question.lower():
+                    answer = f"You have {count} repeat customers{period}."
+                    if names:
+                        answer += f" Your top repeat customers are: {names}."
+                else:
+                    answer = f"Your query found {count} customers{period}."
+                    if names:
+                        answer += f" Your top customers are: {names}."
+                return answer
+            
             if "repeat" in question.lower():
                 answer = f"You have {repeat_count} repeat customers out of {total} total customers."
                 if repeat_customers:
                     top_repeat = repeat_customers[:3]
-                    names = ", ".join([f"{c.get('first_name', '')} {c.get('last_name', '')} ({c.get('orders_count', 0)} orders)" for c in top_repeat])
+                    names = ", ".join([self._customer_label(c) for c in top_repeat])
                     answer += f" Your top repeat customers are: {names}."
                 return answer
             else:
                 return f"Your store has {total} customers in the system."
         
+        elif insights.get("query_result") and insights["query_result"]["aggregated"] and insights["query_result"]["rows"]:
+            query_result = insights["query_result"]
+            answer = f"Your query returned {query_result['row_count']} row(s). "
+            return answer + self._format_query_result(query_result, limit=5).replace("\n", "; ") + "."
+        
         else:
             return "I've retrieved the data, but need more context to provide a specific answer. Please try rephrasing your question."
 
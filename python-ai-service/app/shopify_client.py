@@ -1,355 +1,941 @@
 """
 Shopify API client for executing queries and fetching data
 """
+import asyncio
+import logging
 import os
+import time
 import httpx
-from typing import Dict, Any, Optional
+from functools import partial
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Dict, Any, AsyncIterator, Callable, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from app.aggregates import aggregate_for
+from app.columnar import ColumnarSalesAggregate, ColumnCache, columnar_available, columnar_enabled, sales_insights
+from app.bulk_operations import (
+    BULK_OPERATION_STATUS,
+    CANCEL_BULK_OPERATION,
+    RUN_BULK_QUERY,
+    BulkOperationBusy,
+    BulkOperationError,
+    BulkOperationTimeout,
+    build_bulk_query,
+    is_busy_error,
+    iter_bulk_records,
+)
+from app.http_pool import http_limits, http_timeout
+from app.local_store import LocalStore
+from app.rate_limiter import ShopifyRequestScheduler
+from app.materialized import MaterializedViews
+from app.metrics import SHOPIFY_REQUESTS
+from app.parallel import ParallelAggregator
+from app.planner import FETCH_FIELDS
+from app.singleflight import SingleFlight
+from app.synthetic import SyntheticBackend
+from app.mock_data import MOCK_CUSTOMERS, MOCK_INVENTORY, MOCK_NOW, MOCK_ORDERS, MOCK_PRODUCTS
+from app.shopifyql import Plan, QueryError, QueryExecution, compile_query
+from app.time_periods import DateRange, filter_orders, padded_bounds, parse_timestamp, resolve_period
+
+# Only request the fields the insight calculations read
+ORDER_FIELDS = "id,order_number,total_price,created_at,updated_at,line_items,customer"
+CUSTOMER_FIELDS = "id,email,first_name,last_name,orders_count,total_spent,created_at,updated_at"
+PRODUCT_FIELDS = "id,title,vendor,product_type,variants,created_at,updated_at"
+
+logger = logging.getLogger(__name__)
+
+# Shopify caps inventory_item_ids filters at 50 ids per request
+INVENTORY_ITEM_BATCH = 50
+
+# Source resource each intent's fetch returns, for reuse by the query engine
+INTENT_SOURCES = {
+    "sales": "orders",
+    "customers": "customers",
+    "inventory": "inventory_levels",
+    "products": "products",
+}
 
 class ShopifyClient:
     """
     Handles communication with Shopify APIs
     """
-    
-    def __init__(self):
-        self.base_url = "https://{shop}.myshopify.com/admin/api/2024-01"
-    
+
+    def __init__(
+        self,
+        http_client: Optional[httpx.AsyncClient] = None,
+        scheduler: Optional[ShopifyRequestScheduler] = None
+    ):
+        # SHOPIFY_API_BASE_URL lets tests and benchmarks point at a local fake Admin API
+        self.base_url = os.getenv(
+            "SHOPIFY_API_BASE_URL",
+            "https://{shop}.myshopify.com/admin/api/2024-01"
+        )
+        self.page_size = int(os.getenv("SHOPIFY_PAGE_SIZE", "250"))
+        # SHOPIFY_BULK_MODE: "auto" uses bulk operations for long order
+        # ranges, "always" for every resource that supports it, "never" disables
+        self.bulk_mode = os.getenv("SHOPIFY_BULK_MODE", "auto")
+        self.bulk_min_days = int(os.getenv("SHOPIFY_BULK_MIN_DAYS", "60"))
+        self.bulk_poll_interval = float(os.getenv("SHOPIFY_BULK_POLL_INTERVAL", "1"))
+        self.bulk_timeout = float(os.getenv("SHOPIFY_BULK_TIMEOUT", "600"))
+        # Shopify runs one bulk query per shop at a time; fetches that find
+        # their store's slot taken use REST pages instead of queueing
+        self._bulk_locks: Dict[str, asyncio.Lock] = {}
+        # Time periods resolve in each shop's own timezone (shop.json
+        # iana_timezone); this is used for demo data and when lookup fails
+        self.default_timezone = os.getenv("SHOPIFY_DEFAULT_TIMEZONE", "UTC")
+        self._timezones: Dict[str, tzinfo] = {}
+        # One pooled client per process; keep-alive connections are reused
+        # across requests instead of paying a TLS handshake each time
+        self.http_client = http_client or httpx.AsyncClient(
+            limits=http_limits(),
+            timeout=http_timeout(),
+            http2=True
+        )
+        # Paces every Admin API call against the store's rate-limit bucket
+        self.scheduler = scheduler or ShopifyRequestScheduler()
+        # Optional local copy of store data (LOCAL_STORE_DIR); when a store
+        # has been synced, questions read from it instead of calling Shopify
+        self.local_store = LocalStore.from_env()
+        self.local_sync_interval = float(os.getenv("LOCAL_STORE_SYNC_INTERVAL", "300"))
+        self._sync_tasks: Dict[str, asyncio.Task] = {}
+        # Columnar copies of large order sets, reused until the data changes
+        self.column_cache = ColumnCache()
+        # Bumped by webhooks so data versions change between syncs
+        self._revisions: Dict[Tuple[str, str], int] = {}
+        self._webhook_locks: Dict[str, asyncio.Lock] = {}
+        # Identical data requests in flight share one fetch
+        self.data_flights = SingleFlight()
+        # Precomputed data for the most common questions, per active store
+        self.views = MaterializedViews.from_env(self._materialize)
+        # Process pool for sharded aggregation of very large local stores
+        self.parallel = ParallelAggregator.from_env() if self.local_store is not None else None
+        # SHOPIFY_DATA_BACKEND=synthetic serves seeded generated stores of
+        # any size in place of Shopify, for load and scale testing
+        self.synthetic = SyntheticBackend.from_env()
+
+    def start(self) -> None:
+        """
+        Start background work tied to the server's lifetime
+        """
+        if self.views is not None:
+            self.views.start()
+
+    async def aclose(self) -> None:
+        """
+        Stop background syncs, view refreshes and worker processes and close
+        the pooled HTTP client
+        """
+        if self.views is not None:
+            await self.views.stop()
+        for task in self._sync_tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._sync_tasks.values(), return_exceptions=True)
+        if self.parallel is not None:
+            self.parallel.shutdown()
+        if self.local_store is not None:
+            self.local_store.close()
+        await self.http_client.aclose()
+
     async def execute_query(self, store_id: str, query: str, intent: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Execute ShopifyQL query or use REST API based on intent
+        Fetch the data behind an intent, then run the ShopifyQL query over it
+        """
+        data = await self.fetch_data(store_id, intent, query)
+        return await self.run_query(store_id, query, data)
+
+    async def fetch_data(
+        self,
+        store_id: str,
+        intent: Dict[str, Any],
+        query: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Fetch the data behind an intent (see _fetch_data). Requests matching
+        a materialized view are answered from it. Concurrent identical
+        requests share one fetch; each caller gets its own copy of the
+        top-level dict, since run_query attaches its result to it.
+        """
+        if self.views is not None and query:
+            view = self.views.get(store_id, intent, query)
+            if view is not None:
+                return view
+        key = (
+            store_id,
+            *(intent.get(field) for field in FETCH_FIELDS),
+            " ".join(query.split()) if query is not None else None
+        )
+        return dict(await self.data_flights.do(key, lambda: self._fetch_data(store_id, intent, query)))
+
+    async def _fetch_data(
+        self,
+        store_id: str,
+        intent: Dict[str, Any],
+        query: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Stream the records behind an intent into its insight aggregate, one
+        page at a time while the next page is being fetched, so memory
+        grows with distinct products rather than with orders.
+
+        A query that reads the same resource is executed over the same
+        stream. With query=None (the fused pipeline starts fetching before
+        the query exists) the records are kept under "data" for run_query.
+        Very large local-store order sets are instead sharded across worker
+        processes (see ParallelAggregator) and their partials merged here.
         """
-        # For this implementation, we'll use REST API as ShopifyQL requires GraphQL
-        # In production, you'd use Shopify's GraphQL Analytics API
-        
         intent_type = intent.get("intent_type", "general")
-        
-        if intent_type == "inventory":
-            return await self._fetch_inventory_data(store_id, intent)
-        elif intent_type == "sales":
-            return await self._fetch_sales_data(store_id, intent)
-        elif intent_type == "customers":
-            return await self._fetch_customer_data(store_id, intent)
-        elif intent_type == "products":
-            return await self._fetch_product_data(store_id, intent)
-        else:
+        if intent_type not in INTENT_SOURCES:
             return await self._fetch_general_data(store_id)
-    
-    async def _fetch_inventory_data(self, store_id: str, intent: Dict[str, Any]) -> Dict[str, Any]:
+
+        data: Dict[str, Any] = {"type": intent_type}
+        # Orders are narrowed to the intent's time period; other resources
+        # have no meaningful created_at range
+        window = await self.date_range(store_id, intent) if intent_type == "sales" else None
+        if window is not None:
+            data["date_range"] = window.as_dict()
+        execution = None
+        if query:
+            plan = await self._compile(store_id, query)
+            if plan is None:
+                data["query_result"] = None
+            elif plan.source == INTENT_SOURCES[intent_type] and _within_window(window, plan):
+                execution = QueryExecution(plan)
+        keep_records = query is None
+
+        aggregate, column_key = await self._insight_aggregate(store_id, intent_type, window)
+        cached = self.column_cache.get(column_key) if column_key else None
+        records: List[Dict[str, Any]] = []
+        count = 0
+        id_range = None
+        if cached is None or execution is not None:
+            id_range = None if keep_records else await self._shardable_orders(store_id, intent_type)
+        if id_range is not None:
+            sharded, states = await self.parallel.aggregate_orders(
+                self.local_store.path(store_id),
+                id_range,
+                None if cached is not None else ("columnar" if column_key else "dict"),
+                query if execution is not None else None,
+                execution.plan if execution is not None else None,
+                window
+            )
+            if sharded is not None:
+                aggregate = sharded
+            for groups, results in states:
+                execution.merge_state(groups, results)
+            count = id_range["count"] if sharded is None else sharded.count
+        elif cached is None or execution is not None or keep_records:
+            async for page in _prefetch(self._intent_pages(store_id, intent_type, intent, window)):
+                page = filter_orders(page, window)
+                count += len(page)
+                if cached is None:
+                    aggregate.update(page)
+                if execution is not None:
+                    execution.feed(page)
+                if keep_records:
+                    records.extend(page)
+
+        if column_key is None:
+            data["insights"] = aggregate.finalize(intent)
+        else:
+            columns = cached or aggregate.columns()
+            if cached is None and columnar_enabled(columns.count):
+                self.column_cache.set(column_key, columns)
+            count = columns.count
+            data["insights"] = sales_insights(columns, intent)
+
+        data["count"] = count
+        if intent_type == "sales":
+            data["time_period"] = intent.get("time_period", "last 30 days")
+        if keep_records:
+            data["data"] = records
+        if execution is not None:
+            data["query_result"] = execution.result()
+        return data
+
+    async def _materialize(self, store_id: str, intent: Dict[str, Any], query: str) -> Dict[str, Any]:
+        """
+        Complete data for a materialized view, bypassing the views themselves
+        """
+        return await self.run_query(store_id, query, await self._fetch_data(store_id, intent, query))
+
+    async def run_query(self, store_id: str, query: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute a ShopifyQL query with the local engine and attach its result
+        to the fetched data as "query_result". Records kept by fetch_data are
+        reused when the query reads the same resource; otherwise the query's
+        source is streamed with its created_at bounds pushed into the request.
+        Queries outside the supported subset leave the data unchanged.
+        """
+        if not query or "query_result" in data:
+            return data
+        plan = await self._compile(store_id, query)
+        if plan is None:
+            return data
+
+        execution = QueryExecution(plan)
+        if (
+            "data" in data
+            and INTENT_SOURCES.get(data.get("type")) == plan.source
+            and _within_window(DateRange.from_dict(data.get("date_range")), plan)
+        ):
+            execution.feed(data["data"])
+        else:
+            async for page in _prefetch(self._query_source_pages(store_id, plan)):
+                execution.feed(page)
+        data["query_result"] = execution.result()
+        return data
+
+    async def _compile(self, store_id: str, query: str) -> Optional[Plan]:
+        try:
+            return compile_query(query, self._now(store_id), await self.store_timezone(store_id))
+        except QueryError as e:
+            logger.info("ShopifyQL not executed locally: %s", e)
+            return None
+
+    def _now(self, store_id: str) -> Optional[datetime]:
+        """
+        The time relative dates resolve against: demo and synthetic data
+        are frozen snapshots, so their own "now"; None (the current time)
+        for real stores
+        """
+        if self.synthetic is not None:
+            return self.synthetic.now
+        return None if self._access_token(store_id) else datetime.fromisoformat(MOCK_NOW.replace("Z", "+00:00"))
+
+    async def store_timezone(self, store_id: str) -> tzinfo:
+        """
+        The shop's IANA timezone, looked up once per store
+        """
+        if store_id in self._timezones:
+            return self._timezones[store_id]
+        name = self.default_timezone
+        if self.synthetic is None and self._access_token(store_id):
+            url = f"{self._api_url(store_id)}/shop.json"
+            headers = {"X-Shopify-Access-Token": self._access_token(store_id)}
+            try:
+                response = await self.scheduler.request(
+                    store_id,
+                    lambda: self.http_client.get(url, params={"fields": "iana_timezone"}, headers=headers)
+                )
+                response.raise_for_status()
+                name = response.json()["shop"]["iana_timezone"] or name
+            except (httpx.HTTPError, KeyError, TypeError, ValueError) as e:
+                logger.warning("Timezone lookup failed for %s, using %s: %s", store_id, name, e)
+        try:
+            tz = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning("Unknown timezone %r for %s, using UTC", name, store_id)
+            tz = timezone.utc
+        self._timezones[store_id] = tz
+        return tz
+
+    async def date_range(self, store_id: str, intent: Dict[str, Any]) -> Optional[DateRange]:
+        """
+        The UTC range of data behind an intent's time period, resolved in the
+        store's timezone; for a future period ("next month") the equally long
+        range of history before it. None when there is no usable period.
+        """
+        time_period = intent.get("time_period")
+        if not time_period:
+            return None
+        return resolve_period(
+            time_period, await self.store_timezone(store_id), self._now(store_id), history=True
+        )
+
+    async def _insight_aggregate(
+        self,
+        store_id: str,
+        intent_type: str,
+        window: Optional[DateRange] = None
+    ) -> Tuple[Any, Optional[Tuple[str, Any, Optional[DateRange]]]]:
+        """
+        Aggregate for an intent's insights, plus the column cache key when
+        the columnar sales aggregate is used. That needs numpy and data with
+        a version to cache under: demo data never changes, and local-store
+        data changes only when a sync completes or a webhook is applied.
+        Orders fetched live from Shopify use the dict aggregate, since their
+        totals would not be reused. Totals are cached per date range.
+        """
+        if intent_type == "sales" and columnar_available():
+            version = await self._data_version(store_id, "orders")
+            if version is not None:
+                return ColumnarSalesAggregate(), (store_id, version, window)
+        return aggregate_for(intent_type), None
+
+    async def _shardable_orders(self, store_id: str, intent_type: str) -> Optional[Dict[str, int]]:
+        """
+        The local-store order id range when a sales fetch is large enough
+        (PARALLEL_MIN_ORDERS) to aggregate across worker processes. Smaller
+        stores, demo and synthetic data and live Shopify fetches stay in-process.
+        """
+        if self.parallel is None or intent_type != "sales" or self.synthetic is not None:
+            return None
+        if not self._access_token(store_id):
+            return None
+        if not await self._serve_locally(store_id, "orders"):
+            return None
+        id_range = await self.local_store.order_id_range(store_id)
+        if id_range is None or not self.parallel.should_shard(id_range["count"]):
+            return None
+        return id_range
+
+    async def _data_version(self, store_id: str, resource: str) -> Optional[Any]:
+        if self.synthetic is not None:
+            return "synthetic"
+        if not self._access_token(store_id):
+            return "demo"
+        if self.local_store is not None:
+            state = await self.local_store.sync_state(store_id, resource)
+            if state is not None:
+                return state["synced_at"], self._revisions.get((store_id, resource), 0)
+        return None
+
+    async def apply_webhook(self, store_id: str, resource: str, record: Dict[str, Any]) -> None:
+        """
+        Apply a webhook's record to the store's local copy, if it has been
+        synced. A new order is added to the cached sales totals whose
+        date range contains it (totals for other ranges carry over as
+        they are); any other change bumps the data revision, so columns
+        built before it are not reused.
+        """
+        if self.local_store is None or await self.local_store.sync_state(store_id, resource) is None:
+            return
+        lock = self._webhook_locks.setdefault(store_id, asyncio.Lock())
+        async with lock:
+            old_key = (store_id, await self._data_version(store_id, resource))
+            existing = None
+            if resource == "orders":
+                existing = await self.local_store.upsert_orders(store_id, [record])
+            elif resource == "customers":
+                await self.local_store.upsert_customers(store_id, [record])
+            else:
+                await self.local_store.update_inventory_level(store_id, record)
+            self._revisions[(store_id, resource)] = self._revisions.get((store_id, resource), 0) + 1
+
+            if resource != "orders" or existing:
+                return
+            new_version = await self._data_version(store_id, resource)
+            created_at = parse_timestamp(record.get("created_at"))
+            for key, columns in self.column_cache.items():
+                if key[:2] != old_key:
+                    continue
+                window = key[2]
+                if window is None or (created_at is not None and window.contains(created_at)):
+                    columns = columns.appended([record])
+                self.column_cache.set((store_id, new_version, window), columns)
+
+    def _intent_pages(
+        self,
+        store_id: str,
+        intent_type: str,
+        intent: Dict[str, Any],
+        window: Optional[DateRange] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        if intent_type == "sales" and window is not None:
+            return self._sales_pages(store_id, intent, created_at_min=window.start, created_at_max=window.end)
+        pages = {
+            "inventory": self._inventory_pages,
+            "sales": self._sales_pages,
+            "customers": self._customer_pages,
+            "products": self._product_pages,
+        }[intent_type]
+        return pages(store_id, intent)
+
+    def _query_source_pages(self, store_id: str, plan: Plan) -> AsyncIterator[List[Dict[str, Any]]]:
+        if plan.source == "orders":
+            return self._sales_pages(
+                store_id,
+                {},
+                created_at_min=plan.pushdown.get("created_at_min"),
+                created_at_max=plan.pushdown.get("created_at_max")
+            )
+        if plan.source == "customers":
+            return self._customer_pages(store_id, {})
+        if plan.source == "inventory_levels":
+            return self._inventory_pages(store_id, {"product_mentioned": plan.pushdown.get("product_title")})
+        return self._product_pages(store_id, {})
+
+    def _access_token(self, store_id: str) -> str:
+        """
+        Admin API access token for a store; empty means demo data is served
+        """
+        return os.getenv("SHOPIFY_ACCESS_TOKEN", "")
+
+    def _api_url(self, store_id: str) -> str:
+        """
+        Admin API base URL for a store id such as "example-store.myshopify.com"
+        """
+        shop = store_id.strip().lower()
+        shop = shop.split("://", 1)[-1].split("/", 1)[0]
+        shop = shop.removesuffix(".myshopify.com")
+        return self.base_url.format(shop=shop)
+
+    async def iter_pages(
+        self,
+        store_id: str,
+        resource: str,
+        params: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield one page of records at a time from a REST list endpoint,
+        following the Link: rel="next" page_info cursor until exhausted
+        """
+        url = f"{self._api_url(store_id)}/{resource}.json"
+        page_params = {"limit": self.page_size, **(params or {})}
+        headers = {"X-Shopify-Access-Token": self._access_token(store_id)}
+
+        while url:
+            response = await self.scheduler.request(
+                store_id,
+                lambda: self.http_client.get(url, params=page_params, headers=headers)
+            )
+            response.raise_for_status()
+            yield response.json().get(resource, [])
+
+            # The next URL already carries page_info and limit; Shopify rejects
+            # other filters alongside page_info
+            url = response.links.get("next", {}).get("url")
+            page_params = None
+
+    async def graphql(
+        self,
+        store_id: str,
+        query: str,
+        variables: Optional[Dict[str, Any]] = None,
+        cost: float = 10.0
+    ) -> Dict[str, Any]:
+        """
+        Run an Admin GraphQL request and return its data
+        """
+        url = f"{self._api_url(store_id)}/graphql.json"
+        headers = {"X-Shopify-Access-Token": self._access_token(store_id)}
+        response = await self.scheduler.request(
+            store_id,
+            lambda: self.http_client.post(
+                url,
+                json={"query": query, "variables": variables or {}},
+                headers=headers
+            ),
+            api="graphql",
+            cost=cost
+        )
+        response.raise_for_status()
+        body = response.json()
+        if body.get("errors"):
+            raise BulkOperationError(f"GraphQL error: {body['errors']}")
+        return body.get("data") or {}
+
+    async def bulk_pages(
+        self,
+        store_id: str,
+        resource: str,
+        search: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Ingest a resource through a GraphQL bulk operation: start the
+        operation, poll until it completes, then stream-parse the JSONL
+        result into pages of REST-shaped records. Raises BulkOperationBusy,
+        before yielding anything, when the store already has one running.
+        """
+        url = await self._run_bulk_operation(store_id, resource, search)
+        if not url:
+            # Completed without matching any objects
+            return
+
+        # The result URL is a signed storage link; no Admin API token or
+        # rate-limit slot is needed to download it
+        async with self.http_client.stream("GET", url) as response:
+            SHOPIFY_REQUESTS.labels("bulk_download", str(response.status_code)).inc()
+            response.raise_for_status()
+            async for page in iter_bulk_records(response.aiter_lines(), resource, self.page_size):
+                yield page
+
+    async def _bulk_or_rest(
+        self,
+        store_id: str,
+        resource: str,
+        search: Optional[str],
+        rest_pages: Callable[[], AsyncIterator[List[Dict[str, Any]]]]
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Pages from a bulk operation, or from `rest_pages` when the store
+        already has one running
+        """
+        try:
+            async for page in self.bulk_pages(store_id, resource, search):
+                yield page
+        except BulkOperationBusy as e:
+            logger.info("Fetching %s for %s over REST: %s", resource, store_id, e)
+            async for page in rest_pages():
+                yield page
+
+    async def _run_bulk_operation(self, store_id: str, resource: str, search: Optional[str]) -> Optional[str]:
+        """
+        Start a bulk operation and wait for its result URL, holding the
+        store's bulk slot meanwhile. If the caller is cancelled or gives up
+        waiting, the operation is cancelled on Shopify too, so it does not
+        keep the shop's only bulk slot.
+        """
+        lock = self._bulk_locks.setdefault(store_id, asyncio.Lock())
+        if lock.locked():
+            raise BulkOperationBusy(f"A bulk operation is already running for {store_id}")
+        async with lock:
+            data = await self.graphql(store_id, RUN_BULK_QUERY, {"query": build_bulk_query(resource, search)})
+            result = data.get("bulkOperationRunQuery") or {}
+            if result.get("userErrors"):
+                error = BulkOperationBusy if is_busy_error(result["userErrors"]) else BulkOperationError
+                raise error(f"Could not start bulk operation: {result['userErrors']}")
+            operation_id = result["bulkOperation"]["id"]
+            try:
+                return await self._await_bulk_operation(store_id, operation_id)
+            except (asyncio.CancelledError, BulkOperationTimeout):
+                await asyncio.shield(self._cancel_bulk_operation(store_id, operation_id))
+                raise
+
+    async def _cancel_bulk_operation(self, store_id: str, operation_id: str) -> None:
+        try:
+            await self.graphql(store_id, CANCEL_BULK_OPERATION, {"id": operation_id}, cost=1.0)
+        except (httpx.HTTPError, BulkOperationError) as e:
+            logger.warning("Could not cancel bulk operation %s for %s: %s", operation_id, store_id, e)
+
+    async def _await_bulk_operation(self, store_id: str, operation_id: str) -> Optional[str]:
+        """
+        Poll a bulk operation until it finishes and return its result URL
+        """
+        deadline = time.monotonic() + self.bulk_timeout
+        interval = self.bulk_poll_interval
+        while True:
+            data = await self.graphql(store_id, BULK_OPERATION_STATUS, {"id": operation_id}, cost=1.0)
+            operation = data.get("node") or {}
+            status = operation.get("status")
+            if status == "COMPLETED":
+                return operation.get("url")
+            if status in ("FAILED", "CANCELED", "CANCELLED", "EXPIRED"):
+                raise BulkOperationError(
+                    f"Bulk operation {operation_id} {status.lower()}: {operation.get('errorCode')}"
+                )
+            if time.monotonic() >= deadline:
+                raise BulkOperationTimeout(f"Bulk operation {operation_id} timed out")
+            await asyncio.sleep(interval)
+            interval = min(interval * 1.5, 10.0)
+
+    def _use_bulk(
+        self,
+        resource: str,
+        created_at_min: Optional[datetime] = None,
+        created_at_max: Optional[datetime] = None
+    ) -> bool:
         """
-        Fetch inventory data from Shopify
+        Whether a fetch should go through a bulk operation instead of REST
+        pages; in auto mode, only for orders over a long enough created_at range
+        """
+        if self.bulk_mode == "always":
+            return True
+        if self.bulk_mode != "auto" or resource != "orders" or created_at_min is None:
+            return False
+        span = (created_at_max or datetime.now(timezone.utc)) - created_at_min
+        return span >= timedelta(days=self.bulk_min_days)
+
+    async def sync_store(self, store_id: str) -> None:
+        """
+        Bring the local analytical store up to date. Orders and customers are
+        fetched incrementally from their updated_at_min watermark (the first
+        sync backfills through a bulk operation); inventory levels are small
+        and are refreshed in full.
+        """
+        for resource in ("orders", "customers"):
+            state = await self.local_store.sync_state(store_id, resource)
+            watermark = state["watermark"] if state else None
+            if resource == "orders":
+                rest_pages = partial(self._rest_order_pages, store_id, updated_at_min=watermark)
+            else:
+                rest_pages = partial(self._rest_customer_pages, store_id, updated_at_min=watermark)
+            if watermark is None and self.bulk_mode != "never":
+                pages = self._bulk_or_rest(store_id, resource, None, rest_pages)
+            else:
+                pages = rest_pages()
+
+            upsert = self.local_store.upsert_orders if resource == "orders" else self.local_store.upsert_customers
+            async for page in pages:
+                await upsert(store_id, page)
+                watermark = _latest_updated_at(watermark, page)
+            await self.local_store.mark_synced(store_id, resource, watermark)
+
+        replace = True
+        async for levels in self._remote_inventory_pages(store_id, {}):
+            await self.local_store.upsert_inventory(store_id, levels, replace=replace)
+            replace = False
+        if replace:
+            await self.local_store.upsert_inventory(store_id, [], replace=True)
+        await self.local_store.mark_synced(store_id, "inventory_levels", None)
+        if self.views is not None:
+            # Serve fresh local data until the views catch up
+            self.views.invalidate(store_id)
+
+    async def _serve_locally(self, store_id: str, resource: str) -> bool:
+        """
+        Whether a resource can be read from the local store. Schedules a
+        background sync when the local copy is missing or stale.
+        """
+        if self.local_store is None:
+            return False
+        state = await self.local_store.sync_state(store_id, resource)
+        if state is None or time.time() - state["synced_at"] > self.local_sync_interval:
+            self._schedule_sync(store_id)
+        return state is not None
+
+    def _schedule_sync(self, store_id: str) -> None:
+        task = self._sync_tasks.get(store_id)
+        if task is None or task.done():
+            self._sync_tasks[store_id] = asyncio.create_task(self._sync_in_background(store_id))
+
+    async def _sync_in_background(self, store_id: str) -> None:
+        try:
+            await self.sync_store(store_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Local store sync failed for %s", store_id)
+
+    async def _inventory_pages(self, store_id: str, intent: Dict[str, Any]) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream inventory levels, labelled with their product title
         """
-        access_token = os.getenv("SHOPIFY_ACCESS_TOKEN", "")
         product_name = intent.get("product_mentioned")
-        
-        # Return mock inventory data
-        mock_inventory = [
-            {
-                "inventory_item_id": 1,
-                "location_id": 1,
-                "available": 45,
-                "incoming": 50,
-                "committed": 5,
-                "product_title": "Coffee Beans Premium"
-            },
-            {
-                "inventory_item_id": 2,
-                "location_id": 1,
-                "available": 23,
-                "incoming": 0,
-                "committed": 8,
-                "product_title": "Vintage Mug Set"
-            },
-            {
-                "inventory_item_id": 3,
-                "location_id": 1,
-                "available": 12,
-                "incoming": 20,
-                "committed": 3,
-                "product_title": "Artisan Tea Collection"
-            },
-            {
-                "inventory_item_id": 4,
-                "location_id": 1,
-                "available": 8,
-                "incoming": 0,
-                "committed": 2,
-                "product_title": "Espresso Machine"
-            },
-            {
-                "inventory_item_id": 5,
-                "location_id": 1,
-                "available": 34,
-                "incoming": 15,
-                "committed": 6,
-                "product_title": "Coffee Grinder"
-            },
-            {
-                "inventory_item_id": 6,
-                "location_id": 1,
-                "available": 67,
-                "incoming": 0,
-                "committed": 12,
-                "product_title": "French Press"
-            },
-            {
-                "inventory_item_id": 7,
-                "location_id": 1,
-                "available": 5,
-                "incoming": 0,
-                "committed": 1,
-                "product_title": "Milk Frother"
-            }
-        ]
-        
-        # Filter by product if specified
-        if product_name:
-            filtered = [inv for inv in mock_inventory if product_name.lower() in inv.get("product_title", "").lower()]
-            if filtered:
-                mock_inventory = filtered
-        
-        return {
-            "type": "inventory",
-            "data": mock_inventory,
-            "count": len(mock_inventory)
-        }
-    
-    async def _fetch_sales_data(self, store_id: str, intent: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Fetch sales/order data from Shopify
-        """
-        access_token = os.getenv("SHOPIFY_ACCESS_TOKEN", "")
-        time_period = intent.get("time_period", "last 30 days")
-        
-        # Return mock data for demo purposes
-        mock_orders = [
-            {
-                "id": 1,
-                "order_number": 1001,
-                "total_price": "125.50",
-                "created_at": "2024-12-20T10:30:00Z",
-                "line_items": [
-                    {"title": "Coffee Beans Premium", "quantity": 2, "price": "45.00"},
-                    {"title": "Vintage Mug Set", "quantity": 1, "price": "35.50"}
-                ],
-                "customer": {"email": "john.doe@example.com", "first_name": "John", "last_name": "Doe"}
-            },
-            {
-                "id": 2,
-                "order_number": 1002,
-                "total_price": "89.99",
-                "created_at": "2024-12-19T14:20:00Z",
-                "line_items": [
-                    {"title": "Artisan Tea Collection", "quantity": 1, "price": "89.99"}
-                ],
-                "customer": {"email": "jane.smith@example.com", "first_name": "Jane", "last_name": "Smith"}
-            },
-            {
-                "id": 3,
-                "order_number": 1003,
-                "total_price": "156.75",
-                "created_at": "2024-12-18T09:15:00Z",
-                "line_items": [
-                    {"title": "Coffee Beans Premium", "quantity": 3, "price": "45.00"},
-                    {"title": "Espresso Machine", "quantity": 1, "price": "21.75"}
-                ],
-                "customer": {"email": "john.doe@example.com", "first_name": "John", "last_name": "Doe"}
-            },
-            {
-                "id": 4,
-                "order_number": 1004,
-                "total_price": "67.50",
-                "created_at": "2024-12-17T16:45:00Z",
-                "line_items": [
-                    {"title": "Vintage Mug Set", "quantity": 2, "price": "35.50"}
-                ],
-                "customer": {"email": "mike.johnson@example.com", "first_name": "Mike", "last_name": "Johnson"}
-            },
-            {
-                "id": 5,
-                "order_number": 1005,
-                "total_price": "234.99",
-                "created_at": "2024-12-16T11:30:00Z",
-                "line_items": [
-                    {"title": "Coffee Beans Premium", "quantity": 4, "price": "45.00"},
-                    {"title": "Coffee Grinder", "quantity": 1, "price": "54.99"}
-                ],
-                "customer": {"email": "sarah.williams@example.com", "first_name": "Sarah", "last_name": "Williams"}
-            },
-            {
-                "id": 6,
-                "order_number": 1006,
-                "total_price": "45.00",
-                "created_at": "2024-12-15T13:20:00Z",
-                "line_items": [
-                    {"title": "Coffee Beans Premium", "quantity": 1, "price": "45.00"}
-                ],
-                "customer": {"email": "john.doe@example.com", "first_name": "John", "last_name": "Doe"}
-            },
-            {
-                "id": 7,
-                "order_number": 1007,
-                "total_price": "124.99",
-                "created_at": "2024-12-14T10:10:00Z",
-                "line_items": [
-                    {"title": "Artisan Tea Collection", "quantity": 1, "price": "89.99"},
-                    {"title": "Vintage Mug Set", "quantity": 1, "price": "35.50"}
-                ],
-                "customer": {"email": "jane.smith@example.com", "first_name": "Jane", "last_name": "Smith"}
-            },
-            {
-                "id": 8,
-                "order_number": 1008,
-                "total_price": "178.50",
-                "created_at": "2024-12-13T15:30:00Z",
-                "line_items": [
-                    {"title": "Espresso Machine", "quantity": 2, "price": "21.75"},
-                    {"title": "Coffee Beans Premium", "quantity": 3, "price": "45.00"}
-                ],
-                "customer": {"email": "david.brown@example.com", "first_name": "David", "last_name": "Brown"}
-            }
-        ]
-        
-        return {
-            "type": "sales",
-            "data": mock_orders,
-            "count": len(mock_orders),
-            "time_period": time_period
-        }
-    
-    async def _fetch_customer_data(self, store_id: str, intent: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Fetch customer data from Shopify
-        """
-        access_token = os.getenv("SHOPIFY_ACCESS_TOKEN", "")
-        
-        # Return mock customer data with order counts for repeat customer analysis
-        mock_customers = [
-            {
-                "id": 1,
-                "email": "john.doe@example.com",
-                "first_name": "John",
-                "last_name": "Doe",
-                "orders_count": 3,
-                "total_spent": "227.50",
-                "created_at": "2024-11-01T10:00:00Z"
-            },
-            {
-                "id": 2,
-                "email": "jane.smith@example.com",
-                "first_name": "Jane",
-                "last_name": "Smith",
-                "orders_count": 2,
-                "total_spent": "214.98",
-                "created_at": "2024-11-15T14:00:00Z"
-            },
-            {
-                "id": 3,
-                "email": "mike.johnson@example.com",
-                "first_name": "Mike",
-                "last_name": "Johnson",
-                "orders_count": 1,
-                "total_spent": "67.50",
-                "created_at": "2024-12-01T09:00:00Z"
-            },
-            {
-                "id": 4,
-                "email": "sarah.williams@example.com",
-                "first_name": "Sarah",
-                "last_name": "Williams",
-                "orders_count": 1,
-                "total_spent": "234.99",
-                "created_at": "2024-12-05T11:00:00Z"
-            },
-            {
-                "id": 5,
-                "email": "david.brown@example.com",
-                "first_name": "David",
-                "last_name": "Brown",
-                "orders_count": 1,
-                "total_spent": "178.50",
-                "created_at": "2024-12-10T15:00:00Z"
-            },
-            {
-                "id": 6,
-                "email": "emily.davis@example.com",
-                "first_name": "Emily",
-                "last_name": "Davis",
-                "orders_count": 4,
-                "total_spent": "456.75",
-                "created_at": "2024-10-20T12:00:00Z"
-            },
-            {
-                "id": 7,
-                "email": "robert.wilson@example.com",
-                "first_name": "Robert",
-                "last_name": "Wilson",
-                "orders_count": 2,
-                "total_spent": "189.99",
-                "created_at": "2024-11-25T16:00:00Z"
-            }
-        ]
-        
-        return {
-            "type": "customers",
-            "data": mock_customers,
-            "count": len(mock_customers)
-        }
-    
-    async def _fetch_product_data(self, store_id: str, intent: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Fetch product data from Shopify
-        """
-        access_token = os.getenv("SHOPIFY_ACCESS_TOKEN", "")
-        
-        # Return mock product data
-        mock_products = [
-            {
-                "id": 1,
-                "title": "Coffee Beans Premium",
-                "vendor": "Cafe Nostalgia",
-                "product_type": "Coffee",
-                "variants": [{"price": "45.00", "inventory_quantity": 45}],
-                "created_at": "2024-01-15T10:00:00Z"
-            },
-            {
-                "id": 2,
-                "title": "Vintage Mug Set",
-                "vendor": "Cafe Nostalgia",
-                "product_type": "Accessories",
-                "variants": [{"price": "35.50", "inventory_quantity": 23}],
-                "created_at": "2024-02-20T10:00:00Z"
-            },
-            {
-                "id": 3,
-                "title": "Artisan Tea Collection",
-                "vendor": "Cafe Nostalgia",
-                "product_type": "Tea",
-                "variants": [{"price": "89.99", "inventory_quantity": 12}],
-                "created_at": "2024-03-10T10:00:00Z"
-            },
-            {
-                "id": 4,
-                "title": "Espresso Machine",
-                "vendor": "Cafe Nostalgia",
-                "product_type": "Equipment",
-                "variants": [{"price": "21.75", "inventory_quantity": 8}],
-                "created_at": "2024-04-05T10:00:00Z"
-            },
-            {
-                "id": 5,
-                "title": "Coffee Grinder",
-                "vendor": "Cafe Nostalgia",
-                "product_type": "Equipment",
-                "variants": [{"price": "54.99", "inventory_quantity": 34}],
-                "created_at": "2024-05-12T10:00:00Z"
-            }
-        ]
-        
-        return {
-            "type": "products",
-            "data": mock_products,
-            "count": len(mock_products)
-        }
-    
+
+        if self.synthetic is not None:
+            yield self.synthetic.store(store_id).inventory(product_name)
+            return
+
+        if not self._access_token(store_id):
+            mock_inventory = MOCK_INVENTORY
+            # Filter by product if specified
+            if product_name:
+                filtered = [inv for inv in mock_inventory if product_name.lower() in inv.get("product_title", "").lower()]
+                if filtered:
+                    mock_inventory = filtered
+            yield mock_inventory
+            return
+
+        if await self._serve_locally(store_id, "inventory_levels"):
+            async for levels in self.local_store.iter_inventory(store_id, self.page_size, product_name):
+                yield levels
+            return
+
+        async for levels in self._remote_inventory_pages(store_id, intent):
+            yield levels
+
+    async def _remote_inventory_pages(self, store_id: str, intent: Dict[str, Any]) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream inventory levels from Shopify
+        """
+        product_name = intent.get("product_mentioned")
+
+        if self._use_bulk("inventory_levels"):
+            pages = self._bulk_or_rest(
+                store_id, "inventory_levels", None, partial(self._rest_inventory_pages, store_id, product_name)
+            )
+            async for levels in pages:
+                if product_name:
+                    levels = [level for level in levels if product_name.lower() in level["product_title"].lower()]
+                if levels:
+                    yield levels
+            return
+
+        async for levels in self._rest_inventory_pages(store_id, product_name):
+            yield levels
+
+    async def _rest_inventory_pages(
+        self,
+        store_id: str,
+        product_name: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream inventory levels through the REST products and inventory_levels resources
+        """
+        # Inventory levels only carry inventory_item_id, so walk the products
+        # to label each item and to apply the product filter before fetching levels
+        titles = {}
+        async for products in self.iter_pages(store_id, "products", {"fields": "id,title,variants"}):
+            for product in products:
+                title = product.get("title", "")
+                if product_name and product_name.lower() not in title.lower():
+                    continue
+                for variant in product.get("variants", []):
+                    if variant.get("inventory_item_id"):
+                        titles[variant["inventory_item_id"]] = title
+
+        item_ids = list(titles)
+        for start in range(0, len(item_ids), INVENTORY_ITEM_BATCH):
+            batch = item_ids[start:start + INVENTORY_ITEM_BATCH]
+            async for levels in self.iter_pages(
+                store_id,
+                "inventory_levels",
+                {"inventory_item_ids": ",".join(str(item_id) for item_id in batch)}
+            ):
+                # The REST resource only reports "available"; incoming and
+                # committed quantities are GraphQL-only
+                yield [
+                    {
+                        "inventory_item_id": level.get("inventory_item_id"),
+                        "location_id": level.get("location_id"),
+                        "available": level.get("available") or 0,
+                        "incoming": 0,
+                        "committed": 0,
+                        "product_title": titles.get(level.get("inventory_item_id"), "Unknown")
+                    }
+                    for level in levels
+                ]
+
+    async def _sales_pages(
+        self,
+        store_id: str,
+        intent: Dict[str, Any],
+        created_at_min: Optional[datetime] = None,
+        created_at_max: Optional[datetime] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream orders with their line items, optionally narrowed to a
+        created_at range. The range may be applied loosely; callers that
+        need exact bounds filter again.
+        """
+        if self.synthetic is not None:
+            async for orders in self.synthetic.order_pages(store_id, self.page_size, created_at_min, created_at_max):
+                yield orders
+            return
+
+        if not self._access_token(store_id):
+            # Return mock data for demo purposes
+            yield MOCK_ORDERS
+            return
+
+        if await self._serve_locally(store_id, "orders"):
+            async for orders in self.local_store.iter_orders(
+                store_id,
+                self.page_size,
+                *padded_bounds(created_at_min, created_at_max)
+            ):
+                yield orders
+            return
+
+        async for orders in self._remote_order_pages(
+            store_id, intent, created_at_min=created_at_min, created_at_max=created_at_max
+        ):
+            yield orders
+
+    async def _remote_order_pages(
+        self,
+        store_id: str,
+        intent: Dict[str, Any],
+        updated_at_min: Optional[str] = None,
+        created_at_min: Optional[datetime] = None,
+        created_at_max: Optional[datetime] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream orders from Shopify, optionally only those updated since a
+        watermark or created within a range
+        """
+        rest_pages = partial(self._rest_order_pages, store_id, updated_at_min, created_at_min, created_at_max)
+        if self._use_bulk("orders", created_at_min, created_at_max):
+            search = None
+            if created_at_min is not None:
+                search = f"created_at:>='{_timestamp(created_at_min)}'"
+            if created_at_max is not None:
+                search = " AND ".join(filter(None, [search, f"created_at:<'{_timestamp(created_at_max)}'"]))
+            async for orders in self._bulk_or_rest(store_id, "orders", search, rest_pages):
+                yield orders
+            return
+
+        async for orders in rest_pages():
+            yield orders
+
+    async def _rest_order_pages(
+        self,
+        store_id: str,
+        updated_at_min: Optional[str] = None,
+        created_at_min: Optional[datetime] = None,
+        created_at_max: Optional[datetime] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream orders through REST pages
+        """
+        params = {"status": "any", "fields": ORDER_FIELDS}
+        if updated_at_min:
+            params["updated_at_min"] = updated_at_min
+        if created_at_min is not None:
+            params["created_at_min"] = _timestamp(created_at_min)
+        if created_at_max is not None:
+            params["created_at_max"] = _timestamp(created_at_max)
+        async for orders in self.iter_pages(store_id, "orders", params):
+            yield orders
+
+    async def _customer_pages(self, store_id: str, intent: Dict[str, Any]) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream customers with their order counts for repeat customer analysis
+        """
+        if self.synthetic is not None:
+            async for customers in self.synthetic.customer_pages(store_id, self.page_size):
+                yield customers
+            return
+
+        if not self._access_token(store_id):
+            yield MOCK_CUSTOMERS
+            return
+
+        if await self._serve_locally(store_id, "customers"):
+            async for customers in self.local_store.iter_customers(store_id, self.page_size):
+                yield customers
+            return
+
+        async for customers in self._remote_customer_pages(store_id, intent):
+            yield customers
+
+    async def _remote_customer_pages(
+        self,
+        store_id: str,
+        intent: Dict[str, Any],
+        updated_at_min: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream customers from Shopify, optionally only those updated since a watermark
+        """
+        rest_pages = partial(self._rest_customer_pages, store_id, updated_at_min)
+        if self._use_bulk("customers"):
+            async for customers in self._bulk_or_rest(store_id, "customers", None, rest_pages):
+                yield customers
+            return
+
+        async for customers in rest_pages():
+            yield customers
+
+    async def _rest_customer_pages(
+        self,
+        store_id: str,
+        updated_at_min: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream customers through REST pages
+        """
+        params = {"fields": CUSTOMER_FIELDS}
+        if updated_at_min:
+            params["updated_at_min"] = updated_at_min
+        async for customers in self.iter_pages(store_id, "customers", params):
+            yield customers
+
+    async def _product_pages(self, store_id: str, intent: Dict[str, Any]) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Stream products with their variants
+        """
+        if self.synthetic is not None:
+            yield self.synthetic.store(store_id).products()
+            return
+
+        if not self._access_token(store_id):
+            yield MOCK_PRODUCTS
+            return
+
+        async for products in self.iter_pages(store_id, "products", {"fields": PRODUCT_FIELDS}):
+            yield products
+
     async def _fetch_general_data(self, store_id: str) -> Dict[str, Any]:
         """
         Fetch general store data
@@ -360,3 +946,69 @@ class ShopifyClient:
             "message": "General query - specific implementation needed"
         }
 
+
+async def _prefetch(
+    pages: AsyncIterator[List[Dict[str, Any]]],
+    depth: int = 1
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Fetch up to `depth` pages ahead while the caller processes the current one
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=depth)
+
+    async def produce():
+        try:
+            async for page in pages:
+                await queue.put((page, None))
+        except Exception as e:
+            await queue.put((None, e))
+            return
+        await queue.put((None, None))
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            page, error = await queue.get()
+            if error is not None:
+                raise error
+            if page is None:
+                return
+            yield page
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+
+def _within_window(window: Optional[DateRange], plan: Plan) -> bool:
+    """
+    Whether records fetched for a date range hold everything a query over
+    the same source reads; without a range nothing was filtered out
+    """
+    if window is None:
+        return True
+    now = plan.now or datetime.now(timezone.utc)
+    return window.covers(plan.pushdown.get("created_at_min"), plan.pushdown.get("created_at_max"), now)
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[str]:
+    """
+    UTC ISO-8601 form of an aware datetime, as Shopify filters expect
+    """
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _latest_updated_at(watermark: Optional[str], records: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    Advance a UTC ISO-8601 watermark to the newest updated_at in a page
+    """
+    latest = datetime.fromisoformat(watermark.replace("Z", "+00:00")) if watermark else None
+    for record in records:
+        value = record.get("updated_at")
+        if not value:
+            continue
+        stamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if latest is None or stamp > latest:
+            latest = stamp
+    return latest.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") if latest else watermark
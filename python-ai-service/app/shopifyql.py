@@ -0,0 +1,1224 @@
+"""
+Parser, planner and executor for the ShopifyQL subset the query generator emits
+
+Supported: FROM, WHERE, GROUP BY, HAVING, SELECT (or SHOW) with SUM / COUNT /
+AVG / MIN / MAX, ORDER BY, LIMIT, SINCE / UNTIL, DURING named periods
+(last_week, last_30_days, this_month, ...) and NOW() / DATE_SUB / DATE_ADD
+with INTERVAL arithmetic. Queries run against the REST-shaped records
+ShopifyClient returns.
+"""
+import heapq
+import re
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.time_periods import parse_timestamp, resolve_period
+
+
+class QueryError(Exception):
+    """
+    Raised for queries outside the supported subset
+    """
+
+
+# Tokenizer
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<number>\d+(?:\.\d+)?)
+      | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.)*")
+      | (?P<op><=|>=|<>|!=|=|<|>|\(|\)|,|\*|\+|-|/|\.)
+      | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    )""",
+    re.VERBOSE,
+)
+
+CLAUSES = {"FROM", "WHERE", "GROUP", "HAVING", "SELECT", "SHOW", "ORDER", "LIMIT", "SINCE", "UNTIL", "DURING"}
+KEYWORDS = CLAUSES | {
+    "BY", "AS", "AND", "OR", "NOT", "LIKE", "IN", "IS", "NULL", "BETWEEN",
+    "ASC", "DESC", "INTERVAL", "DISTINCT", "TRUE", "FALSE",
+}
+AGGREGATES = {"SUM", "COUNT", "AVG", "MIN", "MAX"}
+INTERVAL_UNITS = {
+    "SECOND": timedelta(seconds=1), "MINUTE": timedelta(minutes=1), "HOUR": timedelta(hours=1),
+    "DAY": timedelta(days=1), "WEEK": timedelta(weeks=1),
+    "MONTH": timedelta(days=30), "QUARTER": timedelta(days=91), "YEAR": timedelta(days=365),
+}
+_SINCE_UNITS = {"d": "DAY", "w": "WEEK", "m": "MONTH", "q": "QUARTER", "y": "YEAR", "h": "HOUR"}
+
+
+def tokenize(text: str) -> List[Tuple[str, Any]]:
+    text = re.sub(r"--[^\n]*", " ", text).strip().rstrip(";")
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if not match or match.end() == position:
+            if text[position:].strip() == "":
+                break
+            raise QueryError(f"Unexpected character {text[position]!r} in query")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "number":
+            tokens.append(("number", float(value) if "." in value else int(value)))
+        elif kind == "string":
+            quote = value[0]
+            tokens.append(("string", value[1:-1].replace(quote * 2, quote).replace("\\" + quote, quote)))
+        elif kind == "ident" and value.upper() in KEYWORDS | AGGREGATES:
+            tokens.append(("kw", value.upper()))
+        elif kind == "ident":
+            tokens.append(("ident", value))
+        else:
+            tokens.append(("op", value))
+    return tokens
+
+
+# Parser. Expressions are tuples:
+#   ("col", name) ("lit", value) ("star",) ("func", NAME, [args], distinct)
+#   ("bin", op, left, right) ("not", expr) ("neg", expr)
+#   ("like", expr, pattern, negated) ("in", expr, [values], negated)
+#   ("null", expr, negated) ("interval", amount, UNIT)
+
+
+class _Parser:
+    def __init__(self, tokens: List[Tuple[str, Any]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self, offset: int = 0) -> Tuple[str, Any]:
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else ("eof", None)
+
+    def next(self) -> Tuple[str, Any]:
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def accept(self, kind: str, value: Any = None) -> bool:
+        token = self.peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind: str, value: Any = None) -> Any:
+        token = self.next()
+        if token[0] != kind or (value is not None and token[1] != value):
+            raise QueryError(f"Expected {value or kind}, found {token[1]!r}")
+        return token[1]
+
+    def parse_query(self) -> Dict[str, Any]:
+        query: Dict[str, Any] = {}
+        while self.peek()[0] != "eof":
+            kind, clause = self.next()
+            if kind != "kw" or clause not in CLAUSES:
+                raise QueryError(f"Expected a clause keyword, found {clause!r}")
+            if clause == "SHOW":
+                clause = "SELECT"
+            if clause in ("GROUP", "ORDER"):
+                self.expect("kw", "BY")
+            if clause in query:
+                raise QueryError(f"Duplicate {clause} clause")
+
+            if clause == "FROM":
+                query[clause] = self.parse_name()
+            elif clause in ("WHERE", "HAVING"):
+                query[clause] = self.parse_expr()
+            elif clause == "GROUP":
+                query[clause] = self.parse_list(self.parse_expr)
+            elif clause == "SELECT":
+                query[clause] = self.parse_list(self.parse_select_item)
+            elif clause == "ORDER":
+                query[clause] = self.parse_list(self.parse_order_item)
+            elif clause == "LIMIT":
+                query[clause] = int(self.expect("number"))
+            elif clause == "DURING":
+                query[clause] = self.parse_named_period()
+            else:
+                query[clause] = self.parse_relative_date()
+        if "FROM" not in query:
+            raise QueryError("Query has no FROM clause")
+        return query
+
+    def parse_name(self) -> str:
+        name = self.expect("ident")
+        while self.accept("op", "."):
+            name = self.expect("ident")
+        return name.lower()
+
+    def parse_list(self, item: Callable[[], Any]) -> List[Any]:
+        items = [item()]
+        while self.accept("op", ","):
+            items.append(item())
+        return items
+
+    def parse_select_item(self) -> Tuple[Any, Optional[str]]:
+        if self.accept("op", "*"):
+            return ("star",), None
+        expr = self.parse_expr()
+        alias = None
+        if self.accept("kw", "AS"):
+            alias = self.next()[1]
+        elif self.peek()[0] == "ident":
+            alias = self.next()[1]
+        return expr, alias
+
+    def parse_order_item(self) -> Tuple[Any, bool]:
+        expr = self.parse_expr()
+        descending = False
+        if self.accept("kw", "DESC"):
+            descending = True
+        else:
+            self.accept("kw", "ASC")
+        return expr, descending
+
+    def parse_named_period(self) -> str:
+        """
+        DURING operand: a period name such as last_week or last_30_days,
+        kept as text and resolved when the query is planned
+        """
+        name = str(self.expect("ident")).lower()
+        period = name.replace("_", " ")
+        if resolve_period(period) is None:
+            raise QueryError(f"Unknown period {name}")
+        return period
+
+    def parse_relative_date(self) -> Any:
+        """
+        SINCE / UNTIL operand: -30d, today, yesterday or a date literal
+        """
+        if self.peek()[0] == "string":
+            return ("lit", self.next()[1])
+        if self.peek() == ("ident", "today") or self.peek() == ("ident", "yesterday"):
+            days = 0 if self.next()[1] == "today" else 1
+            return ("func", "DATE_SUB", [("func", "TODAY", [], False), ("interval", days, "DAY")], False)
+        negative = self.accept("op", "-")
+        amount = self.expect("number")
+        unit = _SINCE_UNITS.get(str(self.expect("ident")).lower())
+        if unit is None:
+            raise QueryError("Unsupported SINCE/UNTIL unit")
+        name = "DATE_SUB" if negative else "DATE_ADD"
+        return ("func", name, [("func", "NOW", [], False), ("interval", amount, unit)], False)
+
+    def parse_expr(self) -> Any:
+        left = self.parse_and()
+        while self.accept("kw", "OR"):
+            left = ("bin", "OR", left, self.parse_and())
+        return left
+
+    def parse_and(self) -> Any:
+        left = self.parse_not()
+        while self.accept("kw", "AND"):
+            left = ("bin", "AND", left, self.parse_not())
+        return left
+
+    def parse_not(self) -> Any:
+        if self.accept("kw", "NOT"):
+            return ("not", self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> Any:
+        left = self.parse_additive()
+        token = self.peek()
+        if token[0] == "op" and token[1] in ("=", "!=", "<>", "<", "<=", ">", ">="):
+            self.next()
+            op = "!=" if token[1] == "<>" else token[1]
+            return ("bin", op, left, self.parse_additive())
+
+        negated = self.accept("kw", "NOT")
+        if self.accept("kw", "LIKE"):
+            return ("like", left, self.expect("string"), negated)
+        if self.accept("kw", "IN"):
+            self.expect("op", "(")
+            values = self.parse_list(self.parse_additive)
+            self.expect("op", ")")
+            return ("in", left, values, negated)
+        if self.accept("kw", "BETWEEN"):
+            low = self.parse_additive()
+            self.expect("kw", "AND")
+            high = self.parse_additive()
+            between = ("bin", "AND", ("bin", ">=", left, low), ("bin", "<=", left, high))
+            return ("not", between) if negated else between
+        if negated:
+            raise QueryError("Expected LIKE, IN or BETWEEN after NOT")
+        if self.accept("kw", "IS"):
+            negated = self.accept("kw", "NOT")
+            self.expect("kw", "NULL")
+            return ("null", left, negated)
+        return left
+
+    def parse_additive(self) -> Any:
+        left = self.parse_term()
+        while self.peek() in (("op", "+"), ("op", "-")):
+            left = ("bin", self.next()[1], left, self.parse_term())
+        return left
+
+    def parse_term(self) -> Any:
+        left = self.parse_unary()
+        while self.peek() in (("op", "*"), ("op", "/")):
+            left = ("bin", self.next()[1], left, self.parse_unary())
+        return left
+
+    def parse_unary(self) -> Any:
+        if self.accept("op", "-"):
+            return ("neg", self.parse_unary())
+        return self.parse_primary()
+
+    def parse_primary(self) -> Any:
+        kind, value = self.next()
+        if kind in ("number", "string"):
+            return ("lit", value)
+        if kind == "op" and value == "(":
+            expr = self.parse_expr()
+            self.expect("op", ")")
+            return expr
+        if kind == "kw" and value in ("TRUE", "FALSE"):
+            return ("lit", value == "TRUE")
+        if kind == "kw" and value == "NULL":
+            return ("lit", None)
+        if kind == "kw" and value == "INTERVAL":
+            amount = self.expect("number")
+            unit = str(self.next()[1]).upper().rstrip("S")
+            if unit not in INTERVAL_UNITS:
+                raise QueryError(f"Unsupported interval unit {unit}")
+            return ("interval", amount, unit)
+        if (kind == "ident" or (kind == "kw" and value in AGGREGATES)) and self.peek() == ("op", "("):
+            self.next()
+            name = value.upper()
+            distinct = self.accept("kw", "DISTINCT")
+            args = []
+            if self.accept("op", "*"):
+                args.append(("star",))
+            elif self.peek() != ("op", ")"):
+                args = self.parse_list(self.parse_expr)
+            self.expect("op", ")")
+            return ("func", name, args, distinct)
+        if kind == "ident":
+            name = value
+            while self.accept("op", "."):
+                name = self.expect("ident")
+            return ("col", name.lower())
+        raise QueryError(f"Unexpected token {value!r}")
+
+
+def parse(query: str) -> Dict[str, Any]:
+    """
+    Parse a ShopifyQL query into a clause dictionary
+    """
+    return _Parser(tokenize(query)).parse_query()
+
+
+# Tables. Each maps accepted column names onto canonical row keys.
+
+ORDER_COLUMNS = {
+    "id": "id", "order_id": "id", "order_number": "order_number", "name": "order_number",
+    "total_price": "total_price", "total_sales": "total_price", "gross_sales": "total_price",
+    "net_sales": "total_price", "revenue": "total_price", "created_at": "created_at",
+    "processed_at": "created_at", "day": "created_at", "updated_at": "updated_at",
+    "customer_email": "customer_email", "email": "customer_email",
+    "customer_first_name": "customer_first_name", "customer_last_name": "customer_last_name",
+    "customer_name": "customer_name",
+}
+LINE_ITEM_COLUMNS = {
+    "product_title": "product_title", "title": "product_title", "product_name": "product_title",
+    "product": "product_title", "quantity": "quantity", "units_sold": "quantity",
+    "price": "price", "line_total": "line_total",
+}
+# Sales metrics that refer to the line rather than the whole order at line grain
+LINE_GRAIN_OVERRIDES = {
+    "total_sales": "line_total", "gross_sales": "line_total", "net_sales": "line_total",
+    "revenue": "line_total",
+}
+CUSTOMER_COLUMNS = {
+    "id": "id", "customer_id": "id", "email": "email", "customer_email": "email",
+    "first_name": "first_name", "last_name": "last_name", "customer_name": "customer_name",
+    "orders_count": "orders_count", "order_count": "orders_count", "total_spent": "total_spent",
+    "created_at": "created_at", "updated_at": "updated_at",
+}
+INVENTORY_COLUMNS = {
+    "inventory_item_id": "inventory_item_id", "location_id": "location_id",
+    "available": "available", "incoming": "incoming", "committed": "committed",
+    "product_title": "product_title", "title": "product_title", "product_name": "product_title",
+    "product": "product_title",
+}
+PRODUCT_COLUMNS = {
+    "id": "id", "product_id": "id", "title": "product_title", "product_title": "product_title",
+    "product_name": "product_title", "vendor": "vendor", "product_type": "product_type",
+    "price": "price", "inventory_quantity": "inventory_quantity", "created_at": "created_at",
+}
+
+# Table name -> (source resource, column map)
+TABLES = {
+    "orders": ("orders", ORDER_COLUMNS),
+    "sales": ("orders", ORDER_COLUMNS),
+    "line_items": ("orders", ORDER_COLUMNS),
+    "customers": ("customers", CUSTOMER_COLUMNS),
+    "inventory_levels": ("inventory_levels", INVENTORY_COLUMNS),
+    "inventory": ("inventory_levels", INVENTORY_COLUMNS),
+    "products": ("products", PRODUCT_COLUMNS),
+}
+DATE_COLUMNS = {"created_at", "updated_at"}
+ADDITIVE_COLUMNS = {"total_price", "line_total", "quantity", "total_spent", "available", "incoming", "committed"}
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _customer_name(customer: Dict[str, Any]) -> Optional[str]:
+    name = f"{customer.get('first_name') or ''} {customer.get('last_name') or ''}".strip()
+    return name or None
+
+
+# Planner
+
+
+class Plan:
+    """
+    Executable form of a parsed query.
+
+    pushdown holds the predicates applied while scanning source records,
+    before any row is materialized: created_at_min / created_at_max bounds
+    and a product_title filter. Callers may also use them to narrow a fetch.
+    """
+
+    def __init__(self, table: str, source: str, line_grain: bool):
+        self.table = table
+        self.source = source
+        self.line_grain = line_grain
+        self.pushdown: Dict[str, Any] = {}
+        self.product_filter: Optional[Callable[[Any], bool]] = None
+        self.where: Optional[Callable[[Dict[str, Any]], Any]] = None
+        self.group_by: List[Callable[[Dict[str, Any]], Any]] = []
+        self.aggregates: List[Tuple[str, Optional[Callable], bool]] = []
+        self.outputs: List[Tuple[str, Callable[[Dict[str, Any]], Any]]] = []
+        # Per output, what it measures (see _measure), for labelling values
+        self.measures: List[Dict[str, Optional[str]]] = []
+        self.having: Optional[Callable[[Dict[str, Any]], Any]] = None
+        self.order_by: List[Tuple[Callable[[Dict[str, Any], List[Any]], Any], bool]] = []
+        self.limit: Optional[int] = None
+        self.aggregated = False
+        # Canonical columns the scan must materialize
+        self.fields: set = set()
+        # Instant NOW() resolved to and the timezone DURING periods resolve
+        # in; recompiling with both reproduces the plan
+        self.now: Optional[datetime] = None
+        self.tz: tzinfo = timezone.utc
+
+
+def plan(query: Dict[str, Any], now: Optional[datetime] = None, tz: tzinfo = timezone.utc) -> Plan:
+    """
+    Resolve columns, fold constants and split predicates for pushdown.
+    DURING periods resolve to whole days in `tz`, the store's timezone.
+    """
+    now = now or datetime.now(timezone.utc)
+    table = query["FROM"]
+    if table not in TABLES:
+        raise QueryError(f"Unknown table {table}")
+    source, columns = TABLES[table]
+
+    referenced = set()
+    _walk_columns(query, referenced)
+    line_grain = source == "orders" and (
+        table == "line_items" or any(name in LINE_ITEM_COLUMNS for name in referenced)
+    )
+    if line_grain:
+        columns = {**columns, **LINE_ITEM_COLUMNS, **LINE_GRAIN_OVERRIDES}
+
+    compiled = Plan(table, source, line_grain)
+    compiled.now = now
+    compiled.tz = tz
+    compiler = _Compiler(columns, now)
+
+    # Split WHERE (plus SINCE/UNTIL/DURING) into pushed-down scan predicates and a residual filter
+    conjuncts = _conjuncts(query.get("WHERE"))
+    if "SINCE" in query:
+        conjuncts.append(("bin", ">=", ("col", "created_at"), query["SINCE"]))
+    if "UNTIL" in query:
+        conjuncts.append(("bin", "<=", ("col", "created_at"), query["UNTIL"]))
+    if "DURING" in query:
+        window = resolve_period(query["DURING"], tz, now)
+        conjuncts.append(("bin", ">=", ("col", "created_at"), ("lit", window.start.isoformat())))
+        conjuncts.append(("bin", "<", ("col", "created_at"), ("lit", window.end.isoformat())))
+    residual = []
+    for conjunct in conjuncts:
+        if not _push_down(conjunct, compiled, compiler, columns):
+            residual.append(conjunct)
+    if residual:
+        where = residual[0]
+        for conjunct in residual[1:]:
+            where = ("bin", "AND", where, conjunct)
+        compiled.where = compiler.compile(where)
+
+    # Pushed-down predicates read the raw records, so only the residual
+    # filter and the later clauses decide which columns rows carry
+    needed = set()
+    _walk_columns({clause: value for clause, value in query.items() if clause not in ("WHERE", "SINCE", "UNTIL", "DURING")}, needed)
+    _walk_columns(residual, needed)
+    compiled.fields = {columns[name] for name in needed if name in columns}
+
+    select = query.get("SELECT") or [(("star",), None)]
+    group_exprs = query.get("GROUP", [])
+    has_aggregates = any(_contains_aggregate(expr) for expr, _ in select) or "HAVING" in query
+    compiled.aggregated = bool(group_exprs) or has_aggregates
+
+    aliases = {alias.lower(): index for index, (_, alias) in enumerate(select) if alias}
+
+    if compiled.aggregated:
+        compiled.group_by = [compiler.compile(expr) for expr in group_exprs]
+        group_keys = {_render(expr): index for index, expr in enumerate(group_exprs)}
+        agg_compiler = _Compiler(columns, now, aggregates=compiled.aggregates, group_keys=group_keys, base=compiler)
+        for expr, alias in select:
+            if expr == ("star",):
+                for index, group_expr in enumerate(group_exprs):
+                    compiled.outputs.append((_render(group_expr), _group_value(index)))
+                    compiled.measures.append(_measure(group_expr, columns))
+                continue
+            compiled.outputs.append((alias or _render(expr), agg_compiler.compile(expr)))
+            compiled.measures.append(_measure(expr, columns))
+        if "HAVING" in query:
+            compiled.having = agg_compiler.compile(_substitute_aliases(query["HAVING"], select))
+        order_compiler = agg_compiler
+    else:
+        for expr, alias in select:
+            if expr == ("star",):
+                for name in _star_columns(columns):
+                    compiled.fields.add(name)
+                    compiled.outputs.append((name, compiler.compile(("col", name))))
+                    compiled.measures.append(_measure(("col", name), columns))
+                continue
+            compiled.outputs.append((alias or _render(expr), compiler.compile(expr)))
+            compiled.measures.append(_measure(expr, columns))
+        order_compiler = compiler
+
+    for expr, descending in query.get("ORDER", []):
+        if expr[0] == "col" and expr[1] in aliases:
+            index = aliases[expr[1]]
+            compiled.order_by.append((lambda row, out, i=index: out[i], descending))
+        elif expr[0] == "lit" and isinstance(expr[1], int):
+            index = expr[1] - 1
+            compiled.order_by.append((lambda row, out, i=index: out[i], descending))
+        else:
+            evaluate = order_compiler.compile(expr)
+            compiled.order_by.append((lambda row, out, f=evaluate: f(row), descending))
+
+    compiled.limit = query.get("LIMIT")
+    return compiled
+
+
+def _measure(expr: Any, columns: Dict[str, str]) -> Dict[str, Optional[str]]:
+    """
+    What an output measures, independent of its alias: the aggregate
+    function applied (None for a bare column) and the canonical column it
+    reads (None for COUNT(*) and computed expressions). SUM(units_sold)
+    and SUM(quantity) AS total_sold both give {"function": "SUM",
+    "column": "quantity"}.
+    """
+    function = None
+    if expr[0] == "func" and expr[1] in AGGREGATES:
+        function = expr[1]
+        expr = expr[2][0] if len(expr[2]) == 1 else ("star",)
+    column = columns.get(expr[1]) if expr[0] == "col" else None
+    return {"function": function, "column": column}
+
+
+def _walk_columns(node: Any, found: set) -> None:
+    if isinstance(node, dict):
+        for value in node.values():
+            _walk_columns(value, found)
+    elif isinstance(node, (list, tuple)):
+        if len(node) == 2 and node[0] == "col" and isinstance(node[1], str):
+            found.add(node[1])
+            return
+        for item in node:
+            _walk_columns(item, found)
+
+
+def _conjuncts(expr: Any) -> List[Any]:
+    if expr is None:
+        return []
+    if expr[0] == "bin" and expr[1] == "AND":
+        return _conjuncts(expr[2]) + _conjuncts(expr[3])
+    return [expr]
+
+
+def _push_down(conjunct: Any, compiled: Plan, compiler: "_Compiler", columns: Dict[str, str]) -> bool:
+    """
+    Turn created_at range predicates and product_title filters into scan-time predicates
+    """
+    if conjunct[0] == "bin" and conjunct[1] in ("<", "<=", ">", ">=", "="):
+        op, left, right = conjunct[1], conjunct[2], conjunct[3]
+        if right[0] == "col" and left[0] != "col":
+            left, right = right, left
+            op = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}.get(op, op)
+        if left[0] != "col" or not compiler.is_constant(right):
+            return False
+        column = columns.get(left[1])
+
+        if column == "created_at" and op != "=":
+            bound = parse_timestamp(compiler.compile(right)({}))
+            if bound is None:
+                return False
+            # Bounds are half-open [min, max); inclusive upper bounds on whole
+            # dates are nudged so "<= '2024-01-07'" keeps that day
+            if op in (">", ">="):
+                if op == ">":
+                    bound += timedelta(microseconds=1)
+                current = compiled.pushdown.get("created_at_min")
+                compiled.pushdown["created_at_min"] = max(bound, current) if current else bound
+            else:
+                if op == "<=":
+                    bound += timedelta(microseconds=1)
+                current = compiled.pushdown.get("created_at_max")
+                compiled.pushdown["created_at_max"] = min(bound, current) if current else bound
+            return True
+
+        if column == "product_title" and op == "=" and compiled.product_filter is None:
+            value = compiler.compile(right)({})
+            if isinstance(value, str):
+                target = value.lower()
+                compiled.pushdown["product_title"] = value
+                compiled.product_filter = lambda title: (title or "").lower() == target
+                return True
+
+    if (
+        conjunct[0] == "like" and not conjunct[3] and conjunct[1][0] == "col"
+        and columns.get(conjunct[1][1]) == "product_title" and compiled.product_filter is None
+    ):
+        pattern = _like_pattern(conjunct[2])
+        compiled.pushdown["product_title_like"] = conjunct[2]
+        compiled.product_filter = lambda title: bool(pattern.match(title or ""))
+        return True
+    return False
+
+
+def _contains_aggregate(expr: Any) -> bool:
+    if isinstance(expr, list):
+        return any(_contains_aggregate(item) for item in expr)
+    if not isinstance(expr, tuple):
+        return False
+    if expr[0] == "func" and expr[1] in AGGREGATES:
+        return True
+    return any(_contains_aggregate(part) for part in expr[1:])
+
+
+def _substitute_aliases(expr: Any, select: List[Tuple[Any, Optional[str]]]) -> Any:
+    """
+    Let HAVING refer to select aliases, e.g. HAVING order_count > 1
+    """
+    aliases = {alias.lower(): item for item, alias in select if alias}
+    if not isinstance(expr, tuple):
+        return expr
+    if expr[0] == "col" and expr[1] in aliases:
+        return aliases[expr[1]]
+    return tuple(
+        _substitute_aliases(part, select) if isinstance(part, tuple)
+        else [_substitute_aliases(item, select) for item in part] if isinstance(part, list)
+        else part
+        for part in expr
+    )
+
+
+def _star_columns(columns: Dict[str, str]) -> List[str]:
+    seen = []
+    for name, canonical in columns.items():
+        if canonical == name and name not in seen:
+            seen.append(name)
+    return seen
+
+
+def _group_value(index: int) -> Callable[[Dict[str, Any]], Any]:
+    return lambda row: row["__group"][index]
+
+
+def _like_pattern(pattern: str):
+    regex = "".join(
+        ".*" if char == "%" else "." if char == "_" else re.escape(char)
+        for char in pattern
+    )
+    return re.compile(f"^{regex}$", re.IGNORECASE | re.DOTALL)
+
+
+def _render(expr: Any) -> str:
+    """
+    Column name for an unaliased select expression
+    """
+    kind = expr[0]
+    if kind == "col":
+        return expr[1]
+    if kind == "lit":
+        return repr(expr[1])
+    if kind == "star":
+        return "*"
+    if kind == "func":
+        args = ", ".join(_render(arg) for arg in expr[2])
+        return f"{expr[1]}({'DISTINCT ' if expr[3] else ''}{args})"
+    if kind == "bin":
+        return f"{_render(expr[2])} {expr[1]} {_render(expr[3])}"
+    if kind == "interval":
+        return f"INTERVAL {expr[1]} {expr[2]}"
+    if kind == "neg":
+        return f"-{_render(expr[1])}"
+    return kind
+
+
+def _compare(op: str, left: Any, right: Any) -> bool:
+    if left is None or right is None:
+        return False
+    if isinstance(left, datetime) and not isinstance(right, datetime):
+        right = parse_timestamp(right)
+    elif isinstance(right, datetime) and not isinstance(left, datetime):
+        left = parse_timestamp(left)
+    if left is None or right is None:
+        return False
+    if isinstance(left, str) and isinstance(right, str):
+        left, right = left.lower(), right.lower()
+    try:
+        if op == "=":
+            return left == right
+        if op == "!=":
+            return left != right
+        if op == "<":
+            return left < right
+        if op == "<=":
+            return left <= right
+        if op == ">":
+            return left > right
+        return left >= right
+    except TypeError:
+        return False
+
+
+def _arithmetic(op: str, left: Any, right: Any) -> Any:
+    if left is None or right is None:
+        return None
+    if isinstance(right, timedelta) and isinstance(left, datetime):
+        return left + right if op == "+" else left - right if op == "-" else None
+    try:
+        if op == "+":
+            return left + right
+        if op == "-":
+            return left - right
+        if op == "*":
+            return left * right
+        return left / right if right else None
+    except TypeError:
+        return None
+
+
+class _Compiler:
+    """
+    Compiles expression tuples into closures over a row dict
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, str],
+        now: datetime,
+        aggregates: Optional[List] = None,
+        group_keys: Optional[Dict[str, int]] = None,
+        base: Optional["_Compiler"] = None
+    ):
+        self.columns = columns
+        self.now = now
+        self.aggregates = aggregates
+        self.group_keys = group_keys
+        self.base = base
+
+    def is_constant(self, expr: Any) -> bool:
+        kind = expr[0]
+        if kind in ("lit", "interval"):
+            return True
+        if kind == "func":
+            return expr[1] not in AGGREGATES and all(self.is_constant(arg) for arg in expr[2])
+        if kind == "bin":
+            return self.is_constant(expr[2]) and self.is_constant(expr[3])
+        if kind == "neg":
+            return self.is_constant(expr[1])
+        return False
+
+    def compile(self, expr: Any) -> Callable[[Dict[str, Any]], Any]:
+        if self.group_keys is not None:
+            rendered = _render(expr)
+            if rendered in self.group_keys:
+                return _group_value(self.group_keys[rendered])
+        if self.is_constant(expr) and expr[0] != "lit":
+            value = self._compile(expr)({})
+            return lambda row: value
+        return self._compile(expr)
+
+    def _compile(self, expr: Any) -> Callable[[Dict[str, Any]], Any]:
+        kind = expr[0]
+
+        if kind == "lit":
+            value = expr[1]
+            return lambda row: value
+
+        if kind == "interval":
+            value = INTERVAL_UNITS[expr[2]] * expr[1]
+            return lambda row: value
+
+        if kind == "col":
+            if expr[1] not in self.columns:
+                raise QueryError(f"Unknown column {expr[1]}")
+            key = self.columns[expr[1]]
+            if self.aggregates is not None:
+                # Outside GROUP BY, metric columns sum over the group as in
+                # ShopifyQL's SHOW total_sales; other columns take any value
+                name = "SUM" if key in ADDITIVE_COLUMNS else "ANY"
+                return self._aggregate(name, [expr], False)
+            return lambda row: row.get(key)
+
+        if kind == "star":
+            return lambda row: 1
+
+        if kind == "neg":
+            inner = self.compile(expr[1])
+            return lambda row: _arithmetic("-", 0, inner(row))
+
+        if kind == "not":
+            inner = self.compile(expr[1])
+            return lambda row: not inner(row)
+
+        if kind == "null":
+            inner, negated = self.compile(expr[1]), expr[2]
+            return lambda row: (inner(row) is None) != negated
+
+        if kind == "like":
+            inner, pattern, negated = self.compile(expr[1]), _like_pattern(expr[2]), expr[3]
+            return lambda row: bool(pattern.match(str(inner(row) or ""))) != negated
+
+        if kind == "in":
+            inner, negated = self.compile(expr[1]), expr[3]
+            values = [self.compile(value)({}) for value in expr[2]]
+            lowered = {value.lower() if isinstance(value, str) else value for value in values}
+            return lambda row: (
+                (lambda v: (v.lower() if isinstance(v, str) else v) in lowered)(inner(row))
+            ) != negated
+
+        if kind == "bin":
+            op = expr[1]
+            left = self._coerce_dates(expr[2], expr[3])
+            right = self._coerce_dates(expr[3], expr[2])
+            if op == "AND":
+                return lambda row: bool(left(row)) and bool(right(row))
+            if op == "OR":
+                return lambda row: bool(left(row)) or bool(right(row))
+            if op in ("+", "-", "*", "/"):
+                return lambda row: _arithmetic(op, left(row), right(row))
+            return lambda row: _compare(op, left(row), right(row))
+
+        if kind == "func":
+            name, args, distinct = expr[1], expr[2], expr[3]
+            if name in AGGREGATES:
+                if self.aggregates is None:
+                    raise QueryError(f"{name} is not allowed here")
+                return self._aggregate(name, args, distinct)
+            return self._scalar(name, args)
+
+        raise QueryError(f"Unsupported expression {kind}")
+
+    def _coerce_dates(self, expr: Any, other: Any) -> Callable[[Dict[str, Any]], Any]:
+        """
+        Compare string literals against date columns as timestamps
+        """
+        if expr[0] == "lit" and isinstance(expr[1], str) and other[0] == "col" \
+                and self.columns.get(other[1]) in DATE_COLUMNS:
+            value = parse_timestamp(expr[1])
+            return lambda row: value
+        return self.compile(expr)
+
+    def _scalar(self, name: str, args: List[Any]) -> Callable[[Dict[str, Any]], Any]:
+        compiled = [self.compile(arg) for arg in args]
+        if name in ("NOW", "CURRENT_TIMESTAMP"):
+            now = self.now
+            return lambda row: now
+        if name in ("TODAY", "CURDATE", "CURRENT_DATE"):
+            today = self.now.replace(hour=0, minute=0, second=0, microsecond=0)
+            return lambda row: today
+        if name in ("DATE_SUB", "DATE_ADD") and len(compiled) == 2:
+            op = "-" if name == "DATE_SUB" else "+"
+            base, delta = compiled
+            return lambda row: _arithmetic(op, parse_timestamp(base(row)), delta(row))
+        if name == "DATE" and len(compiled) == 1:
+            inner = compiled[0]
+            return lambda row: (lambda v: v.replace(hour=0, minute=0, second=0, microsecond=0) if v else None)(
+                parse_timestamp(inner(row))
+            )
+        if name in ("LOWER", "UPPER") and len(compiled) == 1:
+            inner = compiled[0]
+            method = str.lower if name == "LOWER" else str.upper
+            return lambda row: (lambda v: method(v) if isinstance(v, str) else v)(inner(row))
+        if name == "ROUND" and compiled:
+            inner = compiled[0]
+            digits = compiled[1] if len(compiled) > 1 else (lambda row: 0)
+            return lambda row: (lambda v: round(v, int(digits(row))) if v is not None else None)(inner(row))
+        raise QueryError(f"Unsupported function {name}")
+
+    def _aggregate(self, name: str, args: List[Any], distinct: bool) -> Callable[[Dict[str, Any]], Any]:
+        if len(args) != 1:
+            raise QueryError(f"{name} takes one argument")
+        argument = None if args[0] == ("star",) else self.base.compile(args[0])
+        index = len(self.aggregates)
+        self.aggregates.append((name, argument, distinct))
+        return lambda row: row["__aggregates"][index]
+
+
+# Aggregate accumulators: (initial state, update, finalize)
+
+def _new_state(name: str, distinct: bool) -> Any:
+    if distinct:
+        return set()
+    if name == "AVG":
+        return [0.0, 0]
+    if name == "COUNT":
+        return 0
+    return _MISSING
+
+
+class _Missing:
+    # Unpickles to the module's singleton, so identity checks hold for
+    # state shipped back from worker processes
+    def __reduce__(self):
+        return "_MISSING"
+
+
+_MISSING = _Missing()
+
+
+def _update(name: str, distinct: bool, state: Any, value: Any, is_star: bool) -> Any:
+    if distinct:
+        if value is not None:
+            state.add(value)
+        return state
+    if name == "COUNT":
+        return state + 1 if is_star or value is not None else state
+    if value is None:
+        return state
+    if name == "ANY":
+        return value if state is _MISSING else state
+    if name == "SUM":
+        return value if state is _MISSING else state + value
+    if name == "AVG":
+        state[0] += value
+        state[1] += 1
+        return state
+    if name == "MIN":
+        return value if state is _MISSING or value < state else state
+    if name == "MAX":
+        return value if state is _MISSING or value > state else state
+    return state
+
+
+def _merge_state(name: str, distinct: bool, left: Any, right: Any) -> Any:
+    if distinct:
+        return left | right
+    if name == "COUNT":
+        return left + right
+    if name == "AVG":
+        return [left[0] + right[0], left[1] + right[1]]
+    if right is _MISSING:
+        return left
+    if left is _MISSING:
+        return right
+    if name == "SUM":
+        return left + right
+    if name == "MIN":
+        return min(left, right)
+    if name == "MAX":
+        return max(left, right)
+    return left
+
+
+def _finalize(name: str, distinct: bool, state: Any) -> Any:
+    if distinct:
+        if name == "COUNT":
+            return len(state)
+        if name == "SUM":
+            return sum(state) if state else None
+        if name == "AVG":
+            return sum(state) / len(state) if state else None
+        values = sorted(state)
+        return (values[0] if name == "MIN" else values[-1]) if values else None
+    if name == "AVG":
+        return state[0] / state[1] if state[1] else None
+    return None if state is _MISSING else state
+
+
+# Executor
+
+
+def _first_variant_price(record: Dict[str, Any]) -> Optional[float]:
+    variants = record.get("variants") or []
+    return _number(variants[0].get("price")) if variants else None
+
+
+# Row extractors per source, keyed by canonical column. Only the columns a
+# query references are materialized.
+ORDER_FIELDS = {
+    "id": lambda order, customer: order.get("id"),
+    "order_number": lambda order, customer: order.get("order_number"),
+    "total_price": lambda order, customer: _number(order.get("total_price")),
+    "created_at": lambda order, customer: parse_timestamp(order.get("created_at")),
+    "updated_at": lambda order, customer: order.get("updated_at"),
+    "customer_email": lambda order, customer: customer.get("email"),
+    "customer_first_name": lambda order, customer: customer.get("first_name"),
+    "customer_last_name": lambda order, customer: customer.get("last_name"),
+    "customer_name": lambda order, customer: _customer_name(customer),
+}
+LINE_ITEM_FIELDS = {
+    "product_title": lambda item: item.get("title"),
+    "quantity": lambda item: int(item.get("quantity") or 0),
+    "price": lambda item: _number(item.get("price")),
+    "line_total": lambda item: int(item.get("quantity") or 0) * _number(item.get("price")),
+}
+RECORD_FIELDS = {
+    "customers": {
+        "id": lambda record: record.get("id"),
+        "email": lambda record: record.get("email"),
+        "first_name": lambda record: record.get("first_name"),
+        "last_name": lambda record: record.get("last_name"),
+        "customer_name": _customer_name,
+        "orders_count": lambda record: int(record.get("orders_count") or 0),
+        "total_spent": lambda record: _number(record.get("total_spent")),
+        "created_at": lambda record: parse_timestamp(record.get("created_at")),
+        "updated_at": lambda record: record.get("updated_at"),
+    },
+    "inventory_levels": {
+        "inventory_item_id": lambda record: record.get("inventory_item_id"),
+        "location_id": lambda record: record.get("location_id"),
+        "available": lambda record: int(record.get("available") or 0),
+        "incoming": lambda record: int(record.get("incoming") or 0),
+        "committed": lambda record: int(record.get("committed") or 0),
+        "product_title": lambda record: record.get("product_title"),
+    },
+    "products": {
+        "id": lambda record: record.get("id"),
+        "product_title": lambda record: record.get("title"),
+        "vendor": lambda record: record.get("vendor"),
+        "product_type": lambda record: record.get("product_type"),
+        "price": _first_variant_price,
+        "inventory_quantity": lambda record: sum(
+            int(variant.get("inventory_quantity") or 0) for variant in record.get("variants") or []
+        ),
+        "created_at": lambda record: parse_timestamp(record.get("created_at")),
+    },
+}
+PRODUCT_TITLE_KEYS = {"inventory_levels": "product_title", "products": "title"}
+
+
+def scan(plan_: Plan, records: Iterable[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+    """
+    Materialize rows from source records, applying pushed-down predicates
+    before any row dict is built
+    """
+    low = plan_.pushdown.get("created_at_min")
+    high = plan_.pushdown.get("created_at_max")
+    bounded = low is not None or high is not None
+    product_filter = plan_.product_filter
+    fields = plan_.fields
+
+    if plan_.source == "orders":
+        order_fields = [(key, get) for key, get in ORDER_FIELDS.items() if key in fields]
+        item_fields = [(key, get) for key, get in LINE_ITEM_FIELDS.items() if key in fields]
+        for record in records:
+            if bounded:
+                created = parse_timestamp(record.get("created_at"))
+                if created is None or (low is not None and created < low) or (high is not None and created >= high):
+                    continue
+            customer = record.get("customer") or {}
+            row = {key: get(record, customer) for key, get in order_fields}
+            if not plan_.line_grain:
+                yield row
+                continue
+            for item in record.get("line_items") or []:
+                if product_filter is not None and not product_filter(item.get("title")):
+                    continue
+                line = row.copy()
+                for key, get in item_fields:
+                    line[key] = get(item)
+                yield line
+        return
+
+    record_fields = [(key, get) for key, get in RECORD_FIELDS[plan_.source].items() if key in fields]
+    title_key = PRODUCT_TITLE_KEYS.get(plan_.source)
+    for record in records:
+        if bounded:
+            created = parse_timestamp(record.get("created_at"))
+            if created is None or (low is not None and created < low) or (high is not None and created >= high):
+                continue
+        if product_filter is not None and not product_filter(record.get(title_key)):
+            continue
+        yield {key: get(record) for key, get in record_fields}
+
+
+class QueryExecution:
+    """
+    Incremental execution of a plan: feed record batches as pages arrive,
+    then take the result. Aggregated queries hold one accumulator list per
+    group; plain queries hold at most LIMIT rows (a few multiples of it when
+    ordered) unless they have no LIMIT. Executions of the same plan over
+    different partitions can be merged.
+    """
+
+    def __init__(self, plan_: Plan):
+        self.plan = plan_
+        self.groups: Dict[Tuple, List[Any]] = {}
+        self.results: List[Tuple[Dict[str, Any], List[Any]]] = []
+        group_by = plan_.group_by
+        if len(group_by) == 1:
+            single = group_by[0]
+            self._group_key = lambda row: (single(row),)
+        else:
+            self._group_key = lambda row: tuple(evaluate(row) for evaluate in group_by)
+
+    def feed(self, records: Iterable[Dict[str, Any]]) -> "QueryExecution":
+        plan_ = self.plan
+        rows = scan(plan_, records)
+        if plan_.where is not None:
+            where = plan_.where
+            rows = (row for row in rows if where(row))
+
+        if plan_.aggregated:
+            # Hash aggregation: one accumulator list per distinct group key
+            specs = plan_.aggregates
+            groups = self.groups
+            group_key = self._group_key
+            updates = list(enumerate(specs))
+            for row in rows:
+                key = group_key(row)
+                states = groups.get(key)
+                if states is None:
+                    states = [_new_state(name, distinct) for name, _, distinct in specs]
+                    groups[key] = states
+                for index, (name, argument, distinct) in updates:
+                    if argument is None:
+                        states[index] = _update(name, distinct, states[index], 1, True)
+                    else:
+                        states[index] = _update(name, distinct, states[index], argument(row), False)
+            return self
+
+        outputs = plan_.outputs
+        limit = plan_.limit
+        results = self.results
+        for row in rows:
+            if limit is not None and not plan_.order_by and len(results) >= limit:
+                break
+            results.append((row, [evaluate(row) for _, evaluate in outputs]))
+        if limit is not None and plan_.order_by and len(results) > 4 * limit + 64:
+            self.results = list(_sort(results, plan_.order_by, limit))
+        return self
+
+    def merge(self, other: "QueryExecution") -> "QueryExecution":
+        return self.merge_state(other.groups, other.results)
+
+    def merge_state(
+        self,
+        groups: Dict[Tuple, List[Any]],
+        results: List[Tuple[Dict[str, Any], List[Any]]]
+    ) -> "QueryExecution":
+        """
+        Merge the groups and results of another execution of the same plan,
+        e.g. one run in a worker process, where the plan itself cannot travel
+        """
+        specs = self.plan.aggregates
+        for key, states in groups.items():
+            mine = self.groups.get(key)
+            if mine is None:
+                self.groups[key] = states
+                continue
+            for index, (name, _, distinct) in enumerate(specs):
+                mine[index] = _merge_state(name, distinct, mine[index], states[index])
+        self.results.extend(results)
+        return self
+
+    def result(self) -> Dict[str, Any]:
+        plan_ = self.plan
+        outputs = plan_.outputs
+
+        if plan_.aggregated:
+            specs = plan_.aggregates
+            groups = self.groups
+            if not groups and not plan_.group_by:
+                # Global aggregates still return one row over empty input
+                groups = {(): [_new_state(name, distinct) for name, _, distinct in specs]}
+            rows = (
+                {
+                    "__group": key,
+                    "__aggregates": [
+                        _finalize(name, distinct, state)
+                        for (name, _, distinct), state in zip(specs, states)
+                    ],
+                }
+                for key, states in groups.items()
+            )
+            if plan_.having is not None:
+                having = plan_.having
+                rows = (row for row in rows if having(row))
+            results = ((row, [evaluate(row) for _, evaluate in outputs]) for row in rows)
+        else:
+            results = iter(self.results)
+
+        if plan_.order_by:
+            results = _sort(results, plan_.order_by, plan_.limit)
+        elif plan_.limit is not None:
+            results = (result for _, result in zip(range(plan_.limit), results))
+
+        table = [[_output_value(value) for value in values] for _, values in results]
+        return {
+            "table": plan_.table,
+            "columns": [name for name, _ in outputs],
+            "measures": plan_.measures,
+            "rows": table,
+            "row_count": len(table),
+            "aggregated": plan_.aggregated,
+        }
+
+
+def execute(plan_: Plan, records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Run a plan over source records and return the result table
+    """
+    return QueryExecution(plan_).feed(records).result()
+
+
+def _output_value(value: Any) -> Any:
+    # Results are returned as JSON; money sums carry float noise
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, float):
+        return round(value, 2)
+    return value
+
+
+def _sort_key(value: Any) -> Tuple:
+    # None sorts last in ascending order; mixed types fall back to strings
+    if value is None:
+        return (2, 0)
+    if isinstance(value, (int, float, datetime)):
+        return (0, value)
+    return (1, str(value))
+
+
+def _sort(results, order_by, limit: Optional[int]):
+    if len(order_by) == 1 and limit is not None:
+        # Top-k without sorting every group
+        evaluate, descending = order_by[0]
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        return pick(limit, results, key=lambda item: _sort_key(evaluate(item[0], item[1])))
+
+    items = list(results)
+    for evaluate, descending in reversed(order_by):
+        items.sort(key=lambda item: _sort_key(evaluate(item[0], item[1])), reverse=descending)
+    return items[:limit] if limit is not None else items
+
+
+def compile_query(query: str, now: Optional[datetime] = None, tz: tzinfo = timezone.utc) -> Plan:
+    """
+    Parse and plan a query in one step
+    """
+    return plan(parse(query), now, tz)
@@ -0,0 +1,455 @@
+"""
+Seeded synthetic stores for exercising the pipeline at realistic sizes
+offline (SHOPIFY_DATA_BACKEND=synthetic)
+"""
+import asyncio
+import bisect
+import math
+import os
+import random
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from app.time_periods import parse_timestamp
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+# Share of orders by number of line items, and of line items by quantity
+_ITEM_COUNTS = ((1, 0.55), (2, 0.27), (3, 0.12), (4, 0.06))
+_QUANTITIES = ((1, 0.70), (2, 0.20), (3, 0.07), (5, 0.03))
+# Relative order volume Monday..Sunday
+_WEEKDAY_WEIGHTS = (0.95, 0.92, 0.95, 1.0, 1.1, 1.2, 1.12)
+# How strongly orders cluster in the daytime (0 = uniform over the day)
+_DAYTIME = 0.5
+# Orders generated per random stream
+_BLOCK_SIZE = 1024
+
+_ADJECTIVES = (
+    "Classic", "Organic", "Vintage", "Premium", "Everyday", "Artisan", "Compact", "Deluxe",
+    "Rustic", "Modern", "Handmade", "Limited", "Eco", "Signature", "Travel", "Essential",
+)
+_CATEGORIES = (
+    ("Coffee Beans", "Coffee"), ("Tea Collection", "Tea"), ("Mug Set", "Accessories"),
+    ("Grinder", "Equipment"), ("French Press", "Equipment"), ("Tumbler", "Accessories"),
+    ("Espresso Blend", "Coffee"), ("Matcha", "Tea"), ("Pour Over Kit", "Equipment"),
+    ("Gift Box", "Gifts"), ("Cold Brew", "Coffee"), ("Honey", "Pantry"),
+)
+_VENDORS = ("Cafe Nostalgia", "Tea Masters", "Roast House", "Kettle & Co", "Northern Goods")
+_FIRST_NAMES = (
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Elizabeth",
+    "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Carlos", "Aisha",
+    "Wei", "Priya", "Mateo", "Yuki", "Omar", "Sofia", "Liam", "Chloe", "Noah", "Emma",
+)
+_LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Lewis", "Robinson", "Walker",
+)
+
+
+def _mix(value: int) -> int:
+    """
+    splitmix64 finalizer: a well-spread 64-bit hash of a 64-bit value
+    """
+    value = (value + _GOLDEN) & _MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return value ^ (value >> 31)
+
+
+def _rng(seed: int, *parts: int) -> random.Random:
+    """
+    Random stream for one part of a store (a block of orders, the product
+    catalogue, ...), independent of every other part
+    """
+    for part in parts:
+        seed = _mix(seed ^ part)
+    return random.Random(seed)
+
+
+def _cumulative(weights: List[float]) -> List[float]:
+    total = 0.0
+    result = []
+    for weight in weights:
+        total += weight
+        result.append(total)
+    return result
+
+
+def _stamp(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class SyntheticStore:
+    """
+    One generated store. Orders are spread over `days` days ending at
+    `now` with weekly and yearly seasonality, a growth trend and a Black
+    Friday to Christmas peak, and clustered in the daytime. Product
+    popularity is Zipf-distributed; most orders have one or two line
+    items. Customers are acquired steadily and a `repeat_rate` share of
+    orders comes from earlier customers, favouring the longest-standing.
+
+    Orders are generated in blocks, each from its own random stream, and
+    their timestamps from the daily volumes alone, so pages are produced
+    lazily in id (and created_at) order and a created_at range is located
+    by binary search without generating the orders before it.
+    """
+
+    def __init__(
+        self,
+        seed: int,
+        order_count: int,
+        product_count: int,
+        customer_count: int,
+        days: int,
+        now: datetime,
+        repeat_rate: float = 0.4
+    ):
+        self.seed = seed
+        self.order_count = order_count
+        self.product_count = max(1, product_count)
+        self.customer_count = max(1, customer_count)
+        self.days = max(1, days)
+        self.repeat_rate = repeat_rate
+        end_day = now.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.start = end_day - timedelta(days=self.days)
+        self._start_epoch = int(self.start.timestamp())
+        self._day_prefixes = [
+            (self.start + timedelta(days=day)).strftime("%Y-%m-%dT") for day in range(self.days)
+        ]
+        self._day_offsets = self._allocate_days()
+        self._products = self._build_products()
+        self._line_products = [
+            (product["title"], product["variants"][0]["price"], float(product["variants"][0]["price"]))
+            for product in self._products
+        ]
+        self._product_popularity = _cumulative(
+            [1.0 / (rank + 1) ** 1.1 for rank in range(self.product_count)]
+        )
+        self._item_counts = _cumulative([share for _, share in _ITEM_COUNTS])
+        self._quantities = _cumulative([share for _, share in _QUANTITIES])
+        self._customer_stats: Optional[tuple] = None
+
+    # Calendar
+
+    def _allocate_days(self) -> List[int]:
+        """
+        Cumulative order counts per day: day d holds orders
+        offsets[d] .. offsets[d + 1] - 1
+        """
+        rng = _rng(self.seed, 1)
+        weights = []
+        for day in range(self.days):
+            date = (self.start + timedelta(days=day)).date()
+            weight = _WEEKDAY_WEIGHTS[date.weekday()]
+            # Growth from 1x to 2x over the period
+            weight *= 1.0 + day / self.days
+            # Yearly swell peaking in early December
+            weight *= 1.0 + 0.2 * math.cos(2 * math.pi * (date.timetuple().tm_yday - 340) / 365.25)
+            if date.month == 11 and date.day >= 24 or date.month == 12 and date.day <= 2:
+                weight *= 2.5
+            elif date.month == 12 and date.day <= 23:
+                weight *= 1.6
+            weight *= rng.uniform(0.85, 1.15)
+            weights.append(weight)
+
+        # Largest-remainder rounding so the days add up to order_count exactly
+        total = sum(weights)
+        shares = [weight / total * self.order_count for weight in weights]
+        counts = [int(share) for share in shares]
+        remainders = sorted(range(self.days), key=lambda day: counts[day] - shares[day])
+        for day in remainders[:self.order_count - sum(counts)]:
+            counts[day] += 1
+        offsets = [0]
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        return offsets
+
+    def _order_time(self, index: int) -> Tuple[int, int]:
+        """
+        (day, second of the day) the index-th order (0-based) was created;
+        non-decreasing in index
+        """
+        day = bisect.bisect_right(self._day_offsets, index) - 1
+        first = self._day_offsets[day]
+        jitter = _mix(self.seed ^ index) * (1.0 / (1 << 64))
+        position = (index - first + jitter) / (self._day_offsets[day + 1] - first)
+        # Monotone map that thins the night and packs the middle of the day
+        position += _DAYTIME * math.sin(2 * math.pi * position) / (2 * math.pi)
+        return day, min(int(position * 86400), 86399)
+
+    def _created_at(self, index: int) -> str:
+        day, second = self._order_time(index)
+        return f"{self._day_prefixes[day]}{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}Z"
+
+    def _first_order_at(self, epoch: int) -> int:
+        """
+        Index of the first order created at or after epoch
+        """
+        low, high = 0, self.order_count
+        while low < high:
+            middle = (low + high) // 2
+            day, second = self._order_time(middle)
+            if self._start_epoch + day * 86400 + second < epoch:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # Records
+
+    def _build_products(self) -> List[Dict[str, Any]]:
+        rng = _rng(self.seed, 3)
+        products = []
+        created_at = _stamp(self._start_epoch)
+        for index in range(self.product_count):
+            adjective = _ADJECTIVES[index % len(_ADJECTIVES)]
+            name, product_type = _CATEGORIES[(index // len(_ADJECTIVES)) % len(_CATEGORIES)]
+            title = f"{adjective} {name}"
+            if index >= len(_ADJECTIVES) * len(_CATEGORIES):
+                title += f" {index // (len(_ADJECTIVES) * len(_CATEGORIES)) + 1}"
+            # Log-normal prices around $30
+            price = max(round(rng.lognormvariate(math.log(30), 0.6), 2), 2.0)
+            products.append({
+                "id": index + 1,
+                "title": title,
+                "vendor": _VENDORS[index % len(_VENDORS)],
+                "product_type": product_type,
+                "variants": [{
+                    "price": f"{price:.2f}",
+                    "inventory_quantity": rng.randrange(200),
+                    "inventory_item_id": index + 1
+                }],
+                "created_at": created_at,
+                "updated_at": created_at,
+            })
+        return products
+
+    def _customer(self, index: int) -> Dict[str, Any]:
+        names = _mix(self.seed ^ (index << 1) ^ 1)
+        first_name = _FIRST_NAMES[names % len(_FIRST_NAMES)]
+        last_name = _LAST_NAMES[(names >> 32) % len(_LAST_NAMES)]
+        return {
+            "id": index + 1,
+            "email": f"{first_name}.{last_name}.{index + 1}@example.com".lower(),
+            "first_name": first_name,
+            "last_name": last_name,
+        }
+
+    def _block(self, block: int) -> List[Dict[str, Any]]:
+        """
+        Orders block * _BLOCK_SIZE onwards, from the block's own random stream
+        """
+        rng = _rng(self.seed, 5, block)
+        draw = rng.random
+        products = self._line_products
+        popularity, popularity_total = self._product_popularity, self._product_popularity[-1]
+        item_counts, quantities = self._item_counts, self._quantities
+        orders = []
+        first = block * _BLOCK_SIZE
+        for index in range(first, min(first + _BLOCK_SIZE, self.order_count)):
+            line_items = []
+            total = 0.0
+            for _ in range(_ITEM_COUNTS[bisect.bisect_right(item_counts, draw() * item_counts[-1])][0]):
+                title, price, amount = products[bisect.bisect_right(popularity, draw() * popularity_total)]
+                quantity = _QUANTITIES[bisect.bisect_right(quantities, draw() * quantities[-1])][0]
+                total += quantity * amount
+                line_items.append({"title": title, "quantity": quantity, "price": price})
+
+            # The customer acquired around this order, or an earlier one
+            customer = min(index * self.customer_count // self.order_count, self.customer_count - 1)
+            if customer and draw() < self.repeat_rate:
+                customer = int(customer * draw() ** 1.5)
+
+            created_at = self._created_at(index)
+            orders.append({
+                "id": index + 1,
+                "order_number": 1001 + index,
+                "total_price": f"{total:.2f}",
+                "created_at": created_at,
+                "updated_at": created_at,
+                "line_items": line_items,
+                "customer": self._customer(customer),
+            })
+        return orders
+
+    def order(self, index: int) -> Dict[str, Any]:
+        """
+        The index-th order (0-based), in the shape the Shopify fetches return
+        """
+        return self._block(index // _BLOCK_SIZE)[index % _BLOCK_SIZE]
+
+    # Pages
+
+    def iter_orders(
+        self,
+        page_size: int,
+        created_at_min: Optional[datetime] = None,
+        created_at_max: Optional[datetime] = None
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Pages of orders created within [created_at_min, created_at_max)
+        """
+        first = 0 if created_at_min is None else self._first_order_at(math.ceil(created_at_min.timestamp()))
+        end = self.order_count if created_at_max is None else self._first_order_at(math.ceil(created_at_max.timestamp()))
+        page: List[Dict[str, Any]] = []
+        for block in range(first // _BLOCK_SIZE, (end - 1) // _BLOCK_SIZE + 1 if end > first else 0):
+            offset = block * _BLOCK_SIZE
+            for order in self._block(block)[max(first - offset, 0):end - offset]:
+                page.append(order)
+                if len(page) == page_size:
+                    yield page
+                    page = []
+        if page:
+            yield page
+
+    def iter_customers(self, page_size: int) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Pages of customers with orders_count and total_spent. The first call
+        generates every order once to total them.
+        """
+        counts, spent, first_orders = self.customer_stats()
+        for start in range(0, self.customer_count, page_size):
+            page = []
+            for index in range(start, min(start + page_size, self.customer_count)):
+                customer = self._customer(index)
+                created_at = self._created_at(first_orders[index]) if counts[index] else _stamp(self._start_epoch)
+                customer.update({
+                    "orders_count": counts[index],
+                    "total_spent": f"{spent[index]:.2f}",
+                    "created_at": created_at,
+                    "updated_at": created_at,
+                })
+                page.append(customer)
+            yield page
+
+    def customer_stats(self) -> tuple:
+        """
+        Per customer order count, amount spent and first order index,
+        computed once
+        """
+        if self._customer_stats is None:
+            counts = array("l", [0]) * self.customer_count
+            spent = array("d", [0.0]) * self.customer_count
+            first_orders = array("l", [0]) * self.customer_count
+            for orders in self.iter_orders(_BLOCK_SIZE):
+                for order in orders:
+                    customer = order["customer"]["id"] - 1
+                    if not counts[customer]:
+                        first_orders[customer] = order["id"] - 1
+                    counts[customer] += 1
+                    spent[customer] += float(order["total_price"])
+            self._customer_stats = counts, spent, first_orders
+        return self._customer_stats
+
+    def products(self) -> List[Dict[str, Any]]:
+        return self._products
+
+    def inventory(self, product_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        One inventory level per product; popular products carry more stock
+        """
+        rng = _rng(self.seed, 6)
+        levels = []
+        for index, product in enumerate(self._products):
+            scale = 400 / (index + 1) ** 0.5
+            available, incoming, committed = (
+                int(scale * rng.random() * 2),
+                int(scale * rng.random()) if rng.random() < 0.3 else 0,
+                int(scale * 0.1 * rng.random()),
+            )
+            if product_name and product_name.lower() not in product["title"].lower():
+                continue
+            levels.append({
+                "inventory_item_id": index + 1,
+                "location_id": 1,
+                "available": available,
+                "incoming": incoming,
+                "committed": committed,
+                "product_title": product["title"],
+            })
+        return levels
+
+
+class SyntheticBackend:
+    """
+    Generated stores keyed by store id; each store gets its own seed
+    derived from SYNTHETIC_SEED and the id, so stores differ but every run
+    sees the same data
+    """
+
+    def __init__(
+        self,
+        seed: int = 0,
+        order_count: int = 100_000,
+        product_count: int = 200,
+        customer_count: Optional[int] = None,
+        days: int = 730,
+        now: Optional[datetime] = None,
+        repeat_rate: float = 0.4
+    ):
+        self.seed = seed
+        self.order_count = order_count
+        self.product_count = product_count
+        self.customer_count = customer_count or max(1, order_count // 3)
+        self.days = days
+        self.now = now or datetime(2025, 1, 1, tzinfo=timezone.utc)
+        self.repeat_rate = repeat_rate
+        self._stores: Dict[str, SyntheticStore] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["SyntheticBackend"]:
+        """
+        A backend when SHOPIFY_DATA_BACKEND=synthetic, otherwise None
+        """
+        if os.getenv("SHOPIFY_DATA_BACKEND", "shopify") != "synthetic":
+            return None
+        customers = os.getenv("SYNTHETIC_CUSTOMERS")
+        return cls(
+            seed=int(os.getenv("SYNTHETIC_SEED", "0")),
+            order_count=int(os.getenv("SYNTHETIC_ORDERS", "100000")),
+            product_count=int(os.getenv("SYNTHETIC_PRODUCTS", "200")),
+            customer_count=int(customers) if customers else None,
+            days=int(os.getenv("SYNTHETIC_DAYS", "730")),
+            now=parse_timestamp(os.getenv("SYNTHETIC_NOW", "2025-01-01T00:00:00Z")),
+            repeat_rate=float(os.getenv("SYNTHETIC_REPEAT_RATE", "0.4"))
+        )
+
+    def store(self, store_id: str) -> SyntheticStore:
+        store = self._stores.get(store_id)
+        if store is None:
+            store = SyntheticStore(
+                seed=_mix(self.seed) ^ zlib.crc32(store_id.encode()),
+                order_count=self.order_count,
+                product_count=self.product_count,
+                customer_count=self.customer_count,
+                days=self.days,
+                now=self.now,
+                repeat_rate=self.repeat_rate
+            )
+            self._stores[store_id] = store
+        return store
+
+    async def order_pages(
+        self,
+        store_id: str,
+        page_size: int,
+        created_at_min: Optional[datetime] = None,
+        created_at_max: Optional[datetime] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        for orders in self.store(store_id).iter_orders(page_size, created_at_min, created_at_max):
+            yield orders
+            # Generation is CPU-bound; give other requests a turn between pages
+            await asyncio.sleep(0)
+
+    async def customer_pages(self, store_id: str, page_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        store = self.store(store_id)
+        # Totalling every order takes seconds for large stores; keep serving meanwhile
+        await asyncio.to_thread(store.customer_stats)
+        for customers in store.iter_customers(page_size):
+            yield customers
+            await asyncio.sleep(0)
+
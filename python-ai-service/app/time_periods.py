@@ -0,0 +1,243 @@
+"""
+Resolution of free-text time periods ("last 7 days", "next month") to
+concrete UTC date ranges in a store's timezone
+"""
+import re
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Spelled-out numbers understood in periods, limits and cache keys
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13,
+    "fourteen": 14, "fifteen": 15, "sixteen": 16, "seventeen": 17, "eighteen": 18,
+    "nineteen": 19, "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+    "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90, "hundred": 100,
+}
+
+_UNITS = "day|week|month|quarter|year"
+_COUNT = r"\d+|" + "|".join(NUMBER_WORDS)
+_ROLLING = re.compile(rf"\b(last|past|previous|next|coming)\s+({_COUNT})\s+({_UNITS})s?\b")
+_CALENDAR = re.compile(rf"\b(last|past|previous|this|current|next|coming)\s+({_UNITS})\b")
+_TO_DATE = re.compile(rf"\b({_UNITS})[\s-]+to[\s-]+date\b|\b(wtd|mtd|qtd|ytd)\b")
+_NAMED = re.compile(r"\b(today|yesterday|tomorrow)\b")
+
+_ABBREVIATIONS = {"wtd": "week", "mtd": "month", "qtd": "quarter", "ytd": "year"}
+_DIRECTIONS = {"past": "last", "previous": "last", "current": "this", "coming": "next"}
+
+
+class DateRange(NamedTuple):
+    """
+    Half-open [start, end) range of aware UTC datetimes
+    """
+    start: datetime
+    end: datetime
+
+    def contains(self, stamp: datetime) -> bool:
+        return self.start <= stamp < self.end
+
+    def covers(self, start: Optional[datetime], end: Optional[datetime], now: datetime) -> bool:
+        """
+        Whether every record in [start, end) lies within this range; an open
+        start means all history, an open end means up to `now`
+        """
+        return start is not None and start >= self.start and (end or now) <= self.end
+
+    def as_dict(self) -> Dict[str, str]:
+        return {"start": _utc_string(self.start), "end": _utc_string(self.end)}
+
+    @classmethod
+    def from_dict(cls, value: Optional[Dict[str, str]]) -> Optional["DateRange"]:
+        if not value:
+            return None
+        return cls(parse_timestamp(value["start"]), parse_timestamp(value["end"]))
+
+
+def resolve_period(
+    time_period: Optional[str],
+    tz: tzinfo = timezone.utc,
+    now: Optional[datetime] = None,
+    history: bool = False
+) -> Optional[DateRange]:
+    """
+    The range a time period names, in whole local days of `tz`, or None when
+    the phrase is missing or not understood (callers then do not filter).
+
+    - "today", "yesterday", "tomorrow"
+    - "last N days/weeks/months/quarters/years": the N units ending with
+      today, today included, so "last 7 days" is today and the six days
+      before it; like "this month", it includes today's orders so far
+    - "last week/month/quarter/year": the previous calendar unit (weeks start Monday)
+    - "this month", "month to date", "ytd", ...: the current unit through the end of today
+    - "next N days", "next month", ...: the future range
+
+    With history=True a future range is replaced by the equally long range
+    ending with today, which is the data a forecast for it is based on.
+    """
+    spec = _parse_period(time_period)
+    if spec is None:
+        return None
+    now = (now or datetime.now(timezone.utc)).astimezone(tz)
+    today = now.date()
+    tomorrow = today + timedelta(days=1)
+
+    kind = spec[0]
+    if kind == "rolling":
+        _, direction, count, unit = spec
+        if direction == "last":
+            span = (_shift(tomorrow, unit, -count), tomorrow)
+        else:
+            span = (tomorrow, _shift(tomorrow, unit, count))
+    elif kind == "named":
+        offset = {"yesterday": -1, "today": 0, "tomorrow": 1}[spec[1]]
+        span = (today + timedelta(days=offset), today + timedelta(days=offset + 1))
+    elif kind == "to_date":
+        span = (_unit_start(today, spec[1]), tomorrow)
+    else:
+        _, direction, unit = spec
+        current = _unit_start(today, unit)
+        if direction == "this":
+            span = (current, tomorrow)
+        elif direction == "last":
+            span = (_shift(current, unit, -1), current)
+        else:
+            span = (_shift(current, unit, 1), _shift(current, unit, 2))
+
+    start, end = span
+    if history and start > today:
+        start, end = tomorrow - (end - start), tomorrow
+    return DateRange(_local_midnight(start, tz), _local_midnight(end, tz))
+
+
+def canonical_period(time_period: Optional[str]) -> Optional[str]:
+    """
+    The normalized phrase for a period ("past seven days" -> "last 7 days",
+    "mtd" -> "this month"), or None when it is not understood
+    """
+    spec = _parse_period(time_period)
+    if spec is None:
+        return None
+    kind = spec[0]
+    if kind == "rolling":
+        _, direction, count, unit = spec
+        return f"{direction} {count} {unit}{'s' if count != 1 else ''}"
+    if kind == "named":
+        return spec[1]
+    if kind == "to_date":
+        return f"this {spec[1]}"
+    return f"{spec[1]} {spec[2]}"
+
+
+def _parse_period(time_period: Optional[str]) -> Optional[tuple]:
+    """
+    ("rolling", direction, count, unit), ("named", day), ("to_date", unit)
+    or ("calendar", direction, unit); directions are last / this / next
+    """
+    if not time_period:
+        return None
+    text = " ".join(time_period.lower().split())
+    match = _ROLLING.search(text)
+    if match:
+        direction = _DIRECTIONS.get(match.group(1), match.group(1))
+        count = int(NUMBER_WORDS.get(match.group(2), match.group(2)))
+        return "rolling", direction, count, match.group(3)
+    match = _NAMED.search(text)
+    if match:
+        return "named", match.group(1)
+    match = _TO_DATE.search(text)
+    if match:
+        return "to_date", match.group(1) or _ABBREVIATIONS[match.group(2)]
+    match = _CALENDAR.search(text)
+    if match:
+        return "calendar", _DIRECTIONS.get(match.group(1), match.group(1)), match.group(2)
+    return None
+
+
+def padded_bounds(start: Optional[datetime], end: Optional[datetime]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    String bounds for stored created_at values, widened by a day: stored
+    timestamps keep the shop's UTC offset, so comparing them as strings
+    is only exact to within a day. Either bound may be open (None).
+    Callers filter exactly afterwards.
+    """
+    return (
+        _utc_string(start - timedelta(days=1)) if start is not None else None,
+        _utc_string(end + timedelta(days=1)) if end is not None else None,
+    )
+
+
+def filter_orders(orders: List[Dict[str, Any]], window: Optional[DateRange]) -> List[Dict[str, Any]]:
+    """
+    Orders whose created_at falls within the range; all of them without one
+    """
+    if window is None:
+        return orders
+    kept = []
+    for order in orders:
+        stamp = parse_timestamp(order.get("created_at"))
+        if stamp is not None and window.contains(stamp):
+            kept.append(order)
+    return kept
+
+
+def period_key(time_period: Optional[str]) -> Optional[str]:
+    """
+    Timezone-independent canonical form of a time period, equal for
+    phrases that resolve to the same range in any store ("past 7 days" and
+    "last seven days"); unrecognized phrases are only whitespace- and
+    case-normalized
+    """
+    if not time_period:
+        return None
+    text = " ".join(time_period.lower().split())
+    # Mid-week, mid-quarter, after a 31-day month and a leap day: "last 30
+    # days" and "last 1 month", "this quarter" and "ytd" all differ here
+    anchor = datetime(2000, 8, 17, 12, tzinfo=timezone.utc)
+    window = resolve_period(text, timezone.utc, anchor)
+    if window is None:
+        return text
+    return f"{_utc_string(window.start)}/{_utc_string(window.end)}"
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        stamp = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return stamp if stamp.tzinfo else stamp.replace(tzinfo=timezone.utc)
+
+
+def _unit_start(day: date, unit: str) -> date:
+    if unit == "day":
+        return day
+    if unit == "week":
+        return day - timedelta(days=day.weekday())
+    if unit == "month":
+        return day.replace(day=1)
+    if unit == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day.replace(month=1, day=1)
+
+
+def _shift(day: date, unit: str, count: int) -> date:
+    """
+    Move a date by whole units, clamping to the end of shorter months
+    """
+    if unit in ("day", "week"):
+        return day + timedelta(days=count * (7 if unit == "week" else 1))
+    months = count * {"month": 1, "quarter": 3, "year": 12}[unit]
+    index = day.year * 12 + day.month - 1 + months
+    year, month = divmod(index, 12)
+    month += 1
+    following = date(year + (month == 12), month % 12 + 1, 1)
+    return date(year, month, min(day.day, (following - timedelta(days=1)).day))
+
+
+def _local_midnight(day: date, tz: tzinfo) -> datetime:
+    return datetime.combine(day, time(), tzinfo=tz).astimezone(timezone.utc)
+
+
+def _utc_string(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,28 @@
+"""
+Shopify webhook verification and topic routing
+"""
+import base64
+import hashlib
+import hmac
+from typing import Optional
+
+# Supported topics: the local-store resource each one updates, and the
+# answer data types whose cached answers the change can affect. Any
+# question may query orders, so order changes reach beyond "sales".
+WEBHOOK_TOPICS = {
+    "orders/create": ("orders", ("sales", "customers", "general")),
+    "orders/updated": ("orders", ("sales", "customers", "general")),
+    "inventory_levels/update": ("inventory_levels", ("inventory",)),
+    "customers/update": ("customers", ("customers",)),
+}
+
+
+def verify_webhook(body: bytes, signature: Optional[str], secret: str) -> bool:
+    """
+    Check X-Shopify-Hmac-Sha256: the base64 HMAC-SHA256 of the raw request
+    body keyed with the app's secret. Always fails without a secret.
+    """
+    if not secret or not signature:
+        return False
+    digest = base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+    return hmac.compare_digest(digest, signature)
@@ -0,0 +1,142 @@
+"""
+Stand-in for the OpenAI chat completions API, for benchmarks.
+
+Answers the service's four prompt kinds (intent, fused plan, ShopifyQL,
+answer) with canned content after a configurable delay:
+
+    FAKE_OPENAI_LATENCY        seconds before the first byte (default 0.2)
+    FAKE_OPENAI_TOKEN_LATENCY  seconds between streamed chunks (default 0.005)
+    FAKE_OPENAI_ANSWER_WORDS   words in a generated answer (default 40)
+
+Run with: uvicorn benchmarks.fake_openai:app --port 9100
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+LATENCY = float(os.getenv("FAKE_OPENAI_LATENCY", "0.2"))
+TOKEN_LATENCY = float(os.getenv("FAKE_OPENAI_TOKEN_LATENCY", "0.005"))
+ANSWER_WORDS = int(os.getenv("FAKE_OPENAI_ANSWER_WORDS", "40"))
+
+QUERIES = {
+    "sales": (
+        "FROM orders\nDURING last_7_days\nGROUP BY product_title\n"
+        "SELECT product_title, SUM(quantity) AS total_sold\nORDER BY total_sold DESC\nLIMIT 5"
+    ),
+    "inventory": "FROM inventory_levels\nSELECT available, incoming, committed\nLIMIT 10",
+    "customers": (
+        "FROM orders\nDURING last_90_days\nGROUP BY customer_email\n"
+        "HAVING COUNT(*) > 1\nSELECT customer_email, COUNT(*) AS order_count"
+    ),
+    "products": "FROM products\nSELECT COUNT(*) AS product_count",
+    "general": "FROM orders\nSELECT COUNT(*) AS total_orders",
+}
+
+app = FastAPI()
+
+
+def _question(prompt: str) -> str:
+    match = re.search(r'Question: "([^"]*)"', prompt)
+    return match.group(1) if match else prompt
+
+
+def _intent(question: str) -> Dict[str, Any]:
+    text = question.lower()
+    if re.search(r"inventory|stock|units of", text):
+        intent_type = "inventory"
+    elif re.search(r"customer", text):
+        intent_type = "customers"
+    elif re.search(r"sell|sales|revenue|order", text):
+        intent_type = "sales"
+    elif "product" in text:
+        intent_type = "products"
+    else:
+        intent_type = "general"
+    period = re.search(r"(?:last|past|this|next) (?:\d+ )?(?:day|week|month|quarter|year)s?", text)
+    return {
+        "intent_type": intent_type,
+        "time_period": period.group(0) if period else None,
+        "metrics": [],
+        "product_mentioned": None,
+        "confidence": "high",
+    }
+
+
+def _content(system: str, prompt: str) -> str:
+    question = _question(prompt)
+    if "extracting intent" in system:
+        return json.dumps(_intent(question))
+    if "single valid JSON object" in system:
+        plan = _intent(question)
+        plan["query"] = QUERIES[plan["intent_type"]]
+        return json.dumps(plan)
+    if "ShopifyQL" in system:
+        return QUERIES[_intent(question)["intent_type"]]
+    words = ["Your", "store", "is", "doing", "well", "and", "sales", "are", "steady."]
+    return " ".join(words[index % len(words)] for index in range(ANSWER_WORDS))
+
+
+def _usage(prompt: str, content: str) -> Dict[str, int]:
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    system = body["messages"][0]["content"]
+    prompt = body["messages"][-1]["content"]
+    content = _content(system, prompt)
+    await asyncio.sleep(LATENCY)
+    created = int(time.time())
+
+    if not body.get("stream"):
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": created,
+            "model": body.get("model", "fake"),
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            ],
+            "usage": _usage(prompt, content),
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage")
+
+    async def events():
+        for start in range(0, len(content), 16):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": content[start:start + 16]}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            if TOKEN_LATENCY:
+                await asyncio.sleep(TOKEN_LATENCY)
+        if include_usage:
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model", "fake"),
+                "choices": [],
+                "usage": _usage(prompt, content),
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,209 @@
+"""
+Stand-in for the Shopify Admin REST API, for benchmarks.
+
+Serves the same seeded store for every shop domain: orders, customers,
+products, inventory levels and shop.json, with cursor pagination, the
+created_at / updated_at filters and `fields` the service uses, and a
+configurable delay per call:
+
+    FAKE_SHOPIFY_LATENCY    seconds per API call (default 0.02)
+    FAKE_SHOPIFY_ORDERS     orders in the store (default 2000)
+    FAKE_SHOPIFY_PRODUCTS   products (default 50)
+    FAKE_SHOPIFY_CUSTOMERS  customers (default 300)
+    FAKE_SHOPIFY_LINE_ITEMS max line items per order (default 3)
+    FAKE_SHOPIFY_DAYS       days of order history, ending now (default 180)
+    FAKE_SHOPIFY_TIMEZONE   the shop's iana_timezone (default America/New_York)
+    FAKE_SHOPIFY_SEED       random seed (default 1)
+
+Point the service at it with
+SHOPIFY_API_BASE_URL=http://127.0.0.1:9200/admin/api/2024-01 and any
+SHOPIFY_ACCESS_TOKEN. Run with: uvicorn benchmarks.fake_shopify:app --port 9200
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY = float(os.getenv("FAKE_SHOPIFY_LATENCY", "0.02"))
+ORDER_COUNT = int(os.getenv("FAKE_SHOPIFY_ORDERS", "2000"))
+PRODUCT_COUNT = int(os.getenv("FAKE_SHOPIFY_PRODUCTS", "50"))
+CUSTOMER_COUNT = int(os.getenv("FAKE_SHOPIFY_CUSTOMERS", "300"))
+MAX_LINE_ITEMS = int(os.getenv("FAKE_SHOPIFY_LINE_ITEMS", "3"))
+HISTORY_DAYS = int(os.getenv("FAKE_SHOPIFY_DAYS", "180"))
+TIMEZONE = os.getenv("FAKE_SHOPIFY_TIMEZONE", "America/New_York")
+API_PREFIX = "/admin/api/2024-01"
+MAX_PAGE_SIZE = 250
+
+
+def _stamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def build_store(
+    seed: int = 1,
+    order_count: int = ORDER_COUNT,
+    product_count: int = PRODUCT_COUNT,
+    customer_count: int = CUSTOMER_COUNT,
+    max_line_items: int = MAX_LINE_ITEMS,
+    history_days: int = HISTORY_DAYS
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    A seeded store: the same seed and sizes give the same records, with
+    order dates spread evenly over the history ending now
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start = now - timedelta(days=history_days)
+
+    products = []
+    levels = []
+    for index in range(1, product_count + 1):
+        item_id = 10_000 + index
+        price = f"{rng.randint(500, 20000) / 100:.2f}"
+        products.append({
+            "id": index,
+            "title": f"Product {index}",
+            "vendor": f"Vendor {index % 7}",
+            "product_type": f"Type {index % 5}",
+            "variants": [{"id": 20_000 + index, "price": price, "inventory_quantity": 0, "inventory_item_id": item_id}],
+            "created_at": _stamp(start),
+            "updated_at": _stamp(start),
+        })
+        levels.append({"inventory_item_id": item_id, "location_id": 1, "available": rng.randint(0, 200)})
+
+    customers = [
+        {
+            "id": index,
+            "email": f"customer{index}@example.com",
+            "first_name": "Customer",
+            "last_name": str(index),
+            "orders_count": 0,
+            "total_spent": "0.00",
+            "created_at": _stamp(start),
+            "updated_at": _stamp(start),
+        }
+        for index in range(1, customer_count + 1)
+    ]
+
+    orders = []
+    span = (now - start).total_seconds()
+    for index in range(1, order_count + 1):
+        created = _stamp(start + timedelta(seconds=span * index / (order_count + 1)))
+        line_items = []
+        for _ in range(rng.randint(1, max_line_items)):
+            product = rng.choice(products)
+            line_items.append({
+                "title": product["title"],
+                "quantity": rng.randint(1, 4),
+                "price": product["variants"][0]["price"],
+            })
+        total = sum(item["quantity"] * float(item["price"]) for item in line_items)
+        customer = customers[rng.randrange(len(customers))]
+        customer["orders_count"] += 1
+        customer["total_spent"] = f"{float(customer['total_spent']) + total:.2f}"
+        orders.append({
+            "id": index,
+            "order_number": 1000 + index,
+            "total_price": f"{total:.2f}",
+            "created_at": created,
+            "updated_at": created,
+            "line_items": line_items,
+            "customer": {k: customer[k] for k in ("id", "email", "first_name", "last_name")},
+        })
+
+    return {"orders": orders, "customers": customers, "products": products, "inventory_levels": levels}
+
+
+STORE = build_store(int(os.getenv("FAKE_SHOPIFY_SEED", "1")))
+CALLS = {"total": 0}
+
+app = FastAPI()
+
+
+def _filtered(resource: str, filters: Dict[str, str]) -> List[Dict[str, Any]]:
+    records = STORE[resource]
+    if "inventory_item_ids" in filters:
+        ids = {int(item_id) for item_id in filters["inventory_item_ids"].split(",") if item_id}
+        records = [record for record in records if record["inventory_item_id"] in ids]
+    for key, field, keep in (
+        ("created_at_min", "created_at", lambda value, bound: value >= bound),
+        ("created_at_max", "created_at", lambda value, bound: value <= bound),
+        ("updated_at_min", "updated_at", lambda value, bound: value >= bound),
+    ):
+        if key in filters:
+            bound = _stamp(datetime.fromisoformat(filters[key].replace("Z", "+00:00")).astimezone(timezone.utc))
+            records = [record for record in records if keep(record.get(field, ""), bound)]
+    return records
+
+
+async def _page(request: Request, resource: str) -> JSONResponse:
+    """
+    One page of a resource. Like Shopify, the filters are fixed by the
+    first request and carried in the opaque page_info cursor.
+    """
+    CALLS["total"] += 1
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+    params = dict(request.query_params)
+    limit = min(int(params.pop("limit", 50)), MAX_PAGE_SIZE)
+    if "page_info" in params:
+        cursor = json.loads(base64.urlsafe_b64decode(params["page_info"]))
+        filters, offset = cursor["filters"], cursor["offset"]
+    else:
+        filters, offset = params, 0
+
+    records = _filtered(resource, filters)
+    page = records[offset:offset + limit]
+    fields = filters.get("fields")
+    if fields:
+        names = fields.split(",")
+        page = [{name: record[name] for name in names if name in record} for record in page]
+
+    headers = {"X-Shopify-Shop-Api-Call-Limit": "1/40"}
+    if offset + limit < len(records):
+        cursor = base64.urlsafe_b64encode(
+            json.dumps({"filters": filters, "offset": offset + limit}).encode()
+        ).decode()
+        url = f"{str(request.base_url).rstrip('/')}{request.url.path}?limit={limit}&page_info={cursor}"
+        headers["Link"] = f'<{url}>; rel="next"'
+    return JSONResponse({resource: page}, headers=headers)
+
+
+@app.get(API_PREFIX + "/orders.json")
+async def orders(request: Request):
+    return await _page(request, "orders")
+
+
+@app.get(API_PREFIX + "/customers.json")
+async def customers(request: Request):
+    return await _page(request, "customers")
+
+
+@app.get(API_PREFIX + "/products.json")
+async def products(request: Request):
+    return await _page(request, "products")
+
+
+@app.get(API_PREFIX + "/inventory_levels.json")
+async def inventory_levels(request: Request):
+    return await _page(request, "inventory_levels")
+
+
+@app.get(API_PREFIX + "/shop.json")
+async def shop():
+    CALLS["total"] += 1
+    return {"shop": {"iana_timezone": TIMEZONE}}
+
+
+@app.get("/calls")
+async def calls():
+    """
+    API calls served so far, for reporting how many a benchmark made
+    """
+    return CALLS
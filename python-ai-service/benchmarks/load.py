@@ -0,0 +1,254 @@
+"""
+Load test for /api/v1/analyze against local fake OpenAI and Shopify servers.
+
+Starts benchmarks.fake_openai, benchmarks.fake_shopify and the service
+(uvicorn main:app) as subprocesses, then sends a fixed number of questions
+at each concurrency level and reports latency percentiles, throughput and
+the service's memory:
+
+    python -m benchmarks.load --concurrency 1,4,16,64 --requests 200
+    python -m benchmarks.load --llm-latency 0.5 --orders 20000 --output results.json
+    python -m benchmarks.load --no-llm --stores 10   # repeat questions hit the caches
+
+--stores 0 (the default) sends every request for a different store, so no
+cache or in-flight coalescing can answer it; a small number measures the
+cached path instead.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.questions import QUESTIONS
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+API_KEY = "benchmark-key"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start(app: str, port: int, env: Dict[str, str], workers: int = 1) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "uvicorn", app,
+        "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "warning", "--no-access-log",
+    ]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    return subprocess.Popen(command, cwd=SERVICE_DIR, env={**os.environ, **env})
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+def _rss_mb(pid: int) -> Dict[str, Optional[float]]:
+    """
+    Resident and peak memory of a process and its children (uvicorn
+    workers), from /proc; None where /proc is unavailable
+    """
+    pids = [pid]
+    try:
+        children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+        pids += [int(child) for child in children]
+    except OSError:
+        return {"rss_mb": None, "peak_rss_mb": None}
+    rss = peak = 0
+    for process_id in pids:
+        try:
+            status = Path(f"/proc/{process_id}/status").read_text()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            if line.startswith("VmRSS:"):
+                rss += int(line.split()[1])
+            elif line.startswith("VmHWM:"):
+                peak += int(line.split()[1])
+    return {"rss_mb": round(rss / 1024, 1), "peak_rss_mb": round(peak / 1024, 1)}
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    url: str,
+    concurrency: int,
+    requests: int,
+    stores: int,
+    offset: int
+) -> Dict[str, Any]:
+    """
+    Send `requests` questions with `concurrency` requests in flight
+    """
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal next_index, errors
+        while next_index < requests:
+            index = offset + next_index
+            next_index += 1
+            store = index % stores if stores else index
+            payload = {
+                "question": QUESTIONS[index % len(QUESTIONS)],
+                "store_id": f"bench-{store}.myshopify.com",
+            }
+            started = time.perf_counter()
+            try:
+                response = await client.post(url, json=payload, headers={"X-API-Key": API_KEY})
+                failed = response.status_code != 200 or "error" in (response.json().get("metadata") or {})
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(_percentile(ordered, 0.50) * 1000, 1),
+        "p95_ms": round(_percentile(ordered, 0.95) * 1000, 1),
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+    }
+
+
+async def drive(args: argparse.Namespace, base_url: str, service_pid: Optional[int]) -> List[Dict[str, Any]]:
+    url = f"{base_url}/api/v1/analyze"
+    levels = [int(level) for level in args.concurrency.split(",")]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    results = []
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        # Warm up imports, pools and the shop timezone lookup outside the measurement
+        await run_level(client, url, 1, args.warmup, args.stores, offset=10**6)
+        offset = 0
+        for concurrency in levels:
+            result = await run_level(client, url, concurrency, args.requests, args.stores, offset)
+            offset += args.requests
+            if service_pid is not None:
+                result.update(_rss_mb(service_pid))
+            results.append(result)
+            _print_row(result)
+    return results
+
+
+def _print_row(result: Dict[str, Any]) -> None:
+    print(
+        f"{result['concurrency']:>11} {result['requests']:>8} {result['errors']:>6} "
+        f"{result['rps']:>9.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+        f"{result['p99_ms']:>9.1f} {result['max_ms']:>9.1f} {result.get('rss_mb') or '-':>8}",
+        flush=True
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before the first level")
+    parser.add_argument("--stores", type=int, default=0, help="distinct store ids to cycle through; 0 = one per request")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request client timeout in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the service")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake OpenAI seconds per completion")
+    parser.add_argument("--answer-words", type=int, default=40, help="fake OpenAI answer length")
+    parser.add_argument("--no-llm", action="store_true", help="run the service without an OpenAI key")
+    parser.add_argument("--shopify-latency", type=float, default=0.02, help="fake Shopify seconds per API call")
+    parser.add_argument("--orders", type=int, default=2000, help="orders in the fake store")
+    parser.add_argument("--products", type=int, default=50, help="products in the fake store")
+    parser.add_argument("--customers", type=int, default=300, help="customers in the fake store")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra service environment")
+    parser.add_argument("--url", help="benchmark an already running service instead of starting one")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    processes = []
+    try:
+        if args.url:
+            base_url, service_pid = args.url.rstrip("/"), None
+        else:
+            openai_port, shopify_port, service_port = _free_port(), _free_port(), _free_port()
+            fake_openai = _start("benchmarks.fake_openai:app", openai_port, {
+                "FAKE_OPENAI_LATENCY": str(args.llm_latency),
+                "FAKE_OPENAI_ANSWER_WORDS": str(args.answer_words),
+            })
+            fake_shopify = _start("benchmarks.fake_shopify:app", shopify_port, {
+                "FAKE_SHOPIFY_LATENCY": str(args.shopify_latency),
+                "FAKE_SHOPIFY_ORDERS": str(args.orders),
+                "FAKE_SHOPIFY_PRODUCTS": str(args.products),
+                "FAKE_SHOPIFY_CUSTOMERS": str(args.customers),
+            })
+            processes += [fake_openai, fake_shopify]
+            _wait_ready(f"http://127.0.0.1:{openai_port}/docs", fake_openai)
+            _wait_ready(f"http://127.0.0.1:{shopify_port}/calls", fake_shopify)
+
+            env = {
+                "API_KEY": API_KEY,
+                "OPENAI_API_KEY": "" if args.no_llm else "benchmark",
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+                "SHOPIFY_ACCESS_TOKEN": "benchmark",
+                "SHOPIFY_API_BASE_URL": f"http://127.0.0.1:{shopify_port}/admin/api/2024-01",
+                "SHOPIFY_BULK_MODE": "never",
+            }
+            env.update(pair.split("=", 1) for pair in args.env)
+            service = _start("main:app", service_port, env, workers=args.workers)
+            processes.append(service)
+            base_url, service_pid = f"http://127.0.0.1:{service_port}", service.pid
+            _wait_ready(f"{base_url}/health", service)
+
+        print(f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'rps':>9} {'p50 ms':>9} "
+              f"{'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'rss MB':>8}")
+        results = asyncio.run(drive(args, base_url, service_pid))
+    finally:
+        # The service first, so its background work never sees the fakes gone
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key != "output"}
+        Path(args.output).write_text(json.dumps({"settings": settings, "results": results}, indent=2) + "\n")
+    return 1 if any(result["errors"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Microbenchmarks for the CPU-bound steps of answering a question, with
+saved baselines for regression checks:
+
+    python -m benchmarks.micro                                  # print timings
+    python -m benchmarks.micro --save benchmarks/baseline.json  # record a baseline
+    python -m benchmarks.micro --compare benchmarks/baseline.json --tolerance 0.25
+
+--compare exits with status 1 when a benchmark is slower than its baseline
+by more than the tolerance. Baselines are machine-specific: record one on
+the machine (or CI runner type) that compares against it.
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.fake_shopify import build_store
+from benchmarks.questions import QUESTIONS
+from app.intent_classifier import IntentClassifier
+from app.query_templates import render_query
+from app.response_formatter import ResponseFormatter
+from app.shopifyql import compile_query
+
+
+def _benchmarks() -> Dict[str, Callable[[], Any]]:
+    """
+    Name -> zero-argument callable; each call is one unit of work
+    """
+    # Fixed sizes, independent of the FAKE_SHOPIFY_* environment
+    store = build_store(
+        seed=1, order_count=2000, product_count=50, customer_count=300, max_line_items=3, history_days=180
+    )
+    orders = store["orders"]
+    levels = [
+        {**level, "incoming": 0, "committed": 0, "product_title": f"Product {index}"}
+        for index, level in enumerate(store["inventory_levels"])
+    ]
+    customers = store["customers"]
+    formatter = ResponseFormatter(None)
+    classifier = IntentClassifier()
+    intents = [classifier.classify(question) for question in QUESTIONS]
+    sales_intent = {"intent_type": "sales", "time_period": "last 30 days"}
+    query = render_query(QUESTIONS[0], intents[0])
+
+    def classify_all() -> None:
+        for question in QUESTIONS:
+            classifier.classify(question)
+
+    def render_all() -> None:
+        for question, intent in zip(QUESTIONS, intents):
+            render_query(question, intent)
+
+    return {
+        # Per question in the mix
+        "intent_classify": classify_all,
+        "query_templates": render_all,
+        "shopifyql_compile": lambda: compile_query(query),
+        # Over the whole seeded store (2000 orders, 50 products, 300 customers)
+        "insights_sales": lambda: formatter._calculate_insights("sales", orders, sales_intent),
+        "insights_inventory": lambda: formatter._calculate_insights("inventory", levels, {"intent_type": "inventory"}),
+        "insights_customers": lambda: formatter._calculate_insights("customers", customers, {"intent_type": "customers"}),
+    }
+
+
+# Benchmarks that loop over the question mix report time per question
+PER_QUESTION = {"intent_classify", "query_templates"}
+
+
+def measure(fn: Callable[[], Any], repeat: int = 5) -> float:
+    """
+    Best-of-`repeat` microseconds per call; each repeat runs for at least 0.2s
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def run(names: Optional[List[str]] = None, repeat: int = 5) -> Dict[str, float]:
+    results = {}
+    for name, fn in _benchmarks().items():
+        if names and name not in names:
+            continue
+        micros = measure(fn, repeat)
+        if name in PER_QUESTION:
+            micros /= len(QUESTIONS)
+        results[name] = round(micros, 3)
+    return results
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """
+    Print each benchmark against its baseline and return the regressed names
+    """
+    regressions = []
+    print(f"{'benchmark':<20} {'baseline us':>12} {'current us':>12} {'ratio':>7}")
+    for name, micros in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<20} {'-':>12} {micros:>12.3f} {'new':>7}")
+            continue
+        ratio = micros / before if before else float("inf")
+        flag = " REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:<20} {before:>12.3f} {micros:>12.3f} {ratio:>7.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repeats; the best is kept")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing, as a fraction")
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.repeat)
+    status = 0
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Slower than baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            status = 1
+    else:
+        for name, micros in results.items():
+            print(f"{name:<20} {micros:>12.3f} us")
+
+    if args.save:
+        record = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+        Path(args.save).write_text(json.dumps(record, indent=2) + "\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+"""
+Question mix used by the load driver and the microbenchmarks
+"""
+
+QUESTIONS = [
+    "What were my top 5 selling products last week?",
+    "What was my revenue in the last 30 days?",
+    "Which customers placed repeat orders in the last 90 days?",
+    "How much inventory do I have?",
+    "How many units of 'Product 7' do I have in stock?",
+    "What's my average order value this month?",
+    "Who are my top 3 customers?",
+    "How many orders did I get yesterday?",
+    "Which products are running out of stock?",
+    "How many units of Product 12 will I need next month?",
+    "Top ten products by revenue in the past 7 days",
+    "Tell me something interesting about my store",
+]
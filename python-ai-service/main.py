@@ -1,16 +1,74 @@
-from fastapi import FastAPI, HTTPException, Header
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from pydantic import BaseModel, Field
+from typing import List, Optional
+import json
 import os
 from dotenv import load_dotenv
 
 from app.agent import AnalyticsAgent
+from app.metrics import AgentCollector
+from app.profiler import FORMATS, ProfileLimitExceeded, RequestProfiler
 from app.shopify_client import ShopifyClient
+from app.webhooks import WEBHOOK_TOPICS, verify_webhook
 
 load_dotenv()
 
-app = FastAPI(title="Shopify Analytics AI Service", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Build one shared agent per process, start its background work, expose
+    its counters on /metrics and close its clients on shutdown
+    """
+    app.state.agent = AnalyticsAgent()
+    app.state.agent.start()
+    app.state.profiler = RequestProfiler.from_env()
+    collector = AgentCollector(app.state.agent)
+    REGISTRY.register(collector)
+    try:
+        yield
+    finally:
+        REGISTRY.unregister(collector)
+        await app.state.agent.aclose()
+
+def get_agent(request: Request) -> AnalyticsAgent:
+    """
+    Dependency returning the process-wide analytics agent
+    """
+    return request.app.state.agent
+
+def verify_api_key(x_api_key: Optional[str] = Header(None)) -> None:
+    """
+    Simple API key validation (can be enhanced)
+    """
+    expected_key = os.getenv("API_KEY", "default-key")
+    if x_api_key != expected_key:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+def profile_format(
+    request: Request,
+    profile: Optional[str] = Query(None),
+    x_profile: Optional[str] = Header(None),
+    x_admin_key: Optional[str] = Header(None)
+) -> Optional[str]:
+    """
+    The profile format an admin asked for with ?profile= or X-Profile,
+    or None for an ordinary request
+    """
+    fmt = profile or x_profile
+    if not fmt:
+        return None
+    profiler = request.app.state.profiler
+    if profiler is None or not profiler.authorized(x_admin_key):
+        raise HTTPException(status_code=403, detail="Profiling requires a valid X-Admin-Key")
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown profile format {fmt!r}; use {' or '.join(FORMATS)}")
+    return fmt
+
+app = FastAPI(title="Shopify Analytics AI Service", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -32,26 +90,51 @@ class AnalyzeResponse(BaseModel):
     query_used: Optional[str] = None
     metadata: Optional[dict] = None
 
+class BatchAnalyzeRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=20)
+    store_id: str
+
+class BatchAnalyzeResult(AnalyzeResponse):
+    question: str
+    error: Optional[str] = None
+
+class BatchAnalyzeResponse(BaseModel):
+    results: List[BatchAnalyzeResult]
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok", "service": "Shopify Analytics AI Service"}
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics for this worker process: latency histograms per
+    stage and intent type, LLM tokens, cache hit ratios, Shopify calls and
+    in-flight gauges
+    """
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/api/v1/analyze", response_model=AnalyzeResponse)
 async def analyze_question(
     request: AnalyzeRequest,
-    x_api_key: Optional[str] = Header(None)
+    http_request: Request,
+    _: None = Depends(verify_api_key),
+    agent: AnalyticsAgent = Depends(get_agent),
+    profile: Optional[str] = Depends(profile_format)
 ):
     """
-    Main endpoint that receives natural language questions and returns AI-powered insights
+    Main endpoint that receives natural language questions and returns AI-powered insights.
+    Admins can add ?profile=collapsed|speedscope (or an X-Profile header)
+    with X-Admin-Key to profile the request; see metadata.profile.
     """
-    # Simple API key validation (can be enhanced)
-    expected_key = os.getenv("API_KEY", "default-key")
-    if x_api_key != expected_key:
-        raise HTTPException(status_code=401, detail="Invalid API key")
-    
     try:
-        agent = AnalyticsAgent()
-        result = await agent.process_question(request.question, request.store_id)
+        if profile:
+            profiler = http_request.app.state.profiler
+            async with profiler.profile() as session:
+                result = await agent.process_question(request.question, request.store_id)
+            result.setdefault("metadata", {})["profile"] = profiler.export(session, profile, request.store_id)
+        else:
+            result = await agent.process_question(request.question, request.store_id)
         
         return AnalyzeResponse(
             answer=result["answer"],
@@ -59,12 +142,122 @@ async def analyze_question(
             query_used=result.get("query_used"),
             metadata=result.get("metadata", {})
         )
+    except ProfileLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error processing question: {str(e)}"
         )
 
+@app.post("/api/v1/analyze/stream")
+async def analyze_question_stream(
+    request: AnalyzeRequest,
+    _: None = Depends(verify_api_key),
+    agent: AnalyticsAgent = Depends(get_agent)
+):
+    """
+    Server-Sent Events variant of /api/v1/analyze: intent, query and
+    insights are sent as soon as they are ready, then the answer as it is
+    generated, then a final "done" event with the full response
+    """
+    async def events():
+        async for event, payload in agent.stream_question(request.question, request.store_id):
+            yield f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/api/v1/analyze/batch", response_model=BatchAnalyzeResponse)
+async def analyze_batch(
+    request: BatchAnalyzeRequest,
+    _: None = Depends(verify_api_key),
+    agent: AnalyticsAgent = Depends(get_agent)
+):
+    """
+    Answer several questions about one store, fetching each kind of data
+    once. Results are in input order; failures are reported per question.
+    """
+    try:
+        results = await agent.process_batch(request.questions, request.store_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing questions: {str(e)}"
+        )
+    
+    return BatchAnalyzeResponse(results=[
+        BatchAnalyzeResult(
+            question=question,
+            answer=result["answer"],
+            confidence=result["confidence"],
+            query_used=result.get("query_used"),
+            metadata=result.get("metadata", {}),
+            error=result.get("metadata", {}).get("error")
+        )
+        for question, result in zip(request.questions, results)
+    ])
+
+@app.get("/api/v1/cache/stats")
+async def cache_stats(
+    _: None = Depends(verify_api_key),
+    agent: AnalyticsAgent = Depends(get_agent)
+):
+    """
+    Hit/miss counters for the agent's caches
+    """
+    return agent.cache_stats()
+
+@app.post("/api/v1/stores/{store_id}/invalidate")
+async def invalidate_store(
+    store_id: str,
+    data_type: Optional[str] = None,
+    _: None = Depends(verify_api_key),
+    agent: AnalyticsAgent = Depends(get_agent)
+):
+    """
+    Drop cached answers and materialized views after a store's data changed,
+    optionally only for one data type (inventory, sales, customers, products)
+    """
+    agent.invalidate_store(store_id, data_type)
+    return {"status": "ok", "store_id": store_id, "data_type": data_type}
+
+@app.post("/api/v1/webhooks/{resource}/{event}")
+async def shopify_webhook(
+    resource: str,
+    event: str,
+    request: Request,
+    x_shopify_hmac_sha256: Optional[str] = Header(None),
+    x_shopify_shop_domain: Optional[str] = Header(None),
+    x_shopify_webhook_id: Optional[str] = Header(None),
+    agent: AnalyticsAgent = Depends(get_agent)
+):
+    """
+    Shopify webhook receiver for orders/create, orders/updated,
+    inventory_levels/update and customers/update. Authenticated by the
+    HMAC signature (SHOPIFY_WEBHOOK_SECRET) rather than X-API-Key.
+    """
+    topic = f"{resource}/{event}"
+    if topic not in WEBHOOK_TOPICS:
+        raise HTTPException(status_code=404, detail=f"Unsupported webhook topic {topic}")
+    body = await request.body()
+    if not verify_webhook(body, x_shopify_hmac_sha256, os.getenv("SHOPIFY_WEBHOOK_SECRET", "")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    if not x_shopify_shop_domain:
+        raise HTTPException(status_code=400, detail="Missing X-Shopify-Shop-Domain")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    
+    # A failure returns 500 so Shopify retries the delivery
+    processed = await agent.handle_webhook(x_shopify_shop_domain, topic, x_shopify_webhook_id, payload)
+    return {"status": "ok" if processed else "duplicate"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
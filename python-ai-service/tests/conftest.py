@@ -0,0 +1,43 @@
+"""
+Shared fixtures: a ShopifyClient wired to an in-process stand-in for the
+Admin API (httpx.MockTransport), so no network or credentials are needed
+"""
+import os
+import sys
+from typing import Awaitable, Callable, Union
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.shopify_client import ShopifyClient  # noqa: E402
+
+STORE_ID = "test-store.myshopify.com"
+API_URL = "https://test-store.myshopify.com/admin/api/2024-01"
+
+Handler = Callable[[httpx.Request], Union[httpx.Response, Awaitable[httpx.Response]]]
+
+
+@pytest.fixture(autouse=True)
+def shopify_env(monkeypatch):
+    """
+    A configured real store with the optional background features off
+    """
+    monkeypatch.setenv("SHOPIFY_ACCESS_TOKEN", "test-token")
+    monkeypatch.setenv("MATERIALIZED_VIEWS_INTERVAL", "0")
+    for name in ("SHOPIFY_API_BASE_URL", "LOCAL_STORE_DIR", "SHOPIFY_DATA_BACKEND", "SHOPIFY_BULK_MODE"):
+        monkeypatch.delenv(name, raising=False)
+
+
+@pytest.fixture
+def make_client():
+    """
+    Build ShopifyClients whose HTTP calls are answered by a handler
+    """
+    def build(handler: Handler, **attributes) -> ShopifyClient:
+        client = ShopifyClient(http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        for name, value in attributes.items():
+            setattr(client, name, value)
+        return client
+    return build
@@ -0,0 +1,252 @@
+"""
+GraphQL bulk operations (start, poll, cancel, JSONL download) against a
+local stand-in for the GraphQL endpoint and the result download
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional
+
+import httpx
+import pytest
+
+from app.bulk_operations import BulkOperationBusy, BulkOperationError, iter_bulk_records
+from tests.conftest import API_URL, STORE_ID
+
+RESULT_URL = "https://storage.example.com/bulk/result.jsonl"
+OPERATION_ID = "gid://shopify/BulkOperation/1"
+
+ORDERS_JSONL = [
+    {"id": "gid://shopify/Order/1", "name": "#1001", "createdAt": "2024-06-01T10:00:00Z",
+     "updatedAt": "2024-06-01T10:00:00Z", "totalPriceSet": {"shopMoney": {"amount": "30.00"}},
+     "customer": {"email": "a@example.com", "firstName": "Ann", "lastName": "Lee"}},
+    {"title": "Beans", "quantity": 2, "originalUnitPriceSet": {"shopMoney": {"amount": "10.00"}},
+     "__parentId": "gid://shopify/Order/1"},
+    {"title": "Mug", "quantity": 1, "originalUnitPriceSet": {"shopMoney": {"amount": "10.00"}},
+     "__parentId": "gid://shopify/Order/1"},
+    {"id": "gid://shopify/Order/2", "name": "#1002", "createdAt": "2024-06-02T10:00:00Z",
+     "updatedAt": "2024-06-02T10:00:00Z", "totalPriceSet": {"shopMoney": {"amount": "5.00"}}, "customer": None},
+    {"title": "Tea", "quantity": 1, "originalUnitPriceSet": {"shopMoney": {"amount": "5.00"}},
+     "__parentId": "gid://shopify/Order/2"},
+    {"id": "gid://shopify/Order/3", "name": "#1003", "createdAt": "2024-06-03T10:00:00Z",
+     "updatedAt": "2024-06-03T10:00:00Z", "totalPriceSet": {"shopMoney": {"amount": "0.00"}}},
+]
+
+
+class BulkStub:
+    """
+    Admin GraphQL endpoint and result storage for one shop. `statuses` are
+    returned by successive polls; the last one repeats.
+    """
+
+    def __init__(
+        self,
+        statuses: List[str],
+        jsonl: Optional[List[Dict[str, Any]]] = None,
+        user_errors: Optional[List[Dict[str, Any]]] = None,
+        error_code: Optional[str] = None,
+        url: Optional[str] = RESULT_URL
+    ):
+        self.statuses = list(statuses)
+        self.jsonl = jsonl if jsonl is not None else ORDERS_JSONL
+        self.user_errors = user_errors or []
+        self.error_code = error_code
+        self.url = url
+        self.started: List[str] = []
+        self.polls = 0
+        self.cancelled: List[str] = []
+        self.rest_requests: List[httpx.Request] = []
+        self.release = asyncio.Event()
+        self.block_polls = False
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        if str(request.url) == RESULT_URL:
+            body = "\n".join(json.dumps(row) for row in self.jsonl) + "\n\n"
+            return httpx.Response(200, text=body)
+        if request.url.path.endswith("/graphql.json"):
+            return await self._graphql(json.loads(request.content))
+        # REST fallback
+        self.rest_requests.append(request)
+        resource = request.url.path.rsplit("/", 1)[-1].removesuffix(".json")
+        return httpx.Response(200, json={resource: [{"id": 99}]}, headers={"X-Shopify-Shop-Api-Call-Limit": "1/40"})
+
+    async def _graphql(self, body: Dict[str, Any]) -> httpx.Response:
+        query = body["query"]
+        if "bulkOperationRunQuery" in query:
+            self.started.append(body["variables"]["query"])
+            operation = None if self.user_errors else {"id": OPERATION_ID, "status": "CREATED"}
+            data = {"bulkOperationRunQuery": {"bulkOperation": operation, "userErrors": self.user_errors}}
+        elif "bulkOperationCancel" in query:
+            self.cancelled.append(body["variables"]["id"])
+            data = {"bulkOperationCancel": {"bulkOperation": {"id": OPERATION_ID, "status": "CANCELING"}, "userErrors": []}}
+        else:
+            self.polls += 1
+            if self.block_polls:
+                await self.release.wait()
+            status = self.statuses[min(self.polls, len(self.statuses)) - 1]
+            node = {"id": OPERATION_ID, "status": status, "errorCode": self.error_code, "objectCount": "6"}
+            node["url"] = self.url if status == "COMPLETED" else None
+            data = {"node": node}
+        return httpx.Response(200, json={"data": data})
+
+
+def _client(make_client, stub: BulkStub, **attributes):
+    return make_client(stub, bulk_poll_interval=0, **attributes)
+
+
+def _collect(pages) -> List[List[Dict[str, Any]]]:
+    async def collect():
+        return [page async for page in pages]
+    return asyncio.run(collect())
+
+
+def test_completed_operation_streams_assembled_orders(make_client):
+    stub = BulkStub(["RUNNING", "RUNNING", "COMPLETED"])
+    client = _client(make_client, stub, page_size=2)
+    pages = _collect(client.bulk_pages(STORE_ID, "orders", "created_at:>='2024-06-01T00:00:00Z'"))
+
+    assert stub.polls == 3
+    assert "created_at:>='2024-06-01T00:00:00Z'" in stub.started[0]
+    assert [len(page) for page in pages] == [2, 1]
+    first, second, third = (order for page in pages for order in page)
+    assert first["id"] == 1 and first["order_number"] == "#1001" and first["total_price"] == "30.00"
+    assert first["line_items"] == [
+        {"title": "Beans", "quantity": 2, "price": "10.00"},
+        {"title": "Mug", "quantity": 1, "price": "10.00"},
+    ]
+    assert first["customer"] == {"email": "a@example.com", "first_name": "Ann", "last_name": "Lee"}
+    assert second["customer"] is None and second["line_items"][0]["title"] == "Tea"
+    assert third["line_items"] == []
+
+
+def test_completed_without_results_yields_nothing(make_client):
+    stub = BulkStub(["COMPLETED"], url=None)
+    assert _collect(_client(make_client, stub).bulk_pages(STORE_ID, "orders")) == []
+
+
+@pytest.mark.parametrize("status", ["FAILED", "CANCELED", "EXPIRED"])
+def test_unsuccessful_status_raises(make_client, status):
+    stub = BulkStub(["RUNNING", status], error_code="INTERNAL_SERVER_ERROR")
+    with pytest.raises(BulkOperationError, match=status.lower()) as raised:
+        _collect(_client(make_client, stub).bulk_pages(STORE_ID, "orders"))
+    assert "INTERNAL_SERVER_ERROR" in str(raised.value)
+    assert stub.cancelled == []
+
+
+def test_user_errors_raise(make_client):
+    stub = BulkStub(["COMPLETED"], user_errors=[{"field": ["query"], "message": "Invalid bulk query"}])
+    with pytest.raises(BulkOperationError, match="Invalid bulk query") as raised:
+        _collect(_client(make_client, stub).bulk_pages(STORE_ID, "orders"))
+    assert not isinstance(raised.value, BulkOperationBusy)
+    assert stub.polls == 0
+
+
+def test_graphql_errors_raise(make_client):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={"errors": [{"message": "Access denied"}]})
+
+    with pytest.raises(BulkOperationError, match="Access denied"):
+        _collect(make_client(handler).bulk_pages(STORE_ID, "orders"))
+
+
+def test_operation_running_elsewhere_falls_back_to_rest(make_client):
+    stub = BulkStub(["COMPLETED"], user_errors=[
+        {"field": None, "message": "A bulk query operation for this app and shop is already in progress"}
+    ])
+    client = _client(make_client, stub, bulk_mode="always")
+    pages = _collect(client._remote_order_pages(STORE_ID, {}))
+
+    assert pages == [[{"id": 99}]]
+    assert stub.rest_requests[0].url.path == "/admin/api/2024-01/orders.json"
+
+
+def test_concurrent_fetches_for_one_store_share_the_bulk_slot(make_client):
+    stub = BulkStub(["COMPLETED"])
+    stub.block_polls = True
+    client = _client(make_client, stub, bulk_mode="always")
+
+    async def run():
+        first = asyncio.create_task(_drain(client._remote_order_pages(STORE_ID, {})))
+        while stub.polls == 0:
+            await asyncio.sleep(0)
+        # The store's bulk slot is taken: the second fetch goes over REST
+        second = await _drain(client._remote_customer_pages(STORE_ID, {}))
+        stub.release.set()
+        return await first, second
+
+    first, second = asyncio.run(run())
+    assert len(stub.started) == 1
+    assert [order["id"] for page in first for order in page] == [1, 2, 3]
+    assert second == [[{"id": 99}]]
+    assert [request.url.path for request in stub.rest_requests] == ["/admin/api/2024-01/customers.json"]
+
+
+def test_cancelled_request_cancels_the_operation(make_client):
+    stub = BulkStub(["RUNNING"])
+    stub.block_polls = True
+    client = _client(make_client, stub)
+
+    async def run():
+        task = asyncio.create_task(_drain(client.bulk_pages(STORE_ID, "orders")))
+        while stub.polls == 0:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The slot is free again afterwards
+        assert not client._bulk_locks[STORE_ID].locked()
+
+    asyncio.run(run())
+    assert stub.cancelled == [OPERATION_ID]
+
+
+def test_timeout_cancels_the_operation(make_client):
+    stub = BulkStub(["RUNNING"])
+    client = _client(make_client, stub, bulk_timeout=0)
+    with pytest.raises(BulkOperationError, match="timed out"):
+        _collect(client.bulk_pages(STORE_ID, "orders"))
+    assert stub.cancelled == [OPERATION_ID]
+
+
+def test_jsonl_customers_and_inventory_levels():
+    customers = [
+        {"id": "gid://shopify/Customer/7", "email": "c@example.com", "firstName": "Cy", "lastName": "Ng",
+         "numberOfOrders": "3", "amountSpent": {"amount": "42.50"}, "createdAt": "2024-01-01T00:00:00Z"},
+        {"id": "gid://shopify/Customer/8", "email": None, "numberOfOrders": None, "amountSpent": None},
+    ]
+    levels = [
+        {"id": "gid://shopify/InventoryItem/5", "variant": {"product": {"title": "Beans"}}},
+        {"location": {"id": "gid://shopify/Location/9"}, "__parentId": "gid://shopify/InventoryItem/5",
+         "quantities": [{"name": "available", "quantity": 4}, {"name": "incoming", "quantity": 2},
+                        {"name": "committed", "quantity": 1}]},
+        {"id": "gid://shopify/InventoryItem/6", "variant": None},
+        {"location": {"id": "gid://shopify/Location/9"}, "__parentId": "gid://shopify/InventoryItem/6",
+         "quantities": []},
+        # A child whose parent is not current is skipped
+        {"location": {"id": "gid://shopify/Location/9"}, "__parentId": "gid://shopify/InventoryItem/5"},
+    ]
+
+    async def parse(rows, resource):
+        async def lines():
+            for row in rows:
+                yield json.dumps(row)
+                yield ""
+        return [record async for page in iter_bulk_records(lines(), resource, 10) for record in page]
+
+    parsed_customers = asyncio.run(parse(customers, "customers"))
+    assert parsed_customers[0] == {
+        "id": 7, "email": "c@example.com", "first_name": "Cy", "last_name": "Ng", "orders_count": 3,
+        "total_spent": "42.50", "created_at": "2024-01-01T00:00:00Z", "updated_at": None,
+    }
+    assert parsed_customers[1]["orders_count"] == 0 and parsed_customers[1]["total_spent"] == "0.00"
+
+    parsed_levels = asyncio.run(parse(levels, "inventory_levels"))
+    assert parsed_levels == [
+        {"inventory_item_id": 5, "location_id": 9, "available": 4, "incoming": 2, "committed": 1,
+         "product_title": "Beans"},
+        {"inventory_item_id": 6, "location_id": 9, "available": 0, "incoming": 0, "committed": 0,
+         "product_title": "Unknown"},
+    ]
+
+
+async def _drain(pages) -> List[List[Dict[str, Any]]]:
+    return [page async for page in pages]
@@ -0,0 +1,61 @@
+"""
+Columnar sales totals against the dict-based aggregate
+"""
+import pickle
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.aggregates import SalesAggregate
+from app.columnar import ColumnarSalesAggregate, SalesColumns
+
+
+def _orders(seed: int, count: int) -> list:
+    rng = random.Random(seed)
+    return [
+        {
+            "total_price": f"{rng.randint(100, 50000) / 100:.2f}",
+            "line_items": [
+                {"title": f"Product {rng.randint(0, 30)}", "quantity": rng.randint(1, 4)}
+                for _ in range(rng.randint(0, 3))
+            ],
+        }
+        for _ in range(count)
+    ]
+
+
+def test_paged_and_merged_totals_match_the_dict_aggregate():
+    orders = _orders(1, 600)
+    expected = SalesAggregate(0).update(orders).finalize({})
+
+    first = ColumnarSalesAggregate()
+    for start in range(0, 300, 100):
+        first.update(orders[start:start + 100])
+    # Shards come back pickled from worker processes
+    second = pickle.loads(pickle.dumps(ColumnarSalesAggregate().update(orders[300:])))
+    insights = first.merge(second).finalize({})
+
+    assert insights["total_orders"] == expected["total_orders"]
+    assert insights["total_revenue"] == pytest.approx(expected["total_revenue"])
+    assert insights["top_products"] == expected["top_products"]
+
+
+def test_totals_hold_one_entry_per_product_not_per_line_item():
+    columns = SalesColumns.from_orders(_orders(2, 2000))
+    assert columns.count == 2000
+    assert len(columns.quantities) == len(columns.titles) <= 31
+
+
+def test_appended_leaves_the_cached_totals_unchanged():
+    columns = SalesColumns.from_orders(_orders(3, 50))
+    before = columns.quantities.copy()
+    new = {"total_price": "5.00", "line_items": [{"title": "New product", "quantity": 7}]}
+
+    appended = columns.appended([new])
+
+    assert (columns.quantities == before).all() and columns.count == 50
+    assert appended.count == 51
+    assert appended.revenue_cents == columns.revenue_cents + 500
+    assert appended.quantities[appended.titles.index("New product")] == 7
@@ -0,0 +1,26 @@
+"""
+Keyword intent classification
+"""
+import pytest
+
+from app.intent_classifier import IntentClassifier
+
+
+@pytest.mark.parametrize("question", [
+    "What were my top ten products last week?",
+    "What were my top 10 products last week?",
+    "Top twenty selling products this month",
+    "Which are my least popular products?",
+    "What are my most popular products?",
+    "What were my worst selling products?",
+    "Show my bottom sellers",
+])
+def test_product_ranking_questions_are_sales(question):
+    assert IntentClassifier().classify(question)["intent_type"] == "sales"
+
+
+def test_spelled_out_and_digit_counts_score_alike():
+    classifier = IntentClassifier()
+    words = classifier.classify("What were my top ten products last week?")
+    digits = classifier.classify("What were my top 10 products last week?")
+    assert words["confidence_score"] == digits["confidence_score"]
@@ -0,0 +1,68 @@
+"""
+Materialized view refresh and invalidation
+"""
+import asyncio
+
+from app.materialized import MaterializedViews, _template_view
+
+STORE = "test-store.myshopify.com"
+INTENT = {"intent_type": "sales", "time_period": "last 7 days"}
+VIEW = _template_view("top_products_7d", "What were my top 5 selling products in the last 7 days?", INTENT)
+
+
+def test_refresh_serves_the_view():
+    async def fetch(store_id, intent, query):
+        return {"type": "sales", "insights": {"total_orders": 3}}
+
+    async def run():
+        views = MaterializedViews(fetch, definitions=(VIEW,))
+        await views.refresh(STORE)
+        return views.get(STORE, dict(INTENT), VIEW.query)
+
+    assert asyncio.run(run())["insights"]["total_orders"] == 3
+
+
+def test_refresh_finishing_after_invalidate_is_discarded():
+    async def run():
+        fetching = asyncio.Event()
+        release = asyncio.Event()
+
+        async def fetch(store_id, intent, query):
+            fetching.set()
+            await release.wait()
+            return {"type": "sales", "insights": {"total_orders": 3}}
+
+        views = MaterializedViews(fetch, definitions=(VIEW,))
+        refresh = asyncio.create_task(views.refresh(STORE))
+        await fetching.wait()
+        views.invalidate(STORE, "sales")
+        release.set()
+        await refresh
+        stale = views.get(STORE, dict(INTENT), VIEW.query)
+
+        fetching.clear()
+        await views.refresh(STORE)
+        return stale, views.get(STORE, dict(INTENT), VIEW.query)
+
+    stale, fresh = asyncio.run(run())
+    assert stale is None
+    assert fresh is not None
+
+
+def test_invalidating_another_type_keeps_the_refresh():
+    async def run():
+        release = asyncio.Event()
+
+        async def fetch(store_id, intent, query):
+            await release.wait()
+            return {"type": "sales"}
+
+        views = MaterializedViews(fetch, definitions=(VIEW,))
+        refresh = asyncio.create_task(views.refresh(STORE))
+        await asyncio.sleep(0)
+        views.invalidate(STORE, "inventory")
+        release.set()
+        await refresh
+        return views.get(STORE, dict(INTENT), VIEW.query)
+
+    assert asyncio.run(run()) is not None
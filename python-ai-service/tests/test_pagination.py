@@ -0,0 +1,129 @@
+"""
+REST cursor pagination (Link: rel="next" page_info) against a local stub
+"""
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from tests.conftest import API_URL, STORE_ID
+
+
+class PagedResource:
+    """
+    Serves fixed pages of one resource the way Shopify does: filters on the
+    first request only, then opaque page_info cursors in the Link header
+    """
+
+    def __init__(self, resource: str, pages: List[List[Dict[str, Any]]], with_previous: bool = False):
+        self.resource = resource
+        self.pages = pages
+        self.with_previous = with_previous
+        self.requests: List[httpx.Request] = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        cursor = request.url.params.get("page_info")
+        index = int(cursor.removeprefix("cursor-")) if cursor else 0
+        links = []
+        if self.with_previous and index > 0:
+            links.append(f'<{API_URL}/{self.resource}.json?limit=2&page_info=cursor-{index - 1}>; rel="previous"')
+        if index + 1 < len(self.pages):
+            links.append(f'<{API_URL}/{self.resource}.json?limit=2&page_info=cursor-{index + 1}>; rel="next"')
+        headers = {"X-Shopify-Shop-Api-Call-Limit": "1/40"}
+        if links:
+            headers["Link"] = ", ".join(links)
+        return httpx.Response(200, json={self.resource: self.pages[index]}, headers=headers)
+
+
+def _collect(client, resource: str, params: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    async def collect():
+        try:
+            return [page async for page in client.iter_pages(STORE_ID, resource, params)]
+        finally:
+            await client.aclose()
+    return asyncio.run(collect())
+
+
+def test_follows_next_links_until_the_final_page(make_client):
+    stub = PagedResource("orders", [[{"id": 1}, {"id": 2}], [{"id": 3}, {"id": 4}], [{"id": 5}]])
+    pages = _collect(make_client(stub, page_size=2), "orders", {"status": "any", "created_at_min": "2024-01-01"})
+
+    assert [[order["id"] for order in page] for page in pages] == [[1, 2], [3, 4], [5]]
+    # The final page has no next link, so nothing is requested after it
+    assert len(stub.requests) == 3
+
+
+def test_filters_are_sent_only_with_the_first_request(make_client):
+    stub = PagedResource("orders", [[{"id": 1}], [{"id": 2}]])
+    _collect(make_client(stub), "orders", {"status": "any", "fields": "id"})
+
+    first, second = (dict(request.url.params) for request in stub.requests)
+    assert first["status"] == "any" and first["fields"] == "id" and first["limit"] == "250"
+    assert second == {"limit": "2", "page_info": "cursor-1"}
+    assert all(request.headers["X-Shopify-Access-Token"] == "test-token" for request in stub.requests)
+
+
+def test_empty_page_between_pages_does_not_stop_pagination(make_client):
+    stub = PagedResource("customers", [[{"id": 1}], [], [{"id": 2}]])
+    pages = _collect(make_client(stub), "customers")
+
+    assert pages == [[{"id": 1}], [], [{"id": 2}]]
+    assert len(stub.requests) == 3
+
+
+def test_empty_store_yields_one_empty_page(make_client):
+    stub = PagedResource("orders", [[]])
+    pages = _collect(make_client(stub), "orders")
+
+    assert pages == [[]]
+    assert len(stub.requests) == 1
+
+
+def test_previous_link_is_ignored(make_client):
+    stub = PagedResource("products", [[{"id": 1}], [{"id": 2}], [{"id": 3}]], with_previous=True)
+    pages = _collect(make_client(stub), "products")
+
+    assert [page[0]["id"] for page in pages] == [1, 2, 3]
+    assert [request.url.params.get("page_info") for request in stub.requests] == [None, "cursor-1", "cursor-2"]
+
+
+def test_missing_resource_key_is_an_empty_page(make_client):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json={}, headers={"X-Shopify-Shop-Api-Call-Limit": "1/40"})
+
+    assert _collect(make_client(handler), "orders") == [[]]
+
+
+def test_http_errors_are_raised(make_client):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(404, json={"errors": "Not Found"})
+
+    try:
+        _collect(make_client(handler), "orders")
+    except httpx.HTTPStatusError as e:
+        assert e.response.status_code == 404
+    else:
+        raise AssertionError("expected HTTPStatusError")
+
+
+def test_fetch_streams_every_page_into_the_insights(make_client):
+    orders = [
+        {"id": index, "total_price": "10.00", "created_at": "2024-06-01T12:00:00Z",
+         "line_items": [{"title": "Beans", "quantity": 1, "price": "10.00"}],
+         "customer": {"email": f"c{index}@example.com"}}
+        for index in range(1, 6)
+    ]
+    stub = PagedResource("orders", [orders[:2], [], orders[2:4], orders[4:]])
+    client = make_client(stub, page_size=2, bulk_mode="never")
+
+    async def fetch():
+        try:
+            return await client.fetch_data(STORE_ID, {"intent_type": "sales"})
+        finally:
+            await client.aclose()
+    data = asyncio.run(fetch())
+
+    assert data["type"] == "sales"
+    assert data["insights"]["total_orders"] == 5
+    assert len(stub.requests) == 4
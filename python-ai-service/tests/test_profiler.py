@@ -0,0 +1,34 @@
+"""
+Stack capture for request profiles
+"""
+import sys
+
+from app.profiler import _stack
+
+
+class _Code:
+    """
+    A code object as Python 3.9 and 3.10 have it, without co_qualname
+    """
+    co_name = "handler"
+    co_filename = "/srv/app/handlers.py"
+    co_firstlineno = 12
+
+
+class _Frame:
+    def __init__(self, code, back=None):
+        self.f_code = code
+        self.f_back = back
+
+
+def test_stack_falls_back_to_co_name():
+    assert _stack(_Frame(_Code())) == (("handler", "/srv/app/handlers.py", 12),)
+
+
+def test_stack_is_outermost_first():
+    def inner():
+        return _stack(sys._getframe())
+
+    names = [name for name, _, _ in inner()]
+    assert names[-1].endswith("inner")
+    assert names.index("test_stack_is_outermost_first") < len(names) - 1
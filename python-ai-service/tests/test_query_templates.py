@@ -0,0 +1,46 @@
+"""
+Template queries for ranking questions
+"""
+from app.materialized import DEFAULT_VIEWS, _view_key
+from app.query_templates import render_query
+
+SALES = {"intent_type": "sales", "time_period": "last 30 days"}
+CUSTOMERS = {"intent_type": "customers", "time_period": None}
+
+
+def _order_by(query: str) -> str:
+    return next(line for line in query.splitlines() if line.startswith("ORDER BY"))
+
+
+def test_worst_and_least_rank_products_ascending():
+    for question in [
+        "What were my worst 5 selling products last 30 days?",
+        "Which are my least popular products?",
+        "Show the bottom 5 products",
+    ]:
+        assert _order_by(render_query(question, SALES)) == "ORDER BY total_sold ASC", question
+
+
+def test_best_sellers_rank_descending():
+    query = render_query("What were my top 5 selling products last 30 days?", SALES)
+    assert _order_by(query) == "ORDER BY total_sold DESC"
+
+
+def test_worst_sellers_are_not_served_from_the_best_seller_view():
+    query = render_query("What were my worst 5 selling products in the last 30 days?", SALES)
+    view_keys = {_view_key(view.intent, view.query) for view in DEFAULT_VIEWS}
+    assert _view_key(SALES, query) not in view_keys
+
+
+def test_customers_rank_by_order_count_when_asked():
+    query = render_query("Top 5 customers by number of orders", CUSTOMERS)
+    assert _order_by(query) == "ORDER BY order_count DESC"
+    query = render_query("Which top customers placed the most orders?", CUSTOMERS)
+    assert _order_by(query) == "ORDER BY order_count DESC"
+
+
+def test_customers_rank_by_spend_by_default():
+    query = render_query("Who are my top 5 customers?", CUSTOMERS)
+    assert _order_by(query) == "ORDER BY total_spent DESC"
+    query = render_query("Top customers with at least 3 orders", CUSTOMERS)
+    assert _order_by(query) == "ORDER BY total_spent DESC"
@@ -0,0 +1,40 @@
+"""
+REST bucket pacing learned from X-Shopify-Shop-Api-Call-Limit
+"""
+import asyncio
+
+import httpx
+
+from app.rate_limiter import ShopifyRequestScheduler
+
+
+def _send(scheduler: ShopifyRequestScheduler, call_limit: str) -> None:
+    async def send() -> httpx.Response:
+        return httpx.Response(200, headers={"X-Shopify-Shop-Api-Call-Limit": call_limit})
+    asyncio.run(scheduler.request("store", send))
+
+
+def test_leak_rate_follows_the_learned_capacity(monkeypatch):
+    monkeypatch.delenv("SHOPIFY_REST_LEAK_RATE", raising=False)
+    scheduler = ShopifyRequestScheduler()
+    assert scheduler._bucket("store", "rest").leak_rate == 2.0
+
+    _send(scheduler, "1/400")
+    bucket = scheduler._bucket("store", "rest")
+    assert (bucket.capacity, bucket.leak_rate) == (400.0, 20.0)
+
+
+def test_plus_store_near_capacity_waits_at_the_plus_rate(monkeypatch):
+    monkeypatch.delenv("SHOPIFY_REST_LEAK_RATE", raising=False)
+    scheduler = ShopifyRequestScheduler(headroom=0.9)
+    _send(scheduler, "360/400")
+    # Full to the headroom: one more call waits for one request to leak at 20/s
+    wait = scheduler._bucket("store", "rest").reserve(1, scheduler.headroom)
+    assert 0 < wait <= 0.05 + 1e-6
+
+
+def test_configured_leak_rate_overrides_the_derived_one(monkeypatch):
+    monkeypatch.setenv("SHOPIFY_REST_LEAK_RATE", "4")
+    scheduler = ShopifyRequestScheduler()
+    _send(scheduler, "1/400")
+    assert scheduler._bucket("store", "rest").leak_rate == 4.0
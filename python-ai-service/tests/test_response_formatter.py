@@ -0,0 +1,67 @@
+"""
+Answers built from executed query rows
+"""
+from app.response_formatter import ResponseFormatter
+from app.shopifyql import parse, plan
+
+
+def _query_result(query: str, columns: list, rows: list) -> dict:
+    return {
+        "columns": columns,
+        "measures": plan(parse(query)).measures,
+        "rows": rows,
+        "row_count": len(rows),
+    }
+
+
+def test_ranking_units_follow_the_aggregated_column_not_the_alias():
+    result = _query_result(
+        "FROM orders GROUP BY product_title SELECT product_title, SUM(quantity) AS total_sold",
+        ["product_title", "total_sold"],
+        [["Mug", 4], ["Tea", 2]],
+    )
+    formatter = ResponseFormatter(None)
+    pairs, metric = formatter._query_ranking(result, "product_title")
+    assert formatter._format_ranking(pairs, metric) == "Mug (4 units), Tea (2 units)"
+
+
+def test_ranking_by_money_or_count_uses_a_readable_label():
+    formatter = ResponseFormatter(None)
+    revenue = _query_result(
+        "FROM orders GROUP BY product_title SELECT product_title, SUM(total_price) AS total_revenue",
+        ["product_title", "total_revenue"],
+        [["Mug", 1234.5]],
+    )
+    pairs, metric = formatter._query_ranking(revenue, "product_title")
+    assert formatter._format_ranking(pairs, metric) == "Mug (total revenue: $1,234.50)"
+
+    orders = _query_result(
+        "FROM orders GROUP BY product_title SELECT product_title, COUNT(*)",
+        ["product_title", "COUNT(*)"],
+        [["Mug", 3]],
+    )
+    pairs, metric = formatter._query_ranking(orders, "product_title")
+    assert formatter._format_ranking(pairs, metric) == "Mug (count: 3)"
+
+
+def test_customer_answer_comes_from_the_query_rows():
+    result = _query_result(
+        "FROM orders GROUP BY customer_email HAVING COUNT(*) > 1 "
+        "SELECT customer_email, customer_name, COUNT(*) AS order_count",
+        ["customer_email", "customer_name", "order_count"],
+        [["a@example.com", "Ann", 3], ["b@example.com", None, 2]],
+    )
+    formatter = ResponseFormatter(None)
+    customers = formatter._query_customers(result)
+    assert [formatter._customer_label(c) for c in customers] == [
+        "Ann (3 orders)", "b@example.com (2 orders)"
+    ]
+
+
+def test_non_customer_query_lists_no_customers():
+    result = _query_result(
+        "FROM orders SELECT SUM(total_price) AS total_revenue",
+        ["total_revenue"],
+        [[10.0]],
+    )
+    assert ResponseFormatter(None)._query_customers(result) is None
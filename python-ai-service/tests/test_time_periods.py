@@ -0,0 +1,41 @@
+"""
+Time period resolution and the shared number words
+"""
+from datetime import datetime, timedelta, timezone
+
+from app.cache import normalize_question
+from app.time_periods import DateRange, padded_bounds, period_key, resolve_period
+
+NOW = datetime(2024, 6, 12, 15, 30, tzinfo=timezone.utc)
+
+
+def test_last_n_days_is_n_days_ending_with_today():
+    window = resolve_period("last 7 days", timezone.utc, NOW)
+    assert window == DateRange(
+        datetime(2024, 6, 6, tzinfo=timezone.utc), datetime(2024, 6, 13, tzinfo=timezone.utc)
+    )
+    assert window.end - window.start == timedelta(days=7)
+
+
+def test_last_n_days_in_the_store_timezone():
+    tz = timezone(timedelta(hours=-5))
+    window = resolve_period("past 30 days", tz, NOW)
+    assert window.end - window.start == timedelta(days=30)
+    assert window.end == datetime(2024, 6, 13, 5, tzinfo=timezone.utc)
+
+
+def test_spelled_out_counts_match_digits():
+    for word, digits in [("eight", 8), ("twelve", 12), ("fifteen", 15), ("twenty", 20), ("forty", 40)]:
+        assert period_key(f"last {word} days") == period_key(f"last {digits} days")
+        assert normalize_question(f"top {word} products") == normalize_question(f"top {digits} products")
+
+
+def test_last_week_is_the_previous_calendar_week():
+    assert period_key("last week") != period_key("last 7 days")
+    assert resolve_period("last week", timezone.utc, NOW).start == datetime(2024, 6, 3, tzinfo=timezone.utc)
+
+
+def test_padded_bounds_widen_each_given_bound_by_a_day():
+    start = datetime(2024, 6, 6, tzinfo=timezone.utc)
+    assert padded_bounds(start, None) == ("2024-06-05T00:00:00Z", None)
+    assert padded_bounds(None, start) == (None, "2024-06-07T00:00:00Z")